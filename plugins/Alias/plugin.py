@@ -271,12 +271,14 @@ class Alias(callbacks.Plugin):
         conf.registerGlobalValue(aliasGroup.get(name), 'locked',
                                  registry.Boolean(lock, ''))
         self.aliases[name] = [alias, lock, f]
+        callbacks.commandsChanged()
 
     def removeAlias(self, name, evenIfLocked=False):
         name = callbacks.canonicalName(name)
         if name in self.aliases and self.isCommandMethod(name):
             if evenIfLocked or not self.aliases[name][1]:
                 del self.aliases[name]
+                callbacks.commandsChanged()
                 conf.supybot.plugins.Alias.aliases.unregister(name)
             else:
                 raise AliasError, 'That alias is locked.'
@@ -30,7 +30,8 @@
 
 import os
 import time
-from cStringIO import StringIO
+import Queue
+import threading
 
 import supybot.conf as conf
 import supybot.world as world
@@ -40,64 +41,158 @@ import supybot.ircutils as ircutils
 import supybot.registry as registry
 import supybot.callbacks as callbacks
 
-class FakeLog(object):
+def nextChange(format, now):
+    """Returns the first time after now at which time.strftime(format) will
+    give something different, or the next midnight if it won't change before
+    then.  Only the starts of seconds, minutes, hours and days are checked,
+    since that's when the fields of a timestamp change."""
+    current = time.strftime(format, time.localtime(now))
+    (year, month, day, hour, minute) = time.localtime(now)[:5]
+    midnight = time.mktime((year, month, day + 1, 0, 0, 0, 0, 0, -1))
+    for t in (int(now) + 1,
+              time.mktime((year, month, day, hour, minute + 1, 0, 0, 0, -1)),
+              time.mktime((year, month, day, hour + 1, 0, 0, 0, 0, -1))):
+        if time.strftime(format, time.localtime(t)) != current:
+            return t
+    return midnight
+
+
+class LogWriter(world.SupyThread):
+    """Writes the lines ChannelLogger logs, so the disk is never touched on
+    the thread dispatching messages.  Lines queued for the same file while
+    it was busy are written to it together."""
+    def __init__(self, log):
+        world.SupyThread.__init__(self, name='ChannelLogger')
+        self.setDaemon(True)
+        self.log = log
+        self.queue = Queue.Queue()
+        self.files = {}
+
+    def write(self, filename, s, flush=False):
+        self.queue.put(('write', filename, (s, flush)))
+
+    def close(self, filename):
+        self.queue.put(('close', filename, None))
+
     def flush(self):
-        return
-    def close(self):
-        return
-    def write(self, s):
-        return
+        """Flushes all the open logs, once everything queued before has been
+        written."""
+        done = threading.Event()
+        self.queue.put(('flush', None, done))
+        while not done.isSet() and self.isAlive():
+            done.wait(1)
+
+    def stop(self):
+        """Writes everything queued, closes all the logs and stops."""
+        done = threading.Event()
+        self.queue.put(('stop', None, done))
+        while not done.isSet() and self.isAlive():
+            done.wait(1)
+
+    def run(self):
+        while True:
+            items = [self.queue.get()]
+            try:
+                while True:
+                    items.append(self.queue.get_nowait())
+            except Queue.Empty:
+                pass
+            if not self._handle(items):
+                return
+
+    def _handle(self, items):
+        pending = {}
+        for (action, filename, arg) in items:
+            if action == 'write':
+                (s, flush) = arg
+                lines = pending.setdefault(filename, [[], False])
+                lines[0].append(s)
+                lines[1] = lines[1] or flush
+                continue
+            self._writeAll(pending)
+            pending.clear()
+            if action == 'close':
+                if filename in self.files:
+                    self._call(self.files.pop(filename).close)
+            elif action == 'flush':
+                for fd in self.files.itervalues():
+                    self._call(fd.flush)
+                arg.set()
+            elif action == 'stop':
+                for fd in self.files.itervalues():
+                    self._call(fd.close)
+                self.files.clear()
+                arg.set()
+                return False
+        self._writeAll(pending)
+        return True
+
+    def _call(self, f):
+        try:
+            f()
+        except Exception:
+            self.log.exception('Error in %s:', f)
+
+    def _writeAll(self, pending):
+        for (filename, (lines, flush)) in pending.iteritems():
+            try:
+                fd = self.files[filename]
+            except KeyError:
+                try:
+                    dirname = os.path.dirname(filename)
+                    if not os.path.exists(dirname):
+                        os.makedirs(dirname)
+                    fd = self.files[filename] = file(filename, 'a')
+                except Exception:
+                    self.log.exception('Error opening log:')
+                    continue
+            # Anything escaping from here would kill the thread, and leave
+            # the lines queued after these unwritten.
+            try:
+                fd.write(''.join(lines))
+                if flush:
+                    fd.flush()
+            except Exception:
+                self.log.exception('Error writing %s:', filename)
+
+
+class ChannelConfig(object):
+    """The configuration ChannelLogger needs for each line logged in a
+    channel, read once and kept until the registry changes or the name of the
+    channel's log does (at deadline)."""
+    __slots__ = ('enable', 'timestamp', 'timestampFormat', 'stripFormatting',
+                 'noLogPrefix', 'flushImmediately', 'filename', 'deadline',
+                 'generation')
+
 
 class ChannelLogger(callbacks.Plugin):
     noIgnore = True
     def __init__(self, irc):
         self.__parent = super(ChannelLogger, self)
         self.__parent.__init__(irc)
-        self.lastMsgs = {}
-        self.lastStates = {}
-        self.logs = {}
+        self.configs = {} # (network, channel) -> ChannelConfig.
+        self.lastTimestamp = (None, '')
+        self.writer = LogWriter(self.log)
+        self.writer.start()
         self.flusher = self.flush
         world.flushers.append(self.flusher)
 
     def die(self):
-        for log in self._logs():
-            log.close()
         world.flushers = [x for x in world.flushers if x is not self.flusher]
-
-    def __call__(self, irc, msg):
-        try:
-            # I don't know why I put this in, but it doesn't work, because it
-            # doesn't call doNick or doQuit.
-            # if msg.args and irc.isChannel(msg.args[0]):
-            self.__parent.__call__(irc, msg)
-            if irc in self.lastMsgs:
-                if irc not in self.lastStates:
-                    self.lastStates[irc] = irc.state.copy()
-                self.lastStates[irc].addMsg(irc, self.lastMsgs[irc])
-        finally:
-            # We must make sure this always gets updated.
-            self.lastMsgs[irc] = msg
+        self.writer.stop()
 
     def reset(self):
-        for log in self._logs():
-            log.close()
-        self.logs.clear()
-        self.lastMsgs.clear()
-        self.lastStates.clear()
-
-    def _logs(self):
-        for logs in self.logs.itervalues():
-            for log in logs.itervalues():
-                yield log
+        for config in self.configs.itervalues():
+            self.writer.close(config.filename)
+        self.configs.clear()
 
     def flush(self):
-        self.checkLogNames()
-        for log in self._logs():
-            try:
-                log.flush()
-            except ValueError, e:
-                if e.args[0] != 'I/O operation on a closed file':
-                    self.log.exception('Odd exception:')
+        # Close the logs of channels that have rotated since they last logged.
+        now = time.time()
+        for ((network, channel), config) in self.configs.items():
+            if now >= config.deadline:
+                self.getConfig(network, channel, now)
+        world.write(self.writer.flush)
 
     def logNameTimestamp(self, channel):
         format = self.registryValue('filenameTimestamp', channel)
@@ -109,78 +204,83 @@ class ChannelLogger(callbacks.Plugin):
         else:
             return '%s.log' % channel
 
-    def getLogDir(self, irc, channel):
+    def getLogDir(self, network, channel):
         logDir = conf.supybot.directories.log.dirize(self.name())
         if self.registryValue('directories'):
             if self.registryValue('directories.network'):
-                logDir = os.path.join(logDir,  irc.network)
+                logDir = os.path.join(logDir, network)
             if self.registryValue('directories.channel'):
                 logDir = os.path.join(logDir, channel)
             if self.registryValue('directories.timestamp'):
                 format = self.registryValue('directories.timestamp.format')
                 timeDir =time.strftime(format)
                 logDir = os.path.join(logDir, timeDir)
-        if not os.path.exists(logDir):
-            os.makedirs(logDir)
         return logDir
 
-    def checkLogNames(self):
-        for (irc, logs) in self.logs.items():
-            for (channel, log) in logs.items():
-                if self.registryValue('rotateLogs', channel):
-                    name = self.getLogName(channel)
-                    if name != log.name:
-                        log.close()
-                        del logs[channel]
-
-    def getLog(self, irc, channel):
-        self.checkLogNames()
-        try:
-            logs = self.logs[irc]
-        except KeyError:
-            logs = ircutils.IrcDict()
-            self.logs[irc] = logs
-        if channel in logs:
-            return logs[channel]
-        else:
-            try:
-                name = self.getLogName(channel)
-                logDir = self.getLogDir(irc, channel)
-                log = file(os.path.join(logDir, name), 'a')
-                logs[channel] = log
-                return log
-            except IOError:
-                self.log.exception('Error opening log:')
-                return FakeLog()
-
-    def timestamp(self, log):
-        format = conf.supybot.log.timestampFormat()
-        if format:
-            log.write(time.strftime(format))
-            log.write('  ')
+    def getDeadline(self, channel, now):
+        formats = []
+        if self.registryValue('rotateLogs', channel):
+            formats.append(self.registryValue('filenameTimestamp', channel))
+        if self.registryValue('directories') and \
+           self.registryValue('directories.timestamp'):
+            formats.append(self.registryValue('directories.timestamp.format'))
+        deadline = float('inf')
+        for format in formats:
+            deadline = min(deadline, nextChange(format, now))
+        return deadline
+
+    def getConfig(self, network, channel, now=None):
+        if now is None:
+            now = time.time()
+        key = (network, channel)
+        old = self.configs.get(key)
+        if old is not None and old.generation == registry.generation and \
+           now < old.deadline:
+            return old
+        config = ChannelConfig()
+        config.generation = registry.generation
+        config.enable = self.registryValue('enable', channel)
+        config.timestamp = self.registryValue('timestamp', channel)
+        config.timestampFormat = conf.supybot.log.timestampFormat()
+        config.stripFormatting = self.registryValue('stripFormatting',
+                                                    channel)
+        config.noLogPrefix = self.registryValue('noLogPrefix', channel)
+        config.flushImmediately = self.registryValue('flushImmediately')
+        config.deadline = self.getDeadline(channel, now)
+        config.filename = os.path.join(self.getLogDir(network, channel),
+                                       self.getLogName(channel))
+        if old is not None and old.filename != config.filename:
+            self.writer.close(old.filename)
+        self.configs[key] = config
+        return config
+
+    def timestamp(self, format):
+        now = int(time.time())
+        if self.lastTimestamp[0] != (now, format):
+            self.lastTimestamp = ((now, format), time.strftime(format) + '  ')
+        return self.lastTimestamp[1]
 
     def normalizeChannel(self, irc, channel):
         return ircutils.toLower(channel)
 
     def doLog(self, irc, channel, s, *args):
-        if not self.registryValue('enable', channel):
+        channel = self.normalizeChannel(irc, channel)
+        config = self.getConfig(irc.network, channel)
+        if not config.enable:
             return
         s = format(s, *args)
-        channel = self.normalizeChannel(irc, channel)
-        log = self.getLog(irc, channel)
-        if self.registryValue('timestamp', channel):
-            self.timestamp(log)
-        if self.registryValue('stripFormatting', channel):
+        if config.stripFormatting:
             s = ircutils.stripFormatting(s)
-        log.write(s)
-        if self.registryValue('flushImmediately'):
-            log.flush()
+        if config.timestamp and config.timestampFormat:
+            s = self.timestamp(config.timestampFormat) + s
+        self.writer.write(config.filename, s, config.flushImmediately)
 
     def doPrivmsg(self, irc, msg):
         (recipients, text) = msg.args
         for channel in recipients.split(','):
             if irc.isChannel(channel):
-                noLogPrefix = self.registryValue('noLogPrefix', channel)
+                channel = self.normalizeChannel(irc, channel)
+                noLogPrefix = self.getConfig(irc.network, channel).noLogPrefix
                 if noLogPrefix and text.startswith(noLogPrefix):
                     text = '-= THIS MESSAGE NOT LOGGED =-'
                 nick = msg.nick or irc.nick
@@ -255,11 +355,10 @@ class ChannelLogger(callbacks.Plugin):
             reason = ""
         if not isinstance(irc, irclib.Irc):
             irc = irc.getRealIrc()
-        for (channel, chan) in self.lastStates[irc].channels.iteritems():
-            if msg.nick in chan.users:
-                self.doLog(irc, channel,
-                           '*** %s <%s> has quit IRC%s\n',
-                           msg.nick, msg.prefix, reason)
+        for channel in irc.state.previousChannels(msg):
+            self.doLog(irc, channel,
+                       '*** %s <%s> has quit IRC%s\n',
+                       msg.nick, msg.prefix, reason)
 
     def outFilter(self, irc, msg):
         # Gotta catch my own messages *somehow* :)
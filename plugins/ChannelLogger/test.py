@@ -27,10 +27,78 @@
 # POSSIBILITY OF SUCH DAMAGE.
 ###
 
+import os
+import time
+
 from supybot.test import *
 
-class ChannelLoggerTestCase(PluginTestCase):
+import supybot.plugin as plugin
+
+ChannelLogger = plugin.loadPluginModule('ChannelLogger')
+
+class ChannelLoggerTestCase(ChannelPluginTestCase):
     plugins = ('ChannelLogger',)
+    config = {'supybot.plugins.ChannelLogger.timestamp': False}
+    def logged(self):
+        world.flush()
+        cb = self.irc.getCallback('ChannelLogger')
+        config = cb.getConfig(self.irc.network, self.channel)
+        fd = file(config.filename)
+        try:
+            return fd.read()
+        finally:
+            fd.close()
+
+    def testLogs(self):
+        self.irc.feedMsg(ircmsgs.privmsg(self.channel, '\x02foo\x02',
+                                         prefix='bar!baz@qux'))
+        self.irc.feedMsg(ircmsgs.privmsg(self.channel, '[nolog] secret',
+                                         prefix='bar!baz@qux'))
+        self.failUnless(self.logged().endswith(
+            '<bar> foo\n<bar> -= THIS MESSAGE NOT LOGGED =-\n'))
+
+    def testConfigChanges(self):
+        stripFormatting = conf.supybot.plugins.ChannelLogger.stripFormatting
+        self.irc.feedMsg(ircmsgs.privmsg(self.channel, '\x02foo\x02',
+                                         prefix='bar!baz@qux'))
+        stripFormatting.get(self.channel).setValue(False)
+        try:
+            self.irc.feedMsg(ircmsgs.privmsg(self.channel, '\x02foo\x02',
+                                             prefix='bar!baz@qux'))
+        finally:
+            stripFormatting.get(self.channel).setValue(True)
+        self.failUnless(self.logged().endswith(
+            '<bar> foo\n<bar> \x02foo\x02\n'))
+
+    def testWriterSurvivesBadLines(self):
+        cb = self.irc.getCallback('ChannelLogger')
+        writer = ChannelLogger.plugin.LogWriter(cb.log)
+        writer.start()
+        dirname = conf.supybot.directories.log.dirize('LogWriterTest')
+        (bad, good) = [os.path.join(dirname, s) for s in ('bad', 'good')]
+        if os.path.exists(good):
+            os.remove(good)
+        writer.write(bad, 'caf\xc3\xa9\n')
+        writer.write(bad, u'caf\xe9\n')
+        writer.flush()
+        writer.write(good, 'foo\n')
+        writer.stop()
+        self.failIf(writer.isAlive())
+        fd = file(good)
+        try:
+            self.assertEqual(fd.read(), 'foo\n')
+        finally:
+            fd.close()
+
+    def testNextChange(self):
+        now = time.mktime((2010, 6, 30, 23, 59, 30, 0, 0, -1))
+        self.assertEqual(ChannelLogger.plugin.nextChange('%S', now), now + 1)
+        self.assertEqual(ChannelLogger.plugin.nextChange('%M', now), now + 30)
+        self.assertEqual(ChannelLogger.plugin.nextChange('%m', now), now + 30)
+        self.assertEqual(ChannelLogger.plugin.nextChange('foo', now),
+                         now + 30)
+        self.assertEqual(ChannelLogger.plugin.nextChange('%Y', now + 30),
+                         now + 30 + 86400)
 
 
 # vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
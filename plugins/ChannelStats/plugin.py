@@ -139,19 +139,27 @@ class StatsDB(plugins.ChannelUserDB):
             return UserStat(*L)
 
     def addMsg(self, msg, id=None):
-        if ircutils.isChannel(msg.args[0]):
+        if msg.args and ircutils.isChannel(msg.args[0]):
             channel = plugins.getChannel(msg.args[0])
-            if (channel, 'channelStats') not in self:
-                self[channel, 'channelStats'] = ChannelStat()
-            self[channel, 'channelStats'].addMsg(msg)
+            # The stats are set again after being changed so the db knows
+            # they need to be written out.
+            if (channel, 'channelStats') in self:
+                stats = self[channel, 'channelStats']
+            else:
+                stats = ChannelStat()
+            stats.addMsg(msg)
+            self[channel, 'channelStats'] = stats
             try:
                 if id is None:
                     id = ircdb.users.getUserId(msg.prefix)
             except KeyError:
                 return
-            if (channel, id) not in self:
-                self[channel, id] = UserStat()
-            self[channel, id].addMsg(msg)
+            if (channel, id) in self:
+                stats = self[channel, id]
+            else:
+                stats = UserStat()
+            stats.addMsg(msg)
+            self[channel, id] = stats
 
     def getChannelStats(self, channel):
         return self[channel, 'channelStats']
@@ -165,8 +173,6 @@ class ChannelStats(callbacks.Plugin):
     def __init__(self, irc):
         self.__parent = super(ChannelStats, self)
         self.__parent.__init__(irc)
-        self.lastmsg = None
-        self.laststate = None
         self.outFiltering = False
         self.db = StatsDB(filename)
         self._flush = self.db.flush
@@ -178,13 +184,6 @@ class ChannelStats(callbacks.Plugin):
         self.__parent.die()
 
     def __call__(self, irc, msg):
-        try:
-            if self.lastmsg:
-                self.laststate.addMsg(irc, self.lastmsg)
-            else:
-                self.laststate = irc.state.copy()
-        finally:
-            self.lastmsg = msg
         self.db.addMsg(msg)
         super(ChannelStats, self).__call__(irc, msg)
 
@@ -199,12 +198,19 @@ class ChannelStats(callbacks.Plugin):
                         self.outFiltering = False
         return msg
 
+    def _getStats(self, channel, id):
+        if (channel, id) in self.db:
+            return self.db[channel, id]
+        elif id == 'channelStats':
+            return ChannelStat()
+        else:
+            return UserStat()
+
     def _setUsers(self, irc, channel):
-        if (channel, 'channelStats') not in self.db:
-            self.db[channel, 'channelStats'] = ChannelStat()
-        oldUsers = self.db[channel, 'channelStats'].users
+        stats = self._getStats(channel, 'channelStats')
         newUsers = len(irc.state.channels[channel].users)
-        self.db[channel, 'channelStats'].users = max(oldUsers, newUsers)
+        stats.users = max(stats.users, newUsers)
+        self.db[channel, 'channelStats'] = stats
 
     def doJoin(self, irc, msg):
         self._setUsers(irc, msg.args[0])
@@ -217,15 +223,14 @@ class ChannelStats(callbacks.Plugin):
             id = ircdb.users.getUserId(msg.prefix)
         except KeyError:
             id = None
-        for (channel, c) in self.laststate.channels.iteritems():
-            if msg.nick in c.users:
-                if (channel, 'channelStats') not in self.db:
-                    self.db[channel, 'channelStats'] = ChannelStat()
-                self.db[channel, 'channelStats'].quits += 1
-                if id is not None:
-                    if (channel, id) not in self.db:
-                        self.db[channel, id] = UserStat()
-                    self.db[channel, id].quits += 1
+        for channel in irc.state.previousChannels(msg):
+            stats = self._getStats(channel, 'channelStats')
+            stats.quits += 1
+            self.db[channel, 'channelStats'] = stats
+            if id is not None:
+                stats = self._getStats(channel, id)
+                stats.quits += 1
+                self.db[channel, id] = stats
 
     def doKick(self, irc, msg):
         (channel, nick, _) = msg.args
@@ -234,9 +239,9 @@ class ChannelStats(callbacks.Plugin):
             id = ircdb.users.getUserId(hostmask)
         except KeyError:
             return
-        if (channel, id) not in self.db:
-            self.db[channel, id] = UserStat()
-        self.db.channels[channel][id].kicked += 1
+        stats = self._getStats(channel, id)
+        stats.kicked += 1
+        self.db[channel, id] = stats
 
     def stats(self, irc, msg, args, channel, name):
         """[<channel>] [<name>]
@@ -74,6 +74,23 @@ class ChannelStatsTestCase(ChannelPluginTestCase):
         finally:
             conf.supybot.plugins.ChannelStats.selfStats.setValue(True)
 
+    def testQuitsAndKicksAreWritten(self):
+        cb = self.irc.getCallback('ChannelStats')
+        id = ircdb.users.getUserId(self.prefix)
+        self.irc.feedMsg(ircmsgs.join(self.channel, prefix=self.prefix))
+        self.irc.feedMsg(ircmsgs.kick(self.channel, self.nick, 'bye',
+                                      prefix=self.irc.prefix))
+        self.irc.feedMsg(ircmsgs.join(self.channel, prefix=self.prefix))
+        self.irc.feedMsg(ircmsgs.quit(prefix=self.prefix))
+        cb.db.flush()
+        db = cb.db.__class__(cb.db.filename)
+        try:
+            self.assertEqual(db[self.channel, id].kicked, 1)
+            self.assertEqual(db[self.channel, id].quits, 1)
+            self.assertEqual(db[self.channel, 'channelStats'].quits, 1)
+        finally:
+            db.close()
+
     def testNoKeyErrorStats(self):
         self.assertNotRegexp('stats sweede', 'KeyError')
 
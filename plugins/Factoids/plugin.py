@@ -77,18 +77,18 @@ def getFactoidId(irc, msg, args, state):
 addConverter('factoid', getFactoid)
 addConverter('factoidId', getFactoidId)
 
-class Factoids(callbacks.Plugin, plugins.ChannelDBHandler):
+class Factoids(callbacks.Plugin, plugins.SqliteChannelDBHandler):
+    # The trigrams of each key, for _searchFactoid.
+    keyIndex = plugins.SqliteTrigramIndex('keys', 'key', padded=True)
     def __init__(self, irc):
         callbacks.Plugin.__init__(self, irc)
-        plugins.ChannelDBHandler.__init__(self)
-
-    def makeDb(self, filename):
-        if os.path.exists(filename):
-            db = sqlite3.connect(filename)
-            db.text_factory = str
-            return db
-        db = sqlite3.connect(filename)
-        db.text_factory = str
+        plugins.SqliteChannelDBHandler.__init__(self)
+
+    def die(self):
+        plugins.SqliteChannelDBHandler.die(self)
+        callbacks.Plugin.die(self)
+
+    def createDb(self, db):
         cursor = db.cursor()
         cursor.execute("""CREATE TABLE keys (
                           id INTEGER PRIMARY KEY,
@@ -107,8 +107,18 @@ class Factoids(callbacks.Plugin, plugins.ChannelDBHandler):
                           fact_id INTEGER,
                           usage_count INTEGER
                           )""")
-        db.commit()
-        return db
+        self.keyIndex.create(cursor)
+
+    def prepareDb(self, db):
+        self.keyIndex.prepare(db)
+
+    def _addKey(self, cursor, key):
+        cursor.execute("""INSERT INTO keys VALUES (NULL, ?)""", (key,))
+        self.keyIndex.add(cursor, cursor.lastrowid, key)
+
+    def _deleteKey(self, cursor, id):
+        cursor.execute("""DELETE FROM keys where id=?""", (id,))
+        self.keyIndex.remove(cursor, id)
 
     def getCommandHelp(self, command, simpleSyntax=None):
         method = self.getCommandMethod(command)
@@ -148,7 +158,7 @@ class Factoids(callbacks.Plugin, plugins.ChannelDBHandler):
         (keyid, factid) = self._getKeyAndFactId(channel, key, factoid)
         
         if len(keyid) == 0:
-            cursor.execute("""INSERT INTO keys VALUES (NULL, ?)""", (key,))
+            self._addKey(cursor, key)
             db.commit()
         if len(factid) == 0:
             if ircdb.users.hasUser(msg.prefix):
@@ -193,12 +203,23 @@ class Factoids(callbacks.Plugin, plugins.ChannelDBHandler):
                           LIMIT 20""", (key,))
         return cursor.fetchall()
     
+    def _keysSharing(self, cursor, where):
+        """Returns the keys selected by where (from self.keyIndex), in the
+        order they were added, or None if where is None."""
+        if where is None:
+            return None
+        (sql, args) = where
+        cursor.execute("""SELECT key FROM keys WHERE %s ORDER BY id""" % sql,
+                       args)
+        return [line[0] for line in cursor.fetchall()]
+
     def _searchFactoid(self, channel, key):
         """Try to typo-match input to possible factoids.
         
         Assume first letter is correct, to reduce processing time.        
         First, try a simple wildcard search.
         If that fails, use the Damerau-Levenshtein edit-distance metric.
+        Both only look at the keys whose trigrams could possibly match.
         """
         # if you made a typo in a two-character key, boo on you.
         if len(key) < 3:
@@ -206,37 +227,42 @@ class Factoids(callbacks.Plugin, plugins.ChannelDBHandler):
             
         db = self.getDb(channel)
         cursor = db.cursor()
-        cursor.execute("""SELECT key FROM keys WHERE key LIKE ?""", ('%' + key + '%',))
-        wildcardkeys = cursor.fetchall()
+        if '%' in key or '_' in key:
+            cursor.execute("""SELECT key FROM keys WHERE key LIKE ?""", ('%' + key + '%',))
+            wildcardkeys = [line[0] for line in cursor.fetchall()]
+        else:
+            lowered = key.lower()
+            where = self.keyIndex.containing(key)
+            wildcardkeys = [sourcekey for sourcekey
+                            in self._keysSharing(cursor, where)
+                            if lowered in sourcekey.lower()]
         if len(wildcardkeys) > 0:
-            return [line[0] for line in wildcardkeys]
+            return wildcardkeys
         
-        cursor.execute("""SELECT key FROM keys WHERE key LIKE ?""", (key[0] + '%',))
-        flkeys = cursor.fetchall()
-        if len(flkeys) == 0:
-            return []
-        flkeys = [line[0] for line in flkeys]
-        dl_metrics = [dameraulevenshtein(key, sourcekey) for sourcekey in flkeys]
-        dict_metrics = dict(zip(flkeys, dl_metrics))
-        if min(dl_metrics) <= 2:
-            return [key for key,item in dict_metrics.iteritems() if item <= 2]
-        if min(dl_metrics) <= 3:
-            return [key for key,item in dict_metrics.iteritems() if item <= 3]
+        # An edit changes at most 4 of a key's trigrams (a transposition),
+        # so keys within a distance have all but 4 times that many of them.
+        trigrams = self.keyIndex.trigrams(key)
+        first = key[0].lower()
+        for distance in (2, 3):
+            where = self.keyIndex.sharing(trigrams, 4 * distance)
+            if where is None:
+                where = self.keyIndex.sharing(['  ' + first])
+            flkeys = self._keysSharing(cursor, where)
+            matches = [sourcekey for sourcekey in flkeys
+                       if sourcekey[0].lower() == first and
+                          dameraulevenshtein(key, sourcekey) <= distance]
+            if matches:
+                return matches
         
         return []
                 
     def _updateRank(self, channel, factoids):
         if self.registryValue('keepRankInfo', channel):
-            db = self.getDb(channel)
-            cursor = db.cursor()
+            filename = self.makeFilename(channel)
             for (fact,factid,relationid) in factoids:
-                cursor.execute("""SELECT relations.usage_count
-                          FROM relations
-                          WHERE relations.id=?""", (relationid,))
-                old_count = cursor.fetchall()[0][0]
-                cursor.execute("UPDATE relations SET usage_count=? WHERE id=?", 
-                            (old_count + 1, relationid,))
-                db.commit()
+                self.sqlite.increment(filename, """UPDATE relations
+                          SET usage_count=usage_count+?
+                          WHERE id=?""", relationid)
         
     def _replyFactoids(self, irc, msg, key, channel, factoids,
                        number=0, error=True, raw=False):
@@ -350,8 +376,7 @@ class Factoids(callbacks.Plugin, plugins.ChannelDBHandler):
                 if len(existentrelation) != 0:
                     newkey_info = False
             elif len(newkey_info) == 0:
-                cursor.execute("""INSERT INTO keys VALUES (NULL, ?)""", 
-                            (newkey,))
+                self._addKey(cursor, newkey)
                 db.commit()
                 cursor.execute("""SELECT id FROM keys WHERE key=?""", (newkey,))
                 newkey_info = cursor.fetchall()
@@ -485,7 +510,7 @@ class Factoids(callbacks.Plugin, plugins.ChannelDBHandler):
                             WHERE relations.key_id=?""", (keyid,))
             remaining_key_relations = cursor.fetchall()
             if len(remaining_key_relations) == 0:
-                cursor.execute("""DELETE FROM keys where id=?""", (keyid,))
+                self._deleteKey(cursor, keyid)
             
             cursor.execute("""SELECT id FROM relations
                             WHERE relations.fact_id=?""", (factid,))
@@ -166,6 +166,17 @@ class FactoidsTestCase(ChannelPluginTestCase):
         self.assertNotError('learn moped as pretty fast')
         self.assertRegexp('moe', 'mooz.*moped')
         self.assertError('nosuchthing')
+
+    def testInvalidCommandLongKey(self):
+        self.assertNotError('learn supercalifragilistic as a word')
+        self.assertNotError('learn superfluous as another word')
+        self.assertRegexp('supercalifragilistc', 'supercalifragilistic')
+        self.assertNotRegexp('supercalifragilistc', 'superfluous')
+        self.assertRegexp('supercalifargilistic', 'supercalifragilistic')
+        self.assertRegexp('califragil', 'supercalifragilistic')
+        self.assertNotError('forget supercalifragilistic')
+        self.assertError('supercalifragilistc')
+        self.assertError('califragil')
     
     def testWhatis(self):
         self.assertNotError('learn foo as bar')
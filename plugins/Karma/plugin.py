@@ -28,7 +28,6 @@
 # POSSIBILITY OF SUCH DAMAGE.
 ###
 
-import os
 import csv
 
 import supybot.conf as conf
@@ -46,25 +45,14 @@ except ImportError:
 
 class SqliteKarmaDB(object):
     def __init__(self, filename):
-        self.dbs = ircutils.IrcDict()
+        self.sqlite = plugins.SqliteDB(create=self._create,
+                                       prepare=self._prepare)
         self.filename = filename
 
     def close(self):
-        for db in self.dbs.itervalues():
-            db.close()
+        self.sqlite.close()
 
-    def _getDb(self, channel):
-        filename = plugins.makeChannelFilename(self.filename, channel)
-        if filename in self.dbs:
-            return self.dbs[filename]
-        if os.path.exists(filename):
-            db = sqlite3.connect(filename)
-            db.text_factory = str
-            self.dbs[filename] = db
-            return db
-        db = sqlite3.connect(filename)
-        db.text_factory = str
-        self.dbs[filename] = db
+    def _create(self, db):
         cursor = db.cursor()
         cursor.execute("""CREATE TABLE karma (
                           id INTEGER PRIMARY KEY,
@@ -73,11 +61,17 @@ class SqliteKarmaDB(object):
                           added INTEGER,
                           subtracted INTEGER
                           )""")
-        db.commit()
+
+    def _prepare(self, db):
         def p(s1, s2):
             return int(ircutils.nickEqual(s1, s2))
         db.create_function('nickeq', 2, p)
-        return db
+
+    def _getFilename(self, channel):
+        return plugins.makeChannelFilename(self.filename, channel)
+
+    def _getDb(self, channel):
+        return self.sqlite.connect(self._getFilename(channel))
 
     def get(self, channel, thing):
         db = self._getDb(channel)
@@ -140,25 +134,22 @@ class SqliteKarmaDB(object):
         cursor.execute("""SELECT COUNT(*) FROM karma""")
         return int(cursor.fetchone()[0])
 
-    def increment(self, channel, name):
-        db = self._getDb(channel)
-        cursor = db.cursor()
+    def _add(self, channel, name, column):
+        filename = self._getFilename(channel)
         normalized = name.lower()
-        cursor.execute("""INSERT INTO karma VALUES (NULL, ?, ?, 0, 0)""",
-                       (name, normalized,))
-        cursor.execute("""UPDATE karma SET added=added+1
-                          WHERE normalized=?""", (normalized,))
-        db.commit()
+        self.sqlite.later(filename,
+                          """INSERT INTO karma VALUES (NULL, ?, ?, 0, 0)""",
+                          (name, normalized,))
+        self.sqlite.increment(filename,
+                              """UPDATE karma SET %s=%s+?
+                                 WHERE normalized=?""" % (column, column),
+                              normalized)
+
+    def increment(self, channel, name):
+        self._add(channel, name, 'added')
 
     def decrement(self, channel, name):
-        db = self._getDb(channel)
-        cursor = db.cursor()
-        normalized = name.lower()
-        cursor.execute("""INSERT INTO karma VALUES (NULL, ?, ?, 0, 0)""",
-                       (name, normalized,))
-        cursor.execute("""UPDATE karma SET subtracted=subtracted+1
-                          WHERE normalized=?""", (normalized,))
-        db.commit()
+        self._add(channel, name, 'subtracted')
 
     def most(self, channel, kind, limit):
         if kind == 'increased':
@@ -38,7 +38,6 @@ import supybot.conf as conf
 import supybot.ircdb as ircdb
 
 import re
-import os
 import time
 
 #try:
@@ -53,30 +52,89 @@ try:
 except ImportError:
     from pysqlite2 import dbapi2 as sqlite3 # for python2.4
 
-# these are needed cuz we are overriding getdb
-import threading
-import supybot.world as world
+import supybot.log as log
 
 
-import supybot.log as log
+class TriggerSet(object):
+    """The regexp triggers of a database, compiled once.
+
+    Those regexps that can be joined without changing their meaning are also
+    compiled into alternations, so a message none of them matches is
+    rejected with a single search rather than one per trigger.
+    """
+    # Backreferences, conditional group references, named groups and inline
+    # flags don't survive being put in an alternation with other regexps.
+    uncombinable = re.compile(r'\\\d|\(\?\(|\(\?P|\(\?[iLmsux]+\)')
+    maxGroups = 99 # sre won't compile a regexp with more groups than this.
+    def __init__(self, rows):
+        self.triggers = [] # [(regexp, compiled, action, alternation), ...]
+        self.alternations = []
+        members = []
+        groups = 0
+        for (regexp, action) in rows:
+            try:
+                r = re.compile(regexp)
+            except re.error, e:
+                log.warning('Skipping invalid MessageParser regexp %r: %s',
+                            regexp, e)
+                continue
+            if self.uncombinable.search(regexp):
+                self.triggers.append((regexp, r, action, None))
+                continue
+            if groups + r.groups > self.maxGroups:
+                self._addAlternation(members)
+                members = []
+                groups = 0
+            groups += r.groups
+            members.append(len(self.triggers))
+            self.triggers.append((regexp, r, action, len(self.alternations)))
+        self._addAlternation(members)
+
+    def _addAlternation(self, members):
+        if not members:
+            return
+        regexps = [self.triggers[i][0] for i in members]
+        try:
+            r = re.compile('|'.join(['(?:%s)' % s for s in regexps]))
+        except (re.error, AssertionError):
+            # Let the members be tried on their own.
+            for i in members:
+                (regexp, compiled, action, _) = self.triggers[i]
+                self.triggers[i] = (regexp, compiled, action, None)
+        else:
+            self.alternations.append(r)
+
+    def __len__(self):
+        return len(self.triggers)
 
+    def matches(self, s):
+        """Returns (regexp, action, match) for each match of each trigger in
+        s, in the order of the triggers."""
+        found = [r.search(s) is not None for r in self.alternations]
+        L = []
+        for (regexp, r, action, alternation) in self.triggers:
+            if alternation is not None and not found[alternation]:
+                continue
+            for match in r.finditer(s):
+                L.append((regexp, action, match))
+        return L
 
-class MessageParser(callbacks.Plugin, plugins.ChannelDBHandler):
+
+class MessageParser(callbacks.Plugin, plugins.SqliteChannelDBHandler):
     """This plugin can set regexp triggers to activate the bot.
     Use 'add' command to add regexp trigger, 'remove' to remove."""
     threaded = True
     def __init__(self, irc):
         callbacks.Plugin.__init__(self, irc)
-        plugins.ChannelDBHandler.__init__(self)
+        plugins.SqliteChannelDBHandler.__init__(self)
+        self.triggerSets = {}
+
+    def die(self):
+        plugins.SqliteChannelDBHandler.die(self)
+        callbacks.Plugin.die(self)
     
-    def makeDb(self, filename):
-        """Create the database and connect to it."""
-        if os.path.exists(filename):
-            db = sqlite3.connect(filename)
-            db.text_factory = str
-            return db
-        db = sqlite3.connect(filename)
-        db.text_factory = str
+    def createDb(self, db):
+        """Create the database."""
         cursor = db.cursor()
         cursor.execute("""CREATE TABLE triggers (
                           id INTEGER PRIMARY KEY,
@@ -87,33 +145,28 @@ class MessageParser(callbacks.Plugin, plugins.ChannelDBHandler):
                           action TEXT,
                           locked BOOLEAN
                           )""")
-        db.commit()
-        return db
-    
-    # override this because sqlite3 doesn't have autocommit
-    # use isolation_level instead.
-    def getDb(self, channel):
-        """Use this to get a database for a specific channel."""
-        currentThread = threading.currentThread()
-        if channel not in self.dbCache and currentThread == world.mainThread:
-            self.dbCache[channel] = self.makeDb(self.makeFilename(channel))
-        if currentThread != world.mainThread:
-            db = self.makeDb(self.makeFilename(channel))
-        else:
-            db = self.dbCache[channel]
-        db.isolation_level = None
-        return db
     
     def _updateRank(self, channel, regexp):
         if self.registryValue('keepRankInfo', channel):
+            self.sqlite.increment(self.makeFilename(channel),
+                      """UPDATE triggers SET usage_count=usage_count+?
+                         WHERE regexp=?""", regexp)
+    
+    def _getTriggers(self, channel):
+        """Returns the compiled triggers of channel's database."""
+        filename = self.makeFilename(channel)
+        try:
+            return self.triggerSets[filename]
+        except KeyError:
             db = self.getDb(channel)
             cursor = db.cursor()
-            cursor.execute("""SELECT usage_count
-                      FROM triggers
-                      WHERE regexp=?""", (regexp,))
-            old_count = cursor.fetchall()[0][0]
-            cursor.execute("UPDATE triggers SET usage_count=? WHERE regexp=?", (old_count + 1, regexp,))
-            db.commit()
+            cursor.execute("SELECT regexp, action FROM triggers")
+            triggers = TriggerSet(cursor.fetchall())
+            self.triggerSets[filename] = triggers
+            return triggers
+
+    def _invalidateTriggers(self, channel):
+        self.triggerSets.pop(self.makeFilename(channel), None)
     
     def _runCommandFunction(self, irc, msg, command):
         """Run a command from message, as if command was sent over IRC."""
@@ -146,20 +199,13 @@ class MessageParser(callbacks.Plugin, plugins.ChannelDBHandler):
             if callbacks.addressed(irc.nick, msg): #message is direct command
                 return
             actions = []
-            db = self.getDb(channel)
-            cursor = db.cursor()
-            cursor.execute("SELECT regexp, action FROM triggers")
-            results = cursor.fetchall()
-            if len(results) == 0:
-                return
-            for (regexp, action) in results:
-                for match in re.finditer(regexp, msg.args[1]):
-                    if match is not None:
-                        thisaction = action
-                        self._updateRank(channel, regexp)
-                        for (i, j) in enumerate(match.groups()):
-                            thisaction = re.sub(r'\$' + str(i+1), match.group(i+1), thisaction)
-                        actions.append(thisaction)
+            for (regexp, action, match) in \
+                    self._getTriggers(channel).matches(msg.args[1]):
+                thisaction = action
+                self._updateRank(channel, regexp)
+                for (i, j) in enumerate(match.groups()):
+                    thisaction = re.sub(r'\$' + str(i+1), match.group(i+1), thisaction)
+                actions.append(thisaction)
             
             for action in actions:
                 self._runCommandFunction(irc, msg, action)
@@ -197,6 +243,7 @@ class MessageParser(callbacks.Plugin, plugins.ChannelDBHandler):
                               (NULL, ?, ?, ?, ?, ?, ?)""",
                             (regexp, name, int(time.time()), usage_count, action, locked,))
             db.commit()
+            self._invalidateTriggers(channel)
             irc.replySuccess()
         else:
             irc.error('That trigger is locked.')
@@ -235,6 +282,7 @@ class MessageParser(callbacks.Plugin, plugins.ChannelDBHandler):
         
         cursor.execute("""DELETE FROM triggers WHERE id=?""", (id,))
         db.commit()
+        self._invalidateTriggers(channel)
         irc.replySuccess()
     remove = wrap(remove, ['channel',
                             getopts({'id': '',}),
@@ -259,6 +307,7 @@ class MessageParser(callbacks.Plugin, plugins.ChannelDBHandler):
             return
         cursor.execute("UPDATE triggers SET locked=1 WHERE regexp=?", (regexp,))
         db.commit()
+        self._invalidateTriggers(channel)
         irc.replySuccess()
     lock = wrap(lock, ['channel', 'text'])
 
@@ -281,6 +330,7 @@ class MessageParser(callbacks.Plugin, plugins.ChannelDBHandler):
             return
         cursor.execute("UPDATE triggers SET locked=0 WHERE regexp=?", (regexp,))
         db.commit()
+        self._invalidateTriggers(channel)
         irc.replySuccess()
     unlock = wrap(unlock, ['channel', 'text'])
 
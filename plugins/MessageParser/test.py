@@ -35,6 +35,10 @@ try:
 except ImportError:
     from pysqlite2 import dbapi2 as sqlite3 # for python2.4
 
+import supybot.plugin as plugin
+
+MessageParser = plugin.loadPluginModule('MessageParser')
+
 
 class MessageParserTestCase(ChannelPluginTestCase):
     plugins = ('MessageParser','Utilities','User') 
@@ -171,4 +175,39 @@ class MessageParserTestCase(ChannelPluginTestCase):
         self.getMsg(' ')
         self.assertRegexp('messageparser info "stuff"', 'has been triggered 1 times')
         
+    def testTriggersFollowChanges(self):
+        self.assertNotError('messageparser add "stuff" "echo i saw some stuff"')
+        self.feedMsg('this message has some stuff in it')
+        m = self.getMsg(' ')
+        self.failUnless(str(m).startswith('PRIVMSG #test :i saw some stuff'))
+        self.assertNotError('messageparser add "stuff" "echo more stuff"')
+        self.feedMsg('this message has some stuff in it')
+        m = self.getMsg(' ')
+        self.failUnless(str(m).startswith('PRIVMSG #test :more stuff'))
+        self.assertNotError('messageparser remove "stuff"')
+        self.feedMsg('this message has some stuff in it')
+        self.assertNoResponse(' ', 1)
+
+    def testTriggerSet(self):
+        TriggerSet = MessageParser.plugin.TriggerSet
+        triggers = TriggerSet([('a(b)', 'ab'), (r'(c)\1', 'cc'),
+                               ('(?i)d', 'd'), ('[', 'invalid'),
+                               ('e', 'e')])
+        self.assertEqual(len(triggers), 4)
+        self.assertEqual(len(triggers.alternations), 1)
+        self.assertEqual(triggers.matches('xyz'), [])
+        L = [(action, m.group(0)) for (_, action, m)
+             in triggers.matches('Dab ecc ab')]
+        self.assertEqual(L, [('ab', 'ab'), ('ab', 'ab'),
+                             ('cc', 'cc'), ('d', 'D'), ('e', 'e')])
+        many = [('(%s)' % i, str(i)) for i in range(150)]
+        triggers = TriggerSet(many)
+        self.assertEqual(len(triggers.alternations), 2)
+        self.assertEqual([action for (_, action, _) in
+                          triggers.matches('149')],
+                         ['1', '4', '9', '14', '49', '149'])
+        triggers = TriggerSet([('(a)', 'a'), ('(f)?(?(1)g|h)', 'cond')])
+        self.assertEqual([(action, m.group(0)) for (_, action, m)
+                          in triggers.matches('fg')], [('cond', 'fg')])
+        
 # vim:set shiftwidth=4 tabstop=4 expandtab textwidth=79:
@@ -45,9 +45,10 @@ import supybot.ircutils as ircutils
 import supybot.callbacks as callbacks
 from supybot import commands
 
-from supybot.utils.iter import ifilter
+from supybot.utils.iter import ifilter, islice
 
 class Misc(callbacks.Plugin):
+    regexpBatchSize = 100
     def __init__(self, irc):
         self.__parent = super(Misc, self)
         self.__parent.__init__(irc)
@@ -272,6 +273,29 @@ class Misc(callbacks.Plugin):
                msg.command == 'PRIVMSG' and \
                ircutils.isChannel(msg.args[0])
 
+    def _filterByRegexps(self, msgs, regexps):
+        # The regexps are run in other processes, since specially crafted
+        # regexps can take exponential time and hang up the bot; a timeout
+        # of 0.1 should be more than enough for any normal regexp.  Messages
+        # are sent over in batches, so we don't search through all of them
+        # when only the first match is wanted.
+        while True:
+            batch = list(islice(msgs, self.regexpBatchSize))
+            if not batch:
+                return
+            texts = []
+            for m in batch:
+                if ircmsgs.isAction(m):
+                    texts.append(ircmsgs.unAction(m))
+                else:
+                    texts.append(m.args[1])
+            for regexp in regexps:
+                matches = commands.processPool.search(regexp, texts, 0.1)
+                batch = [m for (m, match) in zip(batch, matches) if match]
+                texts = [s for (s, match) in zip(texts, matches) if match]
+            for m in batch:
+                yield m
+
     def last(self, irc, msg, args, optlist):
         """[--{from,in,on,with,without,regexp} <value>] [--nolimit]
 
@@ -284,11 +308,16 @@ class Misc(callbacks.Plugin):
         given in is searched.
         """
         predicates = {}
+        regexps = []
         nolimit = False
         skipfirst = True
+        # These are what the history's indexes can narrow the search by.
+        channel = nick = None
+        texts = []
         if ircutils.isChannel(msg.args[0]):
             predicates['in'] = lambda m: ircutils.strEqual(m.args[0],
                                                            msg.args[0])
+            channel = msg.args[0]
         else:
             skipfirst = False
         for (option, arg) in optlist:
@@ -296,10 +325,12 @@ class Misc(callbacks.Plugin):
                 def f(m, arg=arg):
                     return ircutils.hostmaskPatternEqual(arg, m.nick)
                 predicates['from'] = f
+                nick = arg
             elif option == 'in':
                 def f(m, arg=arg):
                     return ircutils.strEqual(m.args[0], arg)
                 predicates['in'] = f
+                channel = arg
                 if arg != msg.args[0]:
                     skipfirst = False
             elif option == 'on':
@@ -310,41 +341,23 @@ class Misc(callbacks.Plugin):
                 def f(m, arg=arg):
                     return arg.lower() in m.args[1].lower()
                 predicates.setdefault('with', []).append(f)
+                texts.append(arg)
             elif option == 'without':
                 def f(m, arg=arg):
                     return arg.lower() not in m.args[1].lower()
                 predicates.setdefault('without', []).append(f)
             elif option == 'regexp':
-                def f(m, arg=arg):
-                    def f1(s, arg):
-                        """Since we can't enqueue match objects into the multiprocessing queue,
-                        we'll just wrap the function to return bools."""
-                        if arg.search(s) is not None:
-                            return True
-                        else:
-                            return False
-                    if ircmsgs.isAction(m):
-                        m1 = ircmsgs.unAction(m)
-                        #return arg.search(ircmsgs.unAction(m))
-                    else:
-                        m1 = m.args[1]
-                        #return arg.search(m.args[1])
-                    try:
-                        # use a subprocess here, since specially crafted regexps can
-                        # take exponential time and hang up the bot.
-                        # timeout of 0.1 should be more than enough for any normal regexp.
-                        v = commands.process(f1, m1, arg, timeout=0.1, pn=self.name(), cn='last')
-                        return v
-                    except commands.ProcessTimeoutError:
-                        return False
-                predicates.setdefault('regexp', []).append(f)
+                regexps.append(arg)
             elif option == 'nolimit':
                 nolimit = True
-        iterable = ifilter(self._validLastMsg, reversed(irc.state.history))
+        history = irc.state.history
+        iterable = ifilter(self._validLastMsg,
+                           history.search(channel, nick, texts))
         if skipfirst:
             # Drop the first message only if our current channel is the same as
             # the channel we've been instructed to look at.
-            iterable.next()
+            first = ifilter(self._validLastMsg, reversed(history)).next()
+            iterable = ifilter(lambda m: m is not first, iterable)
         predicates = list(utils.iter.flatten(predicates.itervalues()))
         # Make sure the user can't get messages from channels they aren't in
         def userInChannel(m):
@@ -369,20 +382,24 @@ class Misc(callbacks.Plugin):
             showNick = False
         else:
             showNick = True
-        for m in iterable:
+        def p(m):
             for predicate in predicates:
                 if not predicate(m):
-                    break
+                    return False
+            return True
+        iterable = ifilter(p, iterable)
+        if regexps:
+            iterable = self._filterByRegexps(iterable, regexps)
+        for m in iterable:
+            if nolimit:
+                resp.append(ircmsgs.prettyPrint(m,
+                                                timestampFormat=tsf,
+                                                showNick=showNick))
             else:
-                if nolimit:
-                    resp.append(ircmsgs.prettyPrint(m,
-                                                    timestampFormat=tsf,
-                                                    showNick=showNick))
-                else:
-                    irc.reply(ircmsgs.prettyPrint(m,
-                                                  timestampFormat=tsf,
-                                                  showNick=showNick))
-                    return
+                irc.reply(ircmsgs.prettyPrint(m,
+                                              timestampFormat=tsf,
+                                              showNick=showNick))
+                return
         if not resp:
             irc.error('I couldn\'t find a message matching that criteria in '
                       'my history of %s messages.' % len(irc.state.history))
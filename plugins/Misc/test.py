@@ -167,6 +167,8 @@ class MiscTestCase(ChannelPluginTestCase):
             self.assertResponse('last --from %s*' % self.nick[0],
                                 '<%s> @last --from %s' %
                                 (self.nick, self.nick.upper()))
+            self.assertResponse('last --with "AR BA"', '<%s> foo bar baz' % \
+                                self.nick)
             conf.supybot.plugins.Misc.timestampFormat.setValue('foo')
             self.assertSnarfNoResponse('foo bar baz', 1)
             self.assertResponse('last', '<%s> foo bar baz' % self.nick)
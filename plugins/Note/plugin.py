@@ -58,6 +58,7 @@ class NoteRecord(dbi.Record):
 class DbiNoteDB(dbi.DB):
     Mapping = 'flat'
     Record = NoteRecord
+    textFields = ('text',)
 
     def __init__(self, *args, **kwargs):
         dbi.DB.__init__(self, *args, **kwargs)
@@ -291,13 +292,16 @@ class Note(callbacks.Plugin):
         def frm(note):
             return note.frm == user.id
         own = to
+        literals = []
+        regexps = []
         for (option, arg) in optlist:
             if option == 'regexp':
-                criteria.append(lambda x: commands.regexp_wrapper(x, reobj=arg, 
-                        timeout=0.1, plugin_name = self.name(), fcn_name='search'))
+                literals.extend(dbi.regexpLiterals(arg))
+                regexps.append(arg)
             elif option == 'sent':
                 own = frm
         if glob:
+            literals.extend(dbi.globLiterals(glob))
             glob = utils.python.glob2re(glob)
             criteria.append(re.compile(glob).search)
         def match(note):
@@ -305,7 +309,12 @@ class Note(callbacks.Plugin):
                 if not p(note.text):
                     return False
             return True
-        notes = list(self.db.select(lambda n: match(n) and own(n)))
+        notes = list(self.db.search(literals, lambda n: own(n) and match(n)))
+        for regexp in regexps:
+            matches = commands.processPool.search(regexp,
+                                                  [n.text for n in notes],
+                                                  timeout=0.1)
+            notes = [n for (n, m) in zip(notes, matches) if m]
         if not notes:
             irc.reply('No matching notes were found.')
         else:
@@ -87,6 +87,7 @@ def renameCommand(cb, name, newName):
         method = getattr(cb.__class__, name)
         setattr(cb.__class__, newName, method)
         delattr(cb.__class__, name)
+        callbacks.commandsChanged()
 
 
 registerDefaultPlugin('list', 'Misc')
@@ -389,10 +390,10 @@ class Owner(callbacks.Plugin):
                             (len(ircutils._hostmaskPatternEqualCache),
                              'result')))
             ircutils._hostmaskPatternEqualCache.clear()
-            L.append(format('ircdb username cache flushed: %n cleared.',
-                            (len(ircdb.users._nameCache),
-                             'username to id mapping')))
-            ircdb.users._nameCache.clear()
+            L.append(format('ircdb non-user cache flushed: %n cleared.',
+                            (len(ircdb.users._nonUserCache),
+                             'unrecognized hostmask')))
+            ircdb.users._nonUserCache.clear()
             L.append(format('ircdb hostmask cache flushed: %n cleared.',
                             (len(ircdb.users._hostmaskCache),
                             'hostmask to id mapping')))
@@ -65,32 +65,17 @@ class QuoteGrabsRecord(dbi.Record):
                       self.text, self.hostmask, grabber, self.at)
 
 class SqliteQuoteGrabsDB(object):
+    # The trigrams of each quote, for search.
+    index = plugins.SqliteTrigramIndex('quotegrabs', 'quote')
     def __init__(self, filename):
-        self.dbs = ircutils.IrcDict()
+        self.sqlite = plugins.SqliteDB(create=self._create,
+                                       prepare=self._prepare)
         self.filename = filename
 
     def close(self):
-        for db in self.dbs.itervalues():
-            db.close()
+        self.sqlite.close()
 
-    def _getDb(self, channel):
-        filename = plugins.makeChannelFilename(self.filename, channel)
-        def p(s1, s2):
-            # text_factory seems to only apply as an output adapter,
-            # so doesn't apply to created functions; so we use str()
-            return ircutils.nickEqual(str(s1), str(s2))
-        if filename in self.dbs:
-            return self.dbs[filename]
-        if os.path.exists(filename):
-            db = sqlite3.connect(filename)
-            db.text_factory = str
-            db.create_function('nickeq', 2, p)
-            self.dbs[filename] = db
-            return db
-        db = sqlite3.connect(filename)
-        db.text_factory = str
-        db.create_function('nickeq', 2, p)
-        self.dbs[filename] = db
+    def _create(self, db):
         cursor = db.cursor()
         cursor.execute("""CREATE TABLE quotegrabs (
                           id INTEGER PRIMARY KEY,
@@ -100,8 +85,19 @@ class SqliteQuoteGrabsDB(object):
                           added_at TIMESTAMP,
                           quote TEXT
                           );""")
-        db.commit()
-        return db
+        self.index.create(cursor)
+
+    def _prepare(self, db):
+        def p(s1, s2):
+            # text_factory seems to only apply as an output adapter,
+            # so doesn't apply to created functions; so we use str()
+            return ircutils.nickEqual(str(s1), str(s2))
+        db.create_function('nickeq', 2, p)
+        self.index.prepare(db)
+
+    def _getDb(self, channel):
+        filename = plugins.makeChannelFilename(self.filename, channel)
+        return self.sqlite.connect(filename)
 
     def get(self, channel, id):
         db = self._getDb(channel)
@@ -180,6 +176,7 @@ class SqliteQuoteGrabsDB(object):
         cursor.execute("""INSERT INTO quotegrabs
                           VALUES (NULL, ?, ?, ?, ?, ?)""",
                        (msg.nick, msg.prefix, by, int(time.time()), text,))
+        self.index.add(cursor, cursor.lastrowid, text)
         db.commit()
 
     def remove(self, channel, grab=None):
@@ -194,25 +191,35 @@ class SqliteQuoteGrabsDB(object):
             results = cursor.fetchall()
             if len(results) == 0:
                 raise dbi.NoRecordError
-            cursor.execute("""DELETE FROM quotegrabs WHERE id = ?""", (grab,))
         else:
             cursor.execute("""SELECT * FROM quotegrabs WHERE id = (SELECT MAX(id)
                 FROM quotegrabs)""")
             results = cursor.fetchall()
             if len(results) == 0:
                 raise dbi.NoRecordError
-            cursor.execute("""DELETE FROM quotegrabs WHERE id = (SELECT MAX(id)
-                FROM quotegrabs)""")
+            grab = results[0][0]
+        cursor.execute("""DELETE FROM quotegrabs WHERE id = ?""", (grab,))
+        self.index.remove(cursor, grab)
         db.commit()
 
     def search(self, channel, text):
         db = self._getDb(channel)
         cursor = db.cursor()
-        text = '%' + text + '%'
-        cursor.execute("""SELECT id, nick, quote FROM quotegrabs
-                          WHERE quote LIKE ?
-                          ORDER BY id DESC""", (text,))
-        results = cursor.fetchall()
+        where = self.index.containing(text)
+        if '%' in text or '_' in text or where is None:
+            cursor.execute("""SELECT id, nick, quote FROM quotegrabs
+                              WHERE quote LIKE ?
+                              ORDER BY id DESC""", ('%' + text + '%',))
+            results = cursor.fetchall()
+        else:
+            # Only the quotes with all of text's trigrams can contain it.
+            (sql, args) = where
+            cursor.execute("""SELECT id, nick, quote FROM quotegrabs WHERE %s
+                              ORDER BY id DESC""" % sql, args)
+            text = text.lower()
+            results = [(id, nick, quote)
+                       for (id, nick, quote) in cursor.fetchall()
+                       if text in quote.lower()]
         if len(results) == 0:
             raise dbi.NoRecordError
         return [QuoteGrabsRecord(id, text=quote, by=nick)
@@ -227,6 +234,10 @@ class QuoteGrabs(callbacks.Plugin):
         self.__parent.__init__(irc)
         self.db = QuoteGrabsDB()
 
+    def die(self):
+        self.db.close()
+        self.__parent.die()
+
     def doPrivmsg(self, irc, msg):
         if ircmsgs.isCtcp(msg) and not ircmsgs.isAction(msg):
             return
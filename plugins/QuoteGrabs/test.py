@@ -142,6 +142,11 @@ class QuoteGrabsTestCase(ChannelPluginTestCase):
         self.assertError('quotegrabs search test')  # still none in db
         self.assertNotError('grab foo')
         self.assertNotError('quotegrabs search test')
+        self.assertRegexp('quotegrabs search SEARCH', 'testSearch')
+        self.assertRegexp('quotegrabs search ts', 'testSearch')
+        self.assertError('quotegrabs search testsearcher')
+        self.assertNotError('ungrab')
+        self.assertError('quotegrabs search test')
 
 class QuoteGrabsNonChannelTestCase(QuoteGrabsTestCase):
     config = { 'databases.plugins.channelSpecific' : False }
@@ -62,6 +62,12 @@ conf.registerGlobalValue(RSS, 'waitPeriod',
     registry.PositiveInteger(1800, """Indicates how many seconds the bot will
     wait between retrieving RSS feeds; requests made within this period will
     return cached results."""))
+conf.registerGlobalValue(RSS, 'fetchers',
+    registry.PositiveInteger(4, """Determines how many feeds the bot will
+    download at once when checking announced feeds."""))
+conf.registerGlobalValue(RSS.fetchers, 'perHost',
+    registry.PositiveInteger(1, """Determines how many feeds the bot will
+    download at once from any one host when checking announced feeds."""))
 conf.registerGlobalValue(RSS, 'stripRedirect', registry.Boolean(
     True, """Determines whether the bot will attempt to strip url redirection
     from headline links, by taking things after the last http://."""))
@@ -34,13 +34,16 @@ import socket
 import sgmllib
 import threading
 import re
+from collections import deque
 
 import supybot.conf as conf
 import supybot.utils as utils
 import supybot.world as world
 from supybot.commands import *
+import supybot.ircmsgs as ircmsgs
 import supybot.ircutils as ircutils
 import supybot.registry as registry
+import supybot.schedule as schedule
 import supybot.callbacks as callbacks
 
 try:
@@ -57,12 +60,137 @@ def getFeedName(irc, msg, args, state):
     state.args.append(callbacks.canonicalName(args.pop(0)))
 addConverter('feedName', getFeedName)
 
+class FetcherPool(object):
+    """Runs feed fetches on at most size() worker threads, with at most
+    perHost() of them fetching from any one host at a time.  size and perHost
+    are callables (usually registry values) so changes take effect as soon as
+    a worker is next free."""
+    def __init__(self, size, perHost, log):
+        self.size = size
+        self.perHost = perHost
+        self.log = log
+        self.cond = threading.Condition()
+        self.jobs = [] # (key, host, f, args), in the order submitted.
+        self.keys = set() # The keys of the jobs waiting or running.
+        self.busy = {} # Host -> number of fetches running from it.
+        self.workers = 0
+        self.idle = 0
+        self.stopped = False
+
+    def submit(self, key, host, f, *args):
+        """Runs f(*args) on a worker, unless a job with the same key is
+        already waiting or running."""
+        self.cond.acquire()
+        try:
+            if key in self.keys or self.stopped:
+                return
+            self.keys.add(key)
+            self.jobs.append((key, host, f, args))
+            if len(self.jobs) > self.idle and self.workers < self.size():
+                self.workers += 1
+                t = world.SupyThread(target=self._work, name='RSS fetcher')
+                t.setDaemon(True)
+                t.start()
+            self.cond.notify()
+        finally:
+            self.cond.release()
+
+    def stop(self):
+        """Drops the waiting jobs and stops the workers as they finish."""
+        self.cond.acquire()
+        try:
+            self.stopped = True
+            self.jobs = []
+            self.cond.notifyAll()
+        finally:
+            self.cond.release()
+
+    def _next(self):
+        # Called with self.cond held.
+        perHost = self.perHost()
+        for (i, job) in enumerate(self.jobs):
+            if self.busy.get(job[1], 0) < perHost:
+                del self.jobs[i]
+                return job
+        return None
+
+    def _work(self):
+        self.cond.acquire()
+        try:
+            while True:
+                job = self._next()
+                while job is None:
+                    if self.stopped or self.workers > self.size():
+                        self.workers -= 1
+                        return
+                    self.idle += 1
+                    self.cond.wait()
+                    self.idle -= 1
+                    job = self._next()
+                (key, host, f, args) = job
+                self.busy[host] = self.busy.get(host, 0) + 1
+                self.cond.release()
+                try:
+                    try:
+                        f(*args)
+                    except Exception, e:
+                        self.log.exception('Uncaught exception fetching %s:',
+                                           key)
+                finally:
+                    self.cond.acquire()
+                    self.busy[host] -= 1
+                    if not self.busy[host]:
+                        del self.busy[host]
+                    self.keys.discard(key)
+                    self.cond.notifyAll()
+        finally:
+            self.cond.release()
+
+
+class SeenHeadlines(object):
+    """A bounded set of the headlines of a feed that have been seen, kept as
+    hashes.  Headlines are forgotten, oldest first, once there are more than
+    size of them or they were seen longer ago than the cache period."""
+    def __init__(self, size):
+        self.size = size
+        self.hashes = {} # Hash -> time first seen.
+        self.order = deque() # (time, hash), oldest first.
+
+    def _hash(self, headline):
+        return hash((tuple(headline[0].lower().split()), headline[1]))
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def __contains__(self, headline):
+        return self._hash(headline) in self.hashes
+
+    def add(self, headline):
+        h = self._hash(headline)
+        if h not in self.hashes:
+            self.hashes[h] = headline[3]
+            self.order.append((headline[3], h))
+            while len(self.order) > self.size:
+                self._forget()
+
+    def expire(self, t):
+        """Forgets the headlines seen before t."""
+        while self.order and self.order[0][0] < t:
+            self._forget()
+
+    def _forget(self):
+        (_, h) = self.order.popleft()
+        del self.hashes[h]
+
+
 class RSS(callbacks.Plugin):
     """This plugin is useful both for announcing updates to RSS feeds in a
     channel, and for retrieving the headlines of RSS feeds via command.  Use
     the "add" command to add feeds to this plugin, and use the "announce"
     command to determine what feeds should be announced in a given channel."""
     threaded = True
+    pollPeriod = 60 # How often we check for announced feeds that are due.
+    seenHeadlines = 1000 # How many headlines we remember for each feed.
     def __init__(self, irc):
         self.__parent = super(RSS, self)
         self.__parent.__init__(irc)
@@ -71,8 +199,13 @@ class RSS(callbacks.Plugin):
         self.locks = {}
         self.lastRequest = {}
         self.cachedFeeds = {}
-        self.cachedHeadlines = {}
+        self.validators = {} # url -> (etag, modified) of the cached feed.
+        self.seen = {} # url -> SeenHeadlines.
         self.gettingLockLock = threading.Lock()
+        self.pool = FetcherPool(self.registryValue('fetchers', value=False),
+                                self.registryValue('fetchers.perHost',
+                                                   value=False),
+                                self.log)
         for name in self.registryValue('feeds'):
             self._registerFeed(name)
             try:
@@ -81,7 +214,13 @@ class RSS(callbacks.Plugin):
                 self.log.warning('%s is not a registered feed, removing.',name)
                 continue
             self.makeFeedCommand(name, url)
-            self.getFeed(url) # So announced feeds don't announce on startup.
+        schedule.addPeriodicEvent(self._poll, self.pollPeriod, 'RSS',
+                                  now=False)
+
+    def die(self):
+        schedule.removePeriodicEvent('RSS')
+        self.pool.stop()
+        self.__parent.die()
 
     def isCommandMethod(self, name):
         if not self.__parent.isCommandMethod(name):
@@ -106,38 +245,28 @@ class RSS(callbacks.Plugin):
         group = self.registryValue('feeds', value=False)
         conf.registerGlobalValue(group, name, registry.String(url, ''))
 
-    def __call__(self, irc, msg):
-        self.__parent.__call__(irc, msg)
-        irc = callbacks.SimpleProxy(irc, msg)
-        newFeeds = {}
-        for channel in irc.state.channels:
-            feeds = self.registryValue('announce', channel)
-            for name in feeds:
-                commandName = callbacks.canonicalName(name)
-                if self.isCommandMethod(commandName):
-                    url = self.feedNames[commandName][0]
-                else:
-                    url = name
-                if self.willGetNewFeed(url):
-                    newFeeds.setdefault((url, name), []).append(channel)
-        for ((url, name), channels) in newFeeds.iteritems():
-            # We check if we can acquire the lock right here because if we
-            # don't, we'll possibly end up spawning a lot of threads to get
-            # the feed, because this thread may run for a number of bytecodes
-            # before it switches to a thread that'll get the lock in
-            # _newHeadlines.
-            if self.acquireLock(url, blocking=False):
-                try:
-                    t = threading.Thread(target=self._newHeadlines,
-                                         name=format('Fetching %u', url),
-                                         args=(irc, channels, name, url))
-                    self.log.info('Checking for announcements at %u', url)
-                    world.threadsSpawned += 1
-                    t.setDaemon(True)
-                    t.start()
-                finally:
-                    self.releaseLock(url)
-                    time.sleep(0.1) # So other threads can run.
+    def _poll(self):
+        """Hands the announced feeds that are due to be checked to the pool of
+        fetchers."""
+        targets = {}
+        for irc in world.ircs:
+            if irc.zombie:
+                continue
+            for channel in irc.state.channels:
+                feeds = self.registryValue('announce', channel)
+                for name in feeds:
+                    commandName = callbacks.canonicalName(name)
+                    if self.isCommandMethod(commandName):
+                        url = self.feedNames[commandName][0]
+                    else:
+                        url = name
+                    if self.willGetNewFeed(url):
+                        targets.setdefault((url, name), []).append((irc,
+                                                                    channel))
+        for ((url, name), channels) in targets.iteritems():
+            self.log.info('Checking for announcements at %u', url)
+            self.pool.submit((url, name), utils.web.getDomain(url),
+                             self._newHeadlines, channels, name, url)
 
     def buildHeadlines(self, headlines, channel, linksconfig='announce.showLinks', dateconfig='announce.showPubDate'):
         newheadlines = []
@@ -159,7 +288,7 @@ class RSS(callbacks.Plugin):
                                        pubDate))
         return newheadlines
 
-    def _newHeadlines(self, irc, channels, name, url):
+    def _newHeadlines(self, channels, name, url):
         try:
             # We acquire the lock here so there's only one announcement thread
             # in this code at any given time.  Otherwise, several announcement
@@ -170,12 +299,11 @@ class RSS(callbacks.Plugin):
             self.acquireLock(url)
             t = time.time()
             try:
-                #oldresults = self.cachedFeeds[url]
-                #oldheadlines = self.getHeadlines(oldresults)
-                oldheadlines = self.cachedHeadlines[url]
-                oldheadlines = filter(lambda x: t - x[3] < self.registryValue('announce.cachePeriod'), oldheadlines)
+                seen = self.seen[url]
             except KeyError:
-                oldheadlines = []
+                seen = self.seen[url] = SeenHeadlines(self.seenHeadlines)
+            seen.expire(t - self.registryValue('announce.cachePeriod'))
+            initial = not seen
             newresults = self.getFeed(url)
             newheadlines = self.getHeadlines(newresults)
             if len(newheadlines) == 1:
@@ -184,15 +312,10 @@ class RSS(callbacks.Plugin):
                          'Unable to download feed.'):
                     self.log.debug('%s %u', s, url)
                     return
-            def normalize(headline):
-                return (tuple(headline[0].lower().split()), headline[1])
-            oldheadlinesset = set(map(normalize, oldheadlines))
-            for (i, headline) in enumerate(newheadlines):
-                if normalize(headline) in oldheadlinesset:
-                    newheadlines[i] = None
-            newheadlines = filter(None, newheadlines) # Removes Nones.
-            oldheadlines.extend(newheadlines)
-            self.cachedHeadlines[url] = oldheadlines
+            newheadlines = [headline for headline in newheadlines
+                            if headline not in seen]
+            for headline in newheadlines:
+                seen.add(headline)
             if newheadlines:
                 def filter_whitelist(headline):
                     v = False
@@ -208,8 +331,8 @@ class RSS(callbacks.Plugin):
                             v = False
                             break
                     return v
-                for channel in channels:
-                    if len(oldheadlines) == 0:
+                for (irc, channel) in channels:
+                    if initial:
                         channelnewheadlines = newheadlines[:self.registryValue('initialAnnounceHeadlines', channel)]
                     else:
                         channelnewheadlines = newheadlines[:]
@@ -220,7 +343,7 @@ class RSS(callbacks.Plugin):
                     if len(blacklist) != 0:
                         channelnewheadlines = filter(filter_blacklist, channelnewheadlines)
                     if len(channelnewheadlines) == 0:
-                        return
+                        continue
                     bold = self.registryValue('bold', channel)
                     sep = self.registryValue('headlineSeparator', channel)
                     prefix = self.registryValue('announcementPrefix', channel)
@@ -229,8 +352,10 @@ class RSS(callbacks.Plugin):
                         pre = ircutils.bold(pre)
                         sep = ircutils.bold(sep)
                     headlines = self.buildHeadlines(channelnewheadlines, channel)
-                    irc.replies(headlines, prefixer=pre, joiner=sep,
-                                to=channel, prefixNick=False, private=True)
+                    msg = ircmsgs.privmsg(channel, '', prefix=irc.prefix)
+                    proxy = callbacks.SimpleProxy(irc, msg)
+                    proxy.replies(headlines, prefixer=pre, joiner=sep,
+                                  to=channel, prefixNick=False, private=True)
         finally:
             self.releaseLock(url)
 
@@ -266,9 +391,14 @@ class RSS(callbacks.Plugin):
             # and DoS the website in question.
             self.acquireLock(url)
             if self.willGetNewFeed(url):
+                (etag, modified) = (None, None)
+                if url in self.cachedFeeds:
+                    # Only ask for the feed if it's changed since we got it.
+                    (etag, modified) = self.validators.get(url, (None, None))
                 try:
                     self.log.debug('Downloading new feed from %u', url)
-                    results = feedparser.parse(url)
+                    results = feedparser.parse(url, etag=etag,
+                                               modified=modified)
                     if 'bozo_exception' in results:
                         raise results['bozo_exception']
                 except sgmllib.SGMLParseError:
@@ -280,8 +410,13 @@ class RSS(callbacks.Plugin):
                     # These seem mostly harmless.  We'll need reports of a
                     # kind that isn't.
                     self.log.debug('Allowing bozo_exception %r through.', e)
-                if results.get('feed', {}):
+                if results.get('status') == 304 and url in self.cachedFeeds:
+                    self.log.debug('Feed at %u has not changed.', url)
+                    self.lastRequest[url] = time.time()
+                elif results.get('feed', {}):
                     self.cachedFeeds[url] = results
+                    self.validators[url] = (results.get('etag'),
+                                            results.get('modified'))
                     self.lastRequest[url] = time.time()
                 else:
                     self.log.debug('Not caching results; feed is empty.')
@@ -344,6 +479,7 @@ class RSS(callbacks.Plugin):
         f = new.instancemethod(f, self, RSS)
         self.feedNames[name] = (url, f)
         self._registerFeed(name, url)
+        callbacks.commandsChanged()
 
     def add(self, irc, msg, args, name, url):
         """<name> <url>
@@ -365,6 +501,7 @@ class RSS(callbacks.Plugin):
             irc.error('That\'s not a valid RSS feed command name.')
             return
         del self.feedNames[name]
+        callbacks.commandsChanged()
         conf.supybot.plugins.RSS.feeds().remove(name)
         conf.supybot.plugins.RSS.feeds.unregister(name)
         irc.replySuccess()
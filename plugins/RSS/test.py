@@ -28,11 +28,81 @@
 # POSSIBILITY OF SUCH DAMAGE.
 ###
 
+import time
+import threading
+
 from supybot.test import *
 
+import supybot.plugin as plugin
+
+RSS = plugin.loadPluginModule('RSS')
+
 url = 'http://www.advogato.org/rss/articles.xml'
 class RSSTestCase(ChannelPluginTestCase):
     plugins = ('RSS','Plugin')
+    def testSeenHeadlines(self):
+        seen = RSS.plugin.SeenHeadlines(2)
+        seen.add(('Foo  bar', 'http://foo/', None, 10))
+        self.failUnless(('foo bar', 'http://foo/', None, 20) in seen)
+        self.failIf(('foo bar', 'http://bar/', None, 20) in seen)
+        seen.add(('baz', 'http://baz/', None, 20))
+        seen.add(('qux', 'http://qux/', None, 30))
+        self.assertEqual(len(seen), 2)
+        self.failIf(('foo bar', 'http://foo/', None, 20) in seen)
+        seen.expire(25)
+        self.assertEqual(len(seen), 1)
+        self.failUnless(('qux', 'http://qux/', None, 30) in seen)
+
+    def testFetcherPool(self):
+        lock = threading.Lock()
+        running = {}
+        most = {}
+        def fetch(host):
+            lock.acquire()
+            running[host] = running.get(host, 0) + 1
+            most[host] = max(most.get(host, 0), running[host])
+            lock.release()
+            time.sleep(0.05)
+            lock.acquire()
+            running[host] -= 1
+            lock.release()
+        pool = RSS.plugin.FetcherPool(lambda: 3, lambda: 1, log)
+        try:
+            for i in range(4):
+                for host in ('a', 'b'):
+                    pool.submit((host, i), host, fetch, host)
+            pool.submit(('a', 0), 'a', fetch, 'a') # Already waiting.
+            for _ in range(100):
+                time.sleep(0.05)
+                pool.cond.acquire()
+                done = not pool.keys
+                pool.cond.release()
+                if done:
+                    break
+            self.failUnless(done)
+            self.assertEqual(most, {'a': 1, 'b': 1})
+            self.failIf(pool.workers > 3)
+        finally:
+            pool.stop()
+
+    def testConditionalGet(self):
+        cb = self.irc.getCallback('RSS')
+        calls = []
+        def parse(url, etag=None, modified=None):
+            calls.append((etag, modified))
+            if etag:
+                return {'status': 304, 'feed': {}, 'items': []}
+            return {'status': 200, 'etag': '"1"', 'feed': {'title': 'Foo'},
+                    'items': [{'title': 'bar'}]}
+        originalParse = RSS.plugin.feedparser.parse
+        RSS.plugin.feedparser.parse = parse
+        try:
+            feed = cb.getFeed('http://foo/')
+            del cb.lastRequest['http://foo/']
+            self.failUnless(cb.getFeed('http://foo/') is feed)
+            self.assertEqual(calls, [(None, None), ('"1"', None)])
+        finally:
+            RSS.plugin.feedparser.parse = originalParse
     def testRssAddBadName(self):
         self.assertError('rss add "foo bar" %s' % url)
 
@@ -88,17 +88,23 @@ class Scheduler(callbacks.Plugin):
                     raise
                                      
     def _flush(self):
+        # We pickle here, but leave the writing to the flusher thread.
+        data = ''
         try:
-            pklfd, tempfn = tempfile.mkstemp(suffix='scheduler', dir=datadir)
-            pkl = os.fdopen(pklfd, 'wb')
+            data = pickle.dumps(self.events)
+        except Exception, e:
+            self.log.warning('Unable to store pickled data: %s', e)
+        def write():
             try:
-                pickle.dump(self.events, pkl)
-            except Exception, e:
-                self.log.warning('Unable to store pickled data: %s', e)
-            pkl.close()
-            shutil.move(tempfn, filename)
-        except (IOError, shutil.Error), e:
-            self.log.warning('File error: %s', e)
+                pklfd, tempfn = tempfile.mkstemp(suffix='scheduler',
+                                                 dir=datadir)
+                pkl = os.fdopen(pklfd, 'wb')
+                pkl.write(data)
+                pkl.close()
+                shutil.move(tempfn, filename)
+            except (IOError, shutil.Error), e:
+                self.log.warning('File error: %s', e)
+        world.write(write)
 
     def die(self):
         self._flush()
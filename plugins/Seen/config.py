@@ -43,6 +43,11 @@ Seen = conf.registerPlugin('Seen')
 # This is where your configuration variables (if any) should go.  For example:
 # conf.registerGlobalValue(Seen, 'someConfigVariableName',
 #     registry.Boolean(False, """Help for someConfigVariableName."""))
+conf.registerGlobalValue(Seen, 'maximumWildcardMatches',
+    registry.NonNegativeInteger(20, """Determines the maximum number of nicks
+    the bot will list when asked about a nick with wildcards in it; the ones
+    seen most recently are listed.  If this is 0, all matching nicks are
+    listed."""))
 
 
 # vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
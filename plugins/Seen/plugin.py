@@ -30,6 +30,8 @@
 
 import re
 import time
+import heapq
+import bisect
 
 import supybot.log as log
 import supybot.conf as conf
@@ -37,7 +39,6 @@ import supybot.utils as utils
 import supybot.world as world
 import supybot.ircdb as ircdb
 from supybot.commands import *
-import supybot.irclib as irclib
 import supybot.ircmsgs as ircmsgs
 import supybot.plugins as plugins
 import supybot.ircutils as ircutils
@@ -52,6 +53,12 @@ class IrcStringAndIntDict(utils.InsensitivePreservingDict):
 
 class SeenDB(plugins.ChannelUserDB):
     IdDict = IrcStringAndIntDict
+    def __init__(self, filename):
+        # The lowercased nicks (not ids) seen in each channel, sorted, so
+        # seenWildcard can look at just those starting the right way.
+        self.nicks = ircutils.IrcDict()
+        plugins.ChannelUserDB.__init__(self, filename)
+
     def serialize(self, v):
         return list(v)
 
@@ -59,28 +66,52 @@ class SeenDB(plugins.ChannelUserDB):
         (seen, saying) = L
         return (float(seen), saying)
 
+    def __setitem__(self, (channel, id), v):
+        if isinstance(id, basestring) and (channel, id) not in self:
+            L = self.nicks.setdefault(channel, [])
+            bisect.insort(L, ircutils.toLower(id))
+        plugins.ChannelUserDB.__setitem__(self, (channel, id), v)
+
+    def __delitem__(self, (channel, id)):
+        plugins.ChannelUserDB.__delitem__(self, (channel, id))
+        if isinstance(id, basestring):
+            L = self.nicks[channel]
+            nick = ircutils.toLower(id)
+            i = bisect.bisect_left(L, nick)
+            if i < len(L) and L[i] == nick:
+                del L[i]
+
     def update(self, channel, nickOrId, saying):
         seen = time.time()
         self[channel, nickOrId] = (seen, saying)
         self[channel, '<last>'] = (seen, saying)
 
-    def seenWildcard(self, channel, nick):
-        nicks = ircutils.IrcSet()
-        nickRe = re.compile('^%s$' % '.*'.join(nick.split('*')), re.I)
-        for (searchChan, searchNick) in self.keys():
-            #print 'chan: %s ... nick: %s' % (searchChan, searchNick)
-            if isinstance(searchNick, int):
-                # We need to skip the reponses that are keyed by id as they
-                # apparently duplicate the responses for the same person that
-                # are keyed by nick-string
-                continue
-            if ircutils.strEqual(searchChan, channel):
-                if nickRe.search(searchNick) is not None:
-                    nicks.add(searchNick)
-        L = [[nick, self.seen(channel, nick)] for nick in nicks]
-        def negativeTime(x):
-            return -x[1][0]
-        utils.sortBy(negativeTime, L)
+    def seenWildcard(self, channel, nick, limit=0):
+        """Returns [nick, (seen, saying)] for the nicks seen in channel that
+        match nick, in which * matches anything, most recently seen first.
+        If limit isn't 0, only that many are returned."""
+        pattern = ircutils.toLower(nick)
+        # Only the nicks starting with what's before the first * can match.
+        prefix = pattern.split('*', 1)[0]
+        nickRe = re.compile('^%s$' % '.*'.join(map(re.escape,
+                                                   pattern.split('*'))))
+        if channel not in self.nicks:
+            return []
+        nicks = self.nicks[channel]
+        ids = self.channels[channel]
+        L = []
+        for i in xrange(bisect.bisect_left(nicks, prefix), len(nicks)):
+            searchNick = nicks[i]
+            if not searchNick.startswith(prefix):
+                break
+            if nickRe.match(searchNick) is not None:
+                (searchNick, info) = ids.data[searchNick]
+                L.append([searchNick, info])
+        def when(x):
+            return x[1][0]
+        if limit:
+            return heapq.nlargest(limit, L, key=when)
+        L.sort(key=when, reverse=True)
         return L
 
     def seen(self, channel, nickOrId):
@@ -96,8 +127,6 @@ class Seen(callbacks.Plugin):
         self.__parent.__init__(irc)
         self.db = SeenDB(filename)
         self.anydb = SeenDB(anyfilename)
-        self.lastmsg = {}
-        self.ircstates = {}
         world.flushers.append(self.db.flush)
         world.flushers.append(self.anydb.flush)
 
@@ -114,26 +143,6 @@ class Seen(callbacks.Plugin):
         self.anydb.close()
         self.__parent.die()
 
-    def __call__(self, irc, msg):
-        try:
-            if irc not in self.ircstates:
-                self._addIrc(irc)
-            self.ircstates[irc].addMsg(irc, self.lastmsg[irc])
-        finally:
-            self.lastmsg[irc] = msg
-        self.__parent.__call__(irc, msg)
-
-    def _addIrc(self, irc):
-        # Let's just be extra-special-careful here.
-        if irc not in self.ircstates:
-            self.ircstates[irc] = irclib.IrcState()
-        if irc not in self.lastmsg:
-            self.lastmsg[irc] = ircmsgs.ping('this is just a fake message')
-        if not world.testing:
-            for channel in irc.state.channels:
-                irc.queueMsg(ircmsgs.who(channel))
-                irc.queueMsg(ircmsgs.names(channel))
-
     def doPrivmsg(self, irc, msg):
         if ircmsgs.isCtcp(msg) and not ircmsgs.isAction(msg):
             return
@@ -163,17 +172,14 @@ class Seen(callbacks.Plugin):
 
     def doQuit(self, irc, msg):
         said = ircmsgs.prettyPrint(msg)
-        if irc not in self.ircstates:
-            return
         try:
             id = ircdb.users.getUserId(msg.prefix)
         except KeyError:
             id = None # Not in the database.
-        for channel in self.ircstates[irc].channels:
-            if msg.nick in self.ircstates[irc].channels[channel].users:
-                self.anydb.update(channel, msg.nick, said)
-                if id is not None:
-                    self.anydb.update(channel, id, said)
+        for channel in irc.state.previousChannels(msg):
+            self.anydb.update(channel, msg.nick, said)
+            if id is not None:
+                self.anydb.update(channel, id, said)
     doNick = doQuit
 
     def doMode(self, irc, msg):
@@ -190,7 +196,8 @@ class Seen(callbacks.Plugin):
         try:
             results = []
             if '*' in name:
-                results = db.seenWildcard(channel, name)
+                limit = self.registryValue('maximumWildcardMatches')
+                results = db.seenWildcard(channel, name, limit)
             else:
                 results = [[name, db.seen(channel, name)]]
             if len(results) == 1:
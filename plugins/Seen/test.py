@@ -29,6 +29,12 @@
 
 from supybot.test import *
 
+import os
+
+import supybot.plugin as plugin
+
+Seen = plugin.loadPluginModule('Seen')
+
 import supybot.ircdb as ircdb
 
 class ChannelDBTestCase(ChannelPluginTestCase):
@@ -72,6 +78,41 @@ class ChannelDBTestCase(ChannelPluginTestCase):
     def testSeenNoUser(self):
         self.assertNotRegexp('seen user alsdkfjalsdfkj', 'KeyError')
 
+class SeenDBTestCase(SupyTestCase):
+    def setUp(self):
+        SupyTestCase.setUp(self)
+        self.filename = conf.supybot.directories.data.dirize('SeenTest.db')
+        for filename in [self.filename, self.filename + '.journal']:
+            if os.path.exists(filename):
+                os.remove(filename)
+
+    def nicks(self, L):
+        return [nick for (nick, _) in L]
+
+    def testSeenWildcard(self):
+        db = Seen.plugin.SeenDB(self.filename)
+        for (i, nick) in enumerate(['foo', 'Foobar', 'bar', 'fo[o]', 'baz']):
+            db['#test', nick] = (i, 'said %s' % i)
+        db['#test', 1] = (10, 'said by id')
+        db['#other', 'foobaz'] = (11, 'elsewhere')
+        self.assertEqual(self.nicks(db.seenWildcard('#test', 'f*')),
+                         ['fo[o]', 'Foobar', 'foo'])
+        self.assertEqual(self.nicks(db.seenWildcard('#TEST', 'FO{*')),
+                         ['fo[o]'])
+        self.assertEqual(self.nicks(db.seenWildcard('#test', '*ba*')),
+                         ['baz', 'bar', 'Foobar'])
+        self.assertEqual(self.nicks(db.seenWildcard('#test', '*o', 2)),
+                         ['foo'])
+        self.assertEqual(self.nicks(db.seenWildcard('#test', '*', 2)),
+                         ['baz', 'fo[o]'])
+        self.assertEqual(db.seenWildcard('#nowhere', '*'), [])
+        del db['#test', 'baz']
+        self.assertEqual(self.nicks(db.seenWildcard('#test', 'b*')), ['bar'])
+        db.flush()
+        db = Seen.plugin.SeenDB(self.filename)
+        self.assertEqual(self.nicks(db.seenWildcard('#test', 'foo*')),
+                         ['Foobar', 'foo'])
+
 
 # vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
 
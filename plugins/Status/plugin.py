@@ -36,6 +36,7 @@ import multiprocessing
 import subprocess
 
 import supybot.conf as conf
+import supybot.ircdb as ircdb
 import supybot.utils as utils
 import supybot.world as world
 from supybot.commands import *
@@ -190,10 +191,14 @@ class Status(callbacks.Plugin):
             if isinstance(cb, callbacks.Plugin):
                 callbacksPlugin += 1
                 commands += len(cb.listCommands())
-        s = format('I offer a total of %n in %n.  I have processed %n.',
+        s = format('I offer a total of %n in %n.  I have processed %n.  '
+                   'I have answered %n from my capability cache and worked '
+                   'out %n.',
                    (commands, 'command'),
                    (callbacksPlugin, 'command-based', 'plugin'),
-                   (world.commandsProcessed, 'command'))
+                   (world.commandsProcessed, 'command'),
+                   (ircdb.capabilityCache.hits, 'capability check'),
+                   (ircdb.capabilityCache.misses, 'capability check'))
         irc.reply(s)
     cmd = wrap(cmd)
 
@@ -59,6 +59,7 @@ class StatusTestCase(PluginTestCase):
 
     def testCmd(self):
         self.assertNotError('cmd')
+        self.assertRegexp('cmd', 'capability cache')
 
     def testCommands(self):
         self.assertNotError('commands')
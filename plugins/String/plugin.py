@@ -147,8 +147,14 @@ class String(callbacks.Plugin):
             irc.error(s)
         else:
             t = self.registryValue('re.timeout')
+            if f is ff:
+                (target, targetArgs) = (commands.regexpReplace,
+                                        (ff.regexp, ff.replacement, ff.count))
+            else:
+                (target, targetArgs) = (commands.regexpMatch, (ff,))
             try:
-                v = commands.process(f, text, timeout=t, pn=self.name(), cn='re')
+                v = commands.processPool.apply(target, targetArgs + (text,),
+                                               timeout=t)
                 irc.reply(v)
             except commands.ProcessTimeoutError, e:
                 irc.error("ProcessTimeoutError: %s" % (e,))
@@ -53,6 +53,10 @@ class TodoRecord(dbi.Record):
 
 dataDir = conf.supybot.directories.data
 
+class TodoDB(dbi.DB):
+    Record = TodoRecord
+    textFields = ('task',)
+
 class FlatTodoDb(object):
     def __init__(self):
         self.directory = dataDir.dirize('Todo')
@@ -63,7 +67,7 @@ class FlatTodoDb(object):
     def _getDb(self, uid):
         dbfile = os.path.join(self.directory, str(uid))
         if uid not in self.dbs:
-            self.dbs[uid] = dbi.DB(dbfile, Record=TodoRecord)
+            self.dbs[uid] = TodoDB(dbfile)
         return self.dbs[uid]
 
     def close(self):
@@ -92,14 +96,14 @@ class FlatTodoDb(object):
         t.active = False
         db.set(tid, t)
 
-    def select(self, uid, criteria):
+    def select(self, uid, criteria, literals=()):
         db = self._getDb(uid)
         def match(todo):
             for p in criteria:
                 if not p(todo.task):
                     return False
             return True
-        todos = db.select(lambda t: match(t))
+        todos = db.search(literals, match)
         if not todos:
             raise dbi.NoRecordError
         return todos
@@ -227,16 +231,23 @@ class Todo(callbacks.Plugin):
         if not optlist and not globs:
             raise callbacks.ArgumentError
         criteria = []
+        literals = []
+        regexps = []
         for (option, arg) in optlist:
             if option == 'regexp':
-                criteria.append(lambda x: commands.regexp_wrapper(x, reobj=arg, 
-                        timeout=0.1, plugin_name = self.name(), fcn_name='search'))
-                criteria.append(arg.search)
+                literals.extend(dbi.regexpLiterals(arg))
+                regexps.append(arg)
         for glob in globs:
+            literals.extend(dbi.globLiterals(glob))
             glob = utils.python.glob2re(glob)
             criteria.append(re.compile(glob).search)
         try:
-            tasks = self.db.select(user.id, criteria)
+            tasks = list(self.db.select(user.id, criteria, literals))
+            for regexp in regexps:
+                matches = commands.processPool.search(regexp,
+                                                      [t.task for t in tasks],
+                                                      timeout=0.1)
+                tasks = [t for (t, m) in zip(tasks, matches) if m]
             L = [format('#%i: %s', t.id, self._shrink(t.task)) for t in tasks]
             irc.reply(format('%L', L))
         except dbi.NoRecordError:
@@ -132,20 +132,24 @@ class Topic(callbacks.Plugin):
         self.__parent.die()
 
     def _flush(self):
+        # We pickle here, but leave the writing to the flusher thread.
+        data = []
         try:
-            pklfd, tempfn = tempfile.mkstemp(suffix='topic', dir=datadir)
-            pkl = os.fdopen(pklfd, 'wb')
+            for x in (self.undos, self.redos,
+                      self.lastTopics, self.watchingFor332):
+                data.append(pickle.dumps(x))
+        except Exception, e:
+            self.log.warning('Unable to store pickled data: %s', e)
+        def write():
             try:
-                pickle.dump(self.undos, pkl)
-                pickle.dump(self.redos, pkl)
-                pickle.dump(self.lastTopics, pkl)
-                pickle.dump(self.watchingFor332, pkl)
-            except Exception, e:
-                self.log.warning('Unable to store pickled data: %s', e)
-            pkl.close()
-            shutil.move(tempfn, filename)
-        except (IOError, shutil.Error), e:
-            self.log.warning('File error: %s', e)
+                pklfd, tempfn = tempfile.mkstemp(suffix='topic', dir=datadir)
+                pkl = os.fdopen(pklfd, 'wb')
+                pkl.write(''.join(data))
+                pkl.close()
+                shutil.move(tempfn, filename)
+            except (IOError, shutil.Error), e:
+                self.log.warning('File error: %s', e)
+        world.write(write)
 
     def _splitTopic(self, topic, channel):
         separator = self.registryValue('separator', channel)
@@ -48,12 +48,13 @@ class UrlRecord(dbi.Record):
 class DbiUrlDB(plugins.DbiChannelDB):
     class DB(dbi.DB):
         Record = UrlRecord
+        textFields = ('url', 'near')
         def add(self, url, msg):
             record = self.Record(url=url, by=msg.nick,
                                  near=msg.args[1], at=msg.receivedAt)
             super(self.__class__, self).add(record)
-        def urls(self, p):
-            L = list(self.select(p))
+        def urls(self, p, literals=()):
+            L = list(self.search(literals, p))
             L.reverse()
             return L
 
@@ -105,6 +106,7 @@ class URL(callbacks.Plugin):
         itself.
         """
         predicates = []
+        literals = []
         f = None
         nolimit = False
         for (option, arg) in optlist:
@@ -116,15 +118,18 @@ class URL(callbacks.Plugin):
                 def f(record, arg=arg):
                     return ircutils.strEqual(record.by, arg)
             elif option == 'with':
+                literals.append(arg)
                 def f(record, arg=arg):
                     return arg in record.url.lower()
             elif option == 'without':
                 def f(record, arg=arg):
                     return arg not in record.url.lower()
             elif option == 'proto':
+                literals.append(arg)
                 def f(record, arg=arg):
                     return record.url.lower().startswith(arg)
             elif option == 'near':
+                literals.append(arg)
                 def f(record, arg=arg):
                     return arg in record.near.lower()
             if f is not None:
@@ -134,7 +139,8 @@ class URL(callbacks.Plugin):
                 if not predicate(record):
                     return False
             return True
-        urls = [record.url for record in self.db.urls(channel, predicate)]
+        urls = [record.url for record in
+                self.db.urls(channel, predicate, literals)]
         if not urls:
             irc.reply('No URLs matched that criteria.')
         else:
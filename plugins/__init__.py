@@ -38,9 +38,15 @@ import time
 import random
 import fnmatch
 import os.path
+import weakref
 import UserDict
 import threading
 
+try:
+    import sqlite3
+except ImportError:
+    from pysqlite2 import dbapi2 as sqlite3 # for python2.4
+
 import supybot.log as log
 import supybot.dbi as dbi
 import supybot.conf as conf
@@ -199,6 +205,268 @@ class ChannelDBHandler(object):
         gc.collect()
 
 
+class SqliteDB(object):
+    """Connections to SQLite database files, shared by a plugin's threads.
+
+    Each thread gets its own connection to each file, opened once and reused
+    for as long as the thread lives, so sqlite3's cache of prepared
+    statements stays warm.  The databases are put in WAL mode, so readers
+    don't wait for writers.
+
+    Writes that needn't happen right away -- counter increments, mostly --
+    can be passed to later and increment.  They're done in a single
+    transaction the next time the file is connected to, or when the flushers
+    are run, whichever comes first; increments of the same counter are added
+    together first.  A statement that fails is logged and dropped; if the
+    database itself can't be written, the whole batch is tried again next
+    time.
+
+    create is called with the connection to a file that didn't exist yet,
+    and prepare with every new connection.
+    """
+    pragmas = ['PRAGMA journal_mode=WAL',
+               'PRAGMA synchronous=NORMAL',
+               'PRAGMA temp_store=MEMORY']
+    cachedStatements = 200
+    def __init__(self, create=None, prepare=None):
+        self.create = create
+        self.prepare = prepare
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.threads = weakref.WeakKeyDictionary() # thread -> connections
+        self.pending = {} # filename -> ([[sql, args], ...], {(sql, key): L})
+        world.flushers.append(self.flush)
+
+    def _connections(self):
+        try:
+            return self.local.connections
+        except AttributeError:
+            connections = self.local.connections = {}
+            self.lock.acquire()
+            try:
+                self.threads[threading.currentThread()] = connections
+            finally:
+                self.lock.release()
+            return connections
+
+    def connect(self, filename):
+        """Returns this thread's connection to filename, once any writes
+        pending for it have been done."""
+        connections = self._connections()
+        try:
+            db = connections[filename]
+        except KeyError:
+            new = not os.path.exists(filename)
+            # close() may be called from a thread other than ours.
+            db = sqlite3.connect(filename, check_same_thread=False,
+                                 cached_statements=self.cachedStatements)
+            db.text_factory = str
+            for pragma in self.pragmas:
+                db.execute(pragma)
+            if self.prepare is not None:
+                self.prepare(db)
+            if new and self.create is not None:
+                self.create(db)
+                db.commit()
+            connections[filename] = db
+        if filename in self.pending:
+            self._write(filename, db)
+        return db
+
+    def _pending(self, filename):
+        try:
+            return self.pending[filename]
+        except KeyError:
+            pending = self.pending[filename] = ([], {})
+            return pending
+
+    def later(self, filename, sql, args=()):
+        """Executes sql on filename with the next batch of writes."""
+        self.lock.acquire()
+        try:
+            self._pending(filename)[0].append([sql, args])
+        finally:
+            self.lock.release()
+
+    def increment(self, filename, sql, key, n=1):
+        """Executes sql, which should take the amount to increment by and the
+        key of what to increment (in that order), on filename with the next
+        batch of writes."""
+        self.lock.acquire()
+        try:
+            (statements, counters) = self._pending(filename)
+            try:
+                counters[sql, key][1][0] += n
+            except KeyError:
+                counter = counters[sql, key] = [sql, [n, key]]
+                statements.append(counter)
+        finally:
+            self.lock.release()
+
+    def _write(self, filename, db):
+        self.lock.acquire()
+        try:
+            (statements, _) = self.pending.pop(filename, ([], None))
+        finally:
+            self.lock.release()
+        if not statements:
+            return
+        autocommit = db.isolation_level is None
+        cursor = db.cursor()
+        try:
+            if autocommit:
+                cursor.execute('BEGIN')
+            for (sql, args) in statements:
+                try:
+                    cursor.execute(sql, args)
+                except sqlite3.OperationalError:
+                    raise
+                except Exception, e:
+                    log.warning('Dropping write to %s (%s): %s',
+                                filename, sql, utils.exnToString(e))
+            if autocommit:
+                cursor.execute('COMMIT')
+            else:
+                db.commit()
+        except sqlite3.OperationalError, e:
+            log.warning('Couldn\'t write to %s, will try again later: %s',
+                        filename, utils.exnToString(e))
+            try:
+                if autocommit:
+                    cursor.execute('ROLLBACK')
+                else:
+                    db.rollback()
+            except sqlite3.Error:
+                pass # No transaction was started.
+            self.lock.acquire()
+            try:
+                self._pending(filename)[0][0:0] = statements
+            finally:
+                self.lock.release()
+
+    def flush(self):
+        """Does all the pending writes."""
+        for filename in self.pending.keys():
+            self.connect(filename)
+
+    def close(self):
+        """Does all the pending writes, and closes every thread's
+        connections."""
+        if self.flush in world.flushers:
+            world.flushers.remove(self.flush)
+        self.flush()
+        self.lock.acquire()
+        try:
+            for connections in self.threads.values():
+                for db in connections.values():
+                    db.close()
+                connections.clear()
+        finally:
+            self.lock.release()
+
+
+class SqliteTrigramIndex(object):
+    """The trigrams (see dbi.trigrams) of the texts in one column of a table
+    of an SQLite database, kept in a table of their own, <column>_trigrams,
+    so looking for the rows whose text contains (or is close to) some string
+    only has to look at the rows that could.  The table has to have an
+    INTEGER PRIMARY KEY named id.
+    """
+    maxTrigrams = 500 # Keeps us well under sqlite's limit on parameters.
+    def __init__(self, table, column, padded=False):
+        self.table = table
+        self.column = column
+        self.padded = padded
+        self.trigramTable = '%s_trigrams' % column
+        self.idColumn = '%s_id' % column
+
+    def create(self, cursor):
+        """Creates the trigram table, for a new database."""
+        cursor.execute("""CREATE TABLE %s (
+                          trigram TEXT,
+                          %s INTEGER
+                          )""" % (self.trigramTable, self.idColumn))
+        cursor.execute("""CREATE INDEX %s_trigram ON %s (trigram)""" %
+                       (self.trigramTable, self.trigramTable))
+        cursor.execute("""CREATE INDEX %s_%s ON %s (%s)""" %
+                       (self.trigramTable, self.idColumn,
+                        self.trigramTable, self.idColumn))
+
+    def prepare(self, db):
+        """Creates and fills in the trigram table of a database from before
+        the column was indexed."""
+        cursor = db.cursor()
+        cursor.execute("""SELECT name FROM sqlite_master
+                          WHERE type='table'""")
+        tables = [name for (name,) in cursor.fetchall()]
+        if self.table in tables and self.trigramTable not in tables:
+            self.create(cursor)
+            cursor.execute("""SELECT id, %s FROM %s""" %
+                           (self.column, self.table))
+            for (id, text) in cursor.fetchall():
+                self.add(cursor, id, text)
+            db.commit()
+
+    def trigrams(self, text):
+        return dbi.trigrams(text, self.padded)
+
+    def add(self, cursor, id, text):
+        cursor.executemany("""INSERT INTO %s VALUES (?, ?)""" %
+                           self.trigramTable,
+                           [(trigram, id) for trigram in self.trigrams(text)])
+
+    def remove(self, cursor, id):
+        cursor.execute("""DELETE FROM %s WHERE %s = ?""" %
+                       (self.trigramTable, self.idColumn), (id,))
+
+    def sharing(self, trigrams, missing=0):
+        """Returns an SQL condition, and its arguments, selecting the rows
+        whose text has all but <missing> of trigrams, or None if that doesn't
+        rule any out."""
+        trigrams = sorted(trigrams)[:self.maxTrigrams]
+        minimum = len(trigrams) - missing
+        if minimum <= 0:
+            return None
+        sql = """id IN (SELECT %s FROM %s WHERE trigram IN (%s)
+                        GROUP BY %s HAVING COUNT(*) >= ?)""" % \
+              (self.idColumn, self.trigramTable,
+               ', '.join(['?'] * len(trigrams)), self.idColumn)
+        return (sql, trigrams + [minimum])
+
+    def containing(self, s):
+        """Returns what sharing does for the rows whose text might contain s
+        (ignoring case)."""
+        return self.sharing(dbi.trigrams(s))
+
+
+class SqliteChannelDBHandler(ChannelDBHandler):
+    """A ChannelDBHandler for SQLite databases, whose connections are
+    managed by an SqliteDB."""
+    def __init__(self, suffix='.db'):
+        ChannelDBHandler.__init__(self, suffix)
+        self.sqlite = SqliteDB(create=self.createDb, prepare=self.prepareDb)
+
+    def createDb(self, db):
+        """Override this to create the tables of a new database."""
+        raise NotImplementedError
+
+    def prepareDb(self, db):
+        """Override this to set up each new connection to a database."""
+        pass
+
+    def makeDb(self, filename):
+        return self.sqlite.connect(filename)
+
+    def getDb(self, channel):
+        """Use this to get a database for a specific channel."""
+        db = self.makeDb(self.makeFilename(channel))
+        db.isolation_level = None
+        return db
+
+    def die(self):
+        self.sqlite.close()
+
+
 class DbiChannelDB(object):
     """This just handles some of the general stuff for Channel DBI databases.
     Check out ChannelIdDatabasePlugin for an example of how to use this."""
@@ -263,20 +531,83 @@ class ChannelUserDictionary(UserDict.DictMixin):
 #     would very much feel like an extension, rather than part of the db
 #     itself.
 class ChannelUserDB(ChannelUserDictionary):
+    """A ChannelUserDictionary stored in a CSV file.
+
+    Flushing only appends the records that changed since the last flush to a
+    journal next to the file; the file itself is rewritten only when the
+    journal gets larger than
+    supybot.databases.types.channelUser.maximumJournalSize.  Both files start
+    with the generation of the last rewrite, so a journal left behind by a
+    rewrite that didn't get to remove it is ignored.  The records are
+    serialized when the database is flushed, but written by the flusher
+    thread (see world.write).  Changes are
+    noticed through __setitem__ and __delitem__, so a value that is modified
+    in place must be set again to be written out.
+    """
+    generationTag = '!generation'
     def __init__(self, filename):
         ChannelUserDictionary.__init__(self)
         self.filename = filename
+        self.journalName = filename + '.journal'
+        self.dirty = set()
+        self.records = 0 # Rows in the file at our last rewrite.
+        self.journaled = 0 # Rows in the journal since then.
+        self.generation = 0 # Bumped by every rewrite.
         try:
             fd = file(self.filename)
         except EnvironmentError, e:
             log.warning('Couldn\'t open %s: %s.', self.filename, e)
-            return
+        else:
+            try:
+                self.generation = self._readGeneration(fd)
+                self.records = self._readRows(fd, self.filename)
+            finally:
+                fd.close()
+        stale = False
+        try:
+            fd = file(self.journalName)
+        except EnvironmentError:
+            pass
+        else:
+            try:
+                if self._readGeneration(fd) < self.generation:
+                    log.warning('Ignoring %s, it predates %s.',
+                                self.journalName, self.filename)
+                    stale = True
+                else:
+                    self.journaled = self._readRows(fd, self.journalName,
+                                                    journal=True)
+            finally:
+                fd.close()
+        if stale:
+            try:
+                os.remove(self.journalName)
+            except EnvironmentError, e:
+                log.warning('Couldn\'t remove %s: %s.', self.journalName, e)
+        self.dirty.clear()
+
+    def _readGeneration(self, fd):
+        """Reads the generation row at the start of fd, if there is one.
+        Files written before generations were recorded are generation 0."""
+        line = fd.readline()
+        if line.startswith(self.generationTag + ','):
+            try:
+                return int(line.split(',')[1])
+            except ValueError:
+                log.warning('Invalid generation in %s.', fd.name)
+                return 0
+        fd.seek(0)
+        return 0
+
+    def _readRows(self, fd, filename, journal=False):
         reader = csv.reader(fd)
+        lineno = 0
         try:
-            lineno = 0
             for t in reader:
                 lineno += 1
                 try:
+                    if journal:
+                        op = t.pop(0)
                     channel = t.pop(0)
                     id = t.pop(0)
                     try:
@@ -284,37 +615,90 @@ class ChannelUserDB(ChannelUserDictionary):
                     except ValueError:
                         # We'll skip over this so, say, nicks can be kept here.
                         pass
+                    if journal and op == '-':
+                        if (channel, id) in self:
+                            del self[channel, id]
+                        continue
                     v = self.deserialize(channel, id, t)
                     self[channel, id] = v
                 except Exception, e:
-                    log.warning('Invalid line #%s in %s.',
-                                lineno, self.__class__.__name__)
+                    log.warning('Invalid line #%s in %s.', lineno, filename)
                     log.debug('Exception: %s', utils.exnToString(e))
         except Exception, e: # This catches exceptions from csv.reader.
-            log.warning('Invalid line #%s in %s.',
-                        lineno, self.__class__.__name__)
+            log.warning('Invalid line #%s in %s.', lineno, filename)
             log.debug('Exception: %s', utils.exnToString(e))
+        return lineno
+
+    def __setitem__(self, (channel, id), v):
+        ChannelUserDictionary.__setitem__(self, (channel, id), v)
+        self.dirty.add((channel, id))
+
+    def __delitem__(self, (channel, id)):
+        ChannelUserDictionary.__delitem__(self, (channel, id))
+        self.dirty.add((channel, id))
 
     def flush(self):
-        fd = utils.file.AtomicFile(self.filename, makeBackupIfSmaller=False)
-        writer = csv.writer(fd)
-        items = self.items()
-        if not items:
-            log.debug('%s: Refusing to write blank file.',
-                      self.__class__.__name__)
-            fd.rollback()
+        if not self.dirty:
             return
-        items.sort()
-        for ((channel, id), v) in items:
+        ratio = conf.supybot.databases.types.channelUser.maximumJournalSize()
+        if self.journaled + len(self.dirty) <= ratio * self.records or \
+           not self._rewrite():
+            self._appendJournal()
+
+    def _appendJournal(self):
+        rows = []
+        for (channel, id) in self.dirty:
+            if (channel, id) in self:
+                L = self.serialize(self[channel, id])
+                L[0:0] = ['+', channel, id]
+            else:
+                L = ['-', channel, id]
+            rows.append(L)
+        self.journaled += len(rows)
+        self.dirty.clear()
+        generation = self.generation
+        def write():
+            if not os.path.exists(self.journalName):
+                rows.insert(0, [self.generationTag, generation])
+            fd = file(self.journalName, 'a')
+            try:
+                csv.writer(fd).writerows(rows)
+            finally:
+                fd.close()
+        world.write(write)
+
+    def _rewrite(self):
+        rows = []
+        for ((channel, id), v) in self.iteritems():
             L = self.serialize(v)
             L.insert(0, id)
             L.insert(0, channel)
-            writer.writerow(L)
-        fd.close()
+            rows.append(L)
+        if not rows:
+            log.debug('%s: Refusing to write blank file.',
+                      self.__class__.__name__)
+            return False
+        self.records = len(rows)
+        self.journaled = 0
+        self.generation += 1
+        self.dirty.clear()
+        generation = self.generation
+        def write():
+            rows.sort()
+            rows.insert(0, [self.generationTag, generation])
+            fd = utils.file.AtomicFile(self.filename, makeBackupIfSmaller=False,
+                                       sync=True)
+            csv.writer(fd).writerows(rows)
+            fd.close()
+            if os.path.exists(self.journalName):
+                os.remove(self.journalName)
+        world.write(write)
+        return True
 
     def close(self):
         self.flush()
-        self.clear()
+        self.channels.clear()
+        self.dirty.clear()
 
     def deserialize(self, channel, id, L):
         """Should take a list of strings and return an object to be accessed
@@ -345,6 +729,7 @@ class ChannelIdDatabasePlugin(callbacks.Plugin):
                     'by',
                     'text'
                     ]
+            textFields = ('text',)
             def add(self, at, by, text, **kwargs):
                 record = self.Record(at=at, by=by, text=text, **kwargs)
                 return super(self.__class__, self).add(record)
@@ -428,19 +813,28 @@ class ChannelIdDatabasePlugin(callbacks.Plugin):
                     return False
             return True
 
+        # Only the records containing these need to be checked any further.
+        literals = []
+        regexps = []
         for (opt, arg) in optlist:
             if opt == 'by':
                 predicates.append(lambda r, arg=arg: r.by == arg.id)
             elif opt == 'regexp':
-                predicates.append(lambda x: commands.regexp_wrapper(x.text, reobj=arg, 
-                        timeout=0.1, plugin_name = self.name(), fcn_name='search'))
-                #predicates.append(lambda r, arg=arg: arg.search(r.text))
+                literals.extend(dbi.regexpLiterals(arg))
+                regexps.append(arg)
         if glob:
+            literals.extend(dbi.globLiterals(glob))
             def globP(r, glob=glob.lower()):
                 return fnmatch.fnmatch(r.text.lower(), glob)
             predicates.append(globP)
+        records = list(self.db.search(channel, literals, p))
+        for regexp in regexps:
+            matches = commands.processPool.search(regexp,
+                                                  [r.text for r in records],
+                                                  timeout=0.1)
+            records = [r for (r, m) in zip(records, matches) if m]
         L = []
-        for record in self.db.select(channel, p):
+        for record in records:
             L.append(self.searchSerializeRecord(record))
         if L:
             L.sort()
@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+
+###
+# Copyright (c) 2010, James Vega
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+###
+
+"""
+Compares lookup throughput of cdb.Reader against the old seek-and-read
+reader it replaced, on a database of (by default) 1,000,000 keys.
+
+Usage: cdblookup.py [number of keys] [number of lookups]
+
+The database is built in a temporary directory and removed afterwards.
+"""
+
+from __future__ import division
+
+import os
+import sys
+import time
+import random
+import shutil
+import tempfile
+
+import supybot.cdb as cdb
+
+class OldReader(object):
+    """Just the lookup path of the old cdb.Reader."""
+    def __init__(self, filename):
+        self.fd = file(filename, 'r')
+        self.loop = 0
+
+    def _read(self, len, pos):
+        self.fd.seek(pos)
+        return self.fd.read(len)
+
+    def __getitem__(self, key):
+        self.loop = 0
+        self.khash = cdb.hash(key)
+        (self.hpos, self.hslots) = cdb.unpack2Ints(self._read(8,
+                                                   (self.khash * 8) & 2047))
+        if not self.hslots:
+            raise KeyError, key
+        self.kpos = self.hpos + (((self.khash / 256) % self.hslots) * 8)
+        while self.loop < self.hslots:
+            (h, p) = cdb.unpack2Ints(self._read(8, self.kpos))
+            if p == 0:
+                break
+            self.loop += 1
+            self.kpos += 8
+            if self.kpos == self.hpos + (self.hslots * 8):
+                self.kpos = self.hpos
+            if h == self.khash:
+                (u, dlen) = cdb.unpack2Ints(self._read(8, p))
+                if u == len(key) and self._read(u, p+8) == key:
+                    return self._read(dlen, p + 8 + u)
+        raise KeyError, key
+
+    def close(self):
+        self.fd.close()
+
+def build(filename, n):
+    maker = cdb.Maker(filename)
+    for i in xrange(n):
+        maker.add('key%s' % i, 'value%s' % i)
+    maker.finish()
+
+def timeit(name, n, f):
+    started = time.time()
+    f()
+    elapsed = time.time() - started
+    print '  %s: %s lookups in %.3f seconds (%.0f lookups/s)' % \
+          (name, n, elapsed, n / elapsed)
+
+def main():
+    n = 1000000
+    lookups = 100000
+    if len(sys.argv) > 1:
+        n = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        lookups = int(sys.argv[2])
+    dirname = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(dirname, 'benchmark.cdb')
+        started = time.time()
+        build(filename, n)
+        print 'Built a %s-key database in %.1f seconds.' % \
+              (n, time.time() - started)
+        keys = ['key%s' % random.randrange(n * 2) for _ in xrange(lookups)]
+        old = OldReader(filename)
+        new = cdb.Reader(filename)
+        def oldLookups():
+            for key in keys:
+                try:
+                    old[key]
+                except KeyError:
+                    pass
+        def newLookups():
+            for key in keys:
+                new.get(key)
+        print 'Looking up %s random keys, half of them missing:' % lookups
+        timeit('old Reader', lookups, oldLookups)
+        timeit('Reader', lookups, newLookups)
+        timeit('Reader.getmany', lookups, lambda: new.getmany(keys))
+        old.close()
+        new.close()
+    finally:
+        shutil.rmtree(dirname)
+
+if __name__ == '__main__':
+    main()
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+
+###
+# Copyright (c) 2010, James Vega
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+###
+
+
+"""
+Times parsing raw IRC lines into IrcMsg objects.
+
+Usage: parse.py [capture file]
+
+The capture file should contain raw IRC lines, as received from a server.  If
+none is given, the burst from receive.py is used, mixed with channel chatter.
+Parsing is timed on its own and with every message's nick accessed, since
+most plugins never look at the user or host of most messages.
+"""
+
+from __future__ import division
+
+import os
+import sys
+import time
+
+import supybot.ircmsgs as ircmsgs
+
+def chatter(n=100000):
+    L = []
+    for i in xrange(n):
+        L.append(':nick%s!~user@host%s.example.com PRIVMSG #channel%s :'
+                 'this is line %s of some channel chatter' %
+                 (i % 300, i % 977, i % 50, i))
+    return L
+
+def main():
+    if len(sys.argv) > 1:
+        fd = file(sys.argv[1])
+        lines = [line.rstrip('\r\n') for line in fd if line.strip()]
+        fd.close()
+    else:
+        sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+        import receive
+        lines = receive.burst() + chatter()
+    print 'Parsing %s lines.' % len(lines)
+    IrcMsg = ircmsgs.IrcMsg
+    started = time.time()
+    for line in lines:
+        IrcMsg(line)
+    elapsed = time.time() - started
+    print 'Parsing: %.3f seconds (%.0f lines/s)' % \
+          (elapsed, len(lines) / elapsed)
+    started = time.time()
+    for line in lines:
+        IrcMsg(line).nick
+    elapsed = time.time() - started
+    print 'Parsing and accessing .nick: %.3f seconds (%.0f lines/s)' % \
+          (elapsed, len(lines) / elapsed)
+
+if __name__ == '__main__':
+    main()
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+
+###
+# Copyright (c) 2010, James Vega
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+###
+
+"""
+Fans a batch of announcements out to many channels through IrcMsgQueue, and
+through the old list-based queue (with its linear duplicate check) for
+comparison.  Then drains the queue through FloodControl against a simulated
+server enforcing RFC 1459's flood rule, to show the bot never gets
+disconnected for excess flood.
+
+Usage: queue.py [channels] [messages per channel]
+"""
+
+from __future__ import division
+
+import sys
+import time
+
+import supybot.conf as conf
+import supybot.irclib as irclib
+import supybot.ircmsgs as ircmsgs
+
+class OldQueue(object):
+    """The three-list queue IrcMsgQueue used to be."""
+    def __init__(self):
+        self.high = []
+        self.normal = []
+        self.low = []
+
+    def enqueue(self, msg):
+        if msg in self:
+            return False
+        if msg.command in irclib._high:
+            self.high.append(msg)
+        elif msg.command in irclib._low:
+            self.low.append(msg)
+        else:
+            self.normal.append(msg)
+        return True
+
+    def dequeue(self):
+        for L in (self.high, self.normal, self.low):
+            if L:
+                return L.pop(0)
+
+    def __contains__(self, msg):
+        return msg in self.normal or msg in self.low or msg in self.high
+
+def announcements(channels, n):
+    L = []
+    for i in xrange(n):
+        for j in xrange(channels):
+            L.append(ircmsgs.privmsg('#channel%s' % j,
+                                     'Headline number %s: something happened'
+                                     % i))
+    return L
+
+def fill(q, msgs):
+    started = time.time()
+    for msg in msgs:
+        q.enqueue(msg)
+    enqueued = time.time() - started
+    started = time.time()
+    while q.dequeue() is not None:
+        pass
+    return (enqueued, time.time() - started)
+
+class FloodingServer(object):
+    """A server which disconnects clients whose penalty timer gets more than
+    limit seconds ahead of the current time."""
+    def __init__(self, penalty=2, limit=10):
+        self.timer = 0
+        self.limit = limit
+        self.penalty = penalty
+
+    def receive(self, now):
+        self.timer = max(self.timer, now) + self.penalty
+        return self.timer - now <= self.limit
+
+def drain(msgs, seconds=600, tick=0.1):
+    network = conf.registerNetwork('benchmark')
+    network.throttleTime.setValue(2.0)
+    network.throttleTime.burst.setValue(8.0)
+    q = irclib.IrcMsgQueue(msgs)
+    fc = irclib.FloodControl('benchmark')
+    server = FloodingServer()
+    sent = 0
+    firsts = {}
+    now = 0.0
+    while q and now < seconds:
+        while q and fc.ready(now):
+            msg = q.dequeue()
+            fc.sent(msg, now)
+            if not server.receive(now):
+                print '  Excess flood after %s messages at %.1fs!' % \
+                      (sent, now)
+                return
+            firsts.setdefault(msg.args[0], now)
+            sent += 1
+        now += tick
+    print '  %s messages in %.0f simulated seconds (%.2f messages/s), ' \
+          'no excess flood.' % (sent, now, sent / now)
+    print '  Every channel got its first message within %.0f seconds.' % \
+          max(firsts.itervalues())
+
+def main():
+    channels = 50
+    n = 40
+    if len(sys.argv) > 1:
+        channels = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        n = int(sys.argv[2])
+    msgs = announcements(channels, n)
+    print 'Queuing %s messages to %s channels.' % (len(msgs), channels)
+    for (name, q) in [('old queue', OldQueue()),
+                      ('IrcMsgQueue', irclib.IrcMsgQueue())]:
+        (enqueued, dequeued) = fill(q, msgs)
+        print '  %s: enqueue %.3f seconds (%.0f msgs/s), ' \
+              'dequeue %.3f seconds (%.0f msgs/s)' % \
+              (name, enqueued, len(msgs) / enqueued,
+               dequeued, len(msgs) / dequeued)
+    print 'Sending to a server with a 2 second penalty and 10 second limit:'
+    drain(msgs[:300])
+
+if __name__ == '__main__':
+    main()
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
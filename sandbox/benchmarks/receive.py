@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+
+###
+# Copyright (c) 2010, James Vega
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+###
+
+"""
+Replays a burst of IRC traffic through SocketDriver's receive path, and
+through the old string-concatenation receive loop for comparison.
+
+Usage: receive.py [capture file]
+
+The capture file should contain raw IRC lines, as received from a server.  If
+none is given, a 100,000-line netjoin-style burst (JOINs, NAMES and WHO
+replies) is generated.
+"""
+
+from __future__ import division
+
+import sys
+import time
+import socket
+import threading
+
+import supybot.drivers as drivers
+
+def burst(n=100000):
+    L = []
+    for i in xrange(n):
+        nick = 'nick%s' % i
+        host = 'host%s.example.com' % (i % 977)
+        if i % 3 == 0:
+            L.append(':%s!~user@%s JOIN :#channel%s' % (nick, host, i % 50))
+        elif i % 3 == 1:
+            L.append(':irc.example.com 352 bot #channel%s ~user %s '
+                     'irc.example.com %s H :0 Real Name' %
+                     (i % 50, host, nick))
+        else:
+            names = ' '.join(['@nick%s' % j for j in xrange(i, i+40)])
+            L.append(':irc.example.com 353 bot = #channel%s :%s' %
+                     (i % 50, names))
+    return L
+
+class FakeIrc(object):
+    def __init__(self):
+        self.count = 0
+
+    def feedMsg(self, msg):
+        self.count += 1
+
+def replay(data, read, parse):
+    (server, client) = socket.socketpair()
+    def send():
+        server.sendall(data)
+        server.close()
+    t = threading.Thread(target=send)
+    t.start()
+    irc = FakeIrc()
+    started = time.time()
+    read(client, irc, parse)
+    elapsed = time.time() - started
+    t.join()
+    client.close()
+    return (irc.count, elapsed)
+
+def oldRead(conn, irc, parse):
+    inbuffer = ''
+    while True:
+        s = conn.recv(1024)
+        if not s:
+            break
+        inbuffer += s
+        lines = inbuffer.split('\n')
+        inbuffer = lines.pop()
+        for line in lines:
+            msg = parse(line)
+            if msg is not None:
+                irc.feedMsg(msg)
+
+def newRead(conn, irc, parse):
+    inbuffer = drivers.ReceiveBuffer()
+    while inbuffer.recv(conn):
+        for line in inbuffer.lines():
+            msg = parse(line)
+            if msg is not None:
+                irc.feedMsg(msg)
+
+def main():
+    if len(sys.argv) > 1:
+        fd = file(sys.argv[1])
+        lines = [line.rstrip('\r\n') for line in fd]
+        fd.close()
+    else:
+        lines = burst()
+    data = '\r\n'.join(lines) + '\r\n'
+    print 'Replaying %s lines (%s bytes).' % (len(lines), len(data))
+    for (what, parse) in [('framing only', lambda s: s.strip() or None),
+                          ('framing and parsing', drivers.parseMsg)]:
+        print '%s:' % what.capitalize()
+        for (name, read) in [('string concatenation', oldRead),
+                             ('ReceiveBuffer', newRead)]:
+            (count, elapsed) = replay(data, read, parse)
+            print '  %s: %s lines in %.3f seconds (%.0f lines/s)' % \
+                  (name, count, elapsed, count / elapsed)
+
+if __name__ == '__main__':
+    main()
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
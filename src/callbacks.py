@@ -358,6 +358,18 @@ def tokenize(s, channel=None):
 def formatCommand(command):
     return ' '.join(command)
 
+def isIgnored(msg):
+    """Returns whether the sender of msg is ignored by its recipient.  The
+    answer is remembered in the message's 'isIgnored' tag, so it's only worked
+    out once however many plugins ask."""
+    ignored = msg.tagged('isIgnored')
+    if ignored is None:
+        # Some services implementations send from non-user hostmasks.
+        ignored = ircutils.isUserHostmask(msg.prefix) and \
+                  ircdb.checkIgnored(msg.prefix, msg.args[0])
+        msg.tag('isIgnored', ignored)
+    return ignored
+
 def checkCommandCapability(msg, cb, commandName):
     assert isinstance(commandName, basestring), commandName
     plugin = cb.name().lower()
@@ -572,6 +584,69 @@ class ReplyIrcProxy(RichReplyMethods):
 
 SimpleProxy = ReplyIrcProxy # Backwards-compatibility
 
+###
+# Rather than asking every callback whether the args we're given are one of
+# its commands, NestedCommandsIrcProxy only asks those callbacks that have a
+# command starting with the first of the args.  The index is rebuilt when the
+# list of callbacks changes, or when commandsChanged is called.
+###
+_commandsGeneration = 0
+def commandsChanged():
+    """Tells the command index that the commands provided by some callback
+    have changed (e.g., because one was added, removed, renamed, disabled, or
+    enabled)."""
+    global _commandsGeneration
+    _commandsGeneration += 1
+
+class CommandIndex(object):
+    """Maps the first word of each command to the callbacks (in the order
+    they're called) that might have a command starting with that word."""
+    def __init__(self):
+        self.callbacks = None
+        self.generation = None
+        self.index = {}
+        self.wildcards = []
+
+    def _firstWords(self, cb):
+        words = set([cb.canonicalName()])
+        for command in cb.listCommands():
+            words.add(canonicalName(command.split()[0]))
+        for nested in cb.cbs:
+            words.add(nested.canonicalName())
+        return words
+
+    def rebuild(self, callbacks):
+        generation = _commandsGeneration
+        index = {}
+        wildcards = []
+        for cb in callbacks:
+            if not hasattr(cb, 'getCommand'):
+                continue
+            if getattr(cb.getCommand, 'im_func', None) is not \
+               Commands.getCommand.im_func:
+                # We can't know what it considers a command, so we'll have to
+                # ask it about all of them.
+                wildcards.append(cb)
+                for L in index.itervalues():
+                    L.append(cb)
+                continue
+            for word in self._firstWords(cb):
+                if word not in index:
+                    index[word] = wildcards[:]
+                index[word].append(cb)
+        (self.index, self.wildcards) = (index, wildcards)
+        self.callbacks = callbacks[:]
+        self.generation = generation
+
+    def get(self, callbacks, word):
+        """Returns the callbacks which might have a command starting with
+        word."""
+        if self.generation != _commandsGeneration or \
+           self.callbacks != callbacks:
+            self.rebuild(callbacks)
+        return self.index.get(word, self.wildcards)
+
+
 class NestedCommandsIrcProxy(ReplyIrcProxy):
     "A proxy object to allow proper nesting of commands (even threaded ones)."
     _mores = ircutils.IrcDict()
@@ -691,9 +766,12 @@ class NestedCommandsIrcProxy(ReplyIrcProxy):
         args = map(canonicalName, args)
         cbs = []
         maxL = []
-        for cb in self.irc.callbacks:
-            if not hasattr(cb, 'getCommand'):
-                continue
+        irc = self.getRealIrc()
+        try:
+            index = irc.commandIndex
+        except AttributeError:
+            index = irc.commandIndex = CommandIndex()
+        for cb in index.get(irc.callbacks, args[0]):
             L = cb.getCommand(args)
             #log.debug('%s.getCommand(%r) returned %r', cb.name(), args, L)
             if L and L >= maxL:
@@ -1048,6 +1126,7 @@ class DisabledCommands(object):
                     self.d[command].add(plugin)
             else:
                 self.d[command] = CanonicalNameSet([plugin])
+        commandsChanged()
 
     def remove(self, command, plugin=None):
         if plugin is None:
@@ -1055,6 +1134,7 @@ class DisabledCommands(object):
         else:
             if self.d[command] is not None:
                 self.d[command].remove(plugin)
+        commandsChanged()
 
 class BasePlugin(object):
     def __init__(self, *args, **kwargs):
@@ -1073,6 +1153,18 @@ class BasePlugin(object):
 class SynchronizedAndFirewalled(log.MetaFirewall, utils.python.Synchronized):
     pass # Necessary for the metaclass compatibility issue.
 
+_commandArgsCache = {}
+def _getCommandArgs(method):
+    """Returns the names of the arguments method takes, caching them by its
+    code object."""
+    code = method.im_func.func_code
+    try:
+        return _commandArgsCache[code]
+    except KeyError:
+        args = inspect.getargs(code)[0]
+        _commandArgsCache[code] = args
+        return args
+
 class Commands(BasePlugin):
     __metaclass__ = SynchronizedAndFirewalled
     __synchronized__ = (
@@ -1112,8 +1204,7 @@ class Commands(BasePlugin):
         if hasattr(self, name):
             method = getattr(self, name)
             if inspect.ismethod(method):
-                code = method.im_func.func_code
-                return inspect.getargs(code)[0] == self.commandArgs
+                return _getCommandArgs(method) == self.commandArgs
             else:
                 return False
         else:
@@ -1158,8 +1249,7 @@ class Commands(BasePlugin):
         else:
             method = getattr(self, command[0])
             if inspect.ismethod(method):
-                code = method.im_func.func_code
-                if inspect.getargs(code)[0] == self.commandArgs:
+                if _getCommandArgs(method) == self.commandArgs:
                     return method
                 else:
                     raise AttributeError
@@ -1257,9 +1347,7 @@ class PluginMixin(BasePlugin, irclib.IrcCallback):
     def __call__(self, irc, msg):
         irc = SimpleProxy(irc, msg)
         if msg.command == 'PRIVMSG':
-            if self.noIgnore or \
-               not ircdb.checkIgnored(msg.prefix, msg.args[0]) or \
-               not ircutils.isUserHostmask(msg.prefix):  # Some services impl.
+            if self.noIgnore or not isIgnored(msg):
                 self.__parent.__call__(irc, msg)
         else:
             self.__parent.__call__(irc, msg)
@@ -34,6 +34,7 @@ the same as) DJB's CDB <http://cr.yp.to/cdb.html>.
 
 import os
 import sys
+import mmap
 import struct
 import os.path
 import cPickle as pickle
@@ -178,76 +179,78 @@ class Maker(object):
             self.fd.write(pack2Ints(hashPos, hashLen))
 
 
+_pair = struct.Struct('<LL')
+
 class Reader(utils.IterableMap):
-    """Class for reading from a CDB database."""
+    """Class for reading from a CDB database.
+
+    The database is memory-mapped, and each lookup keeps its probe state to
+    itself, so a single Reader can be shared between threads.
+    """
     def __init__(self, filename):
         self.filename = filename
-        self.fd = file(filename, 'r')
-        self.loop = 0
-        self.khash = 0
-        self.kpos = 0
-        self.hpos = 0
-        self.hslots = 0
-        self.dpos = 0
-        self.dlen = 0
+        self.fd = file(filename, 'rb')
+        self.map = mmap.mmap(self.fd.fileno(), 0, access=mmap.ACCESS_READ)
 
     def close(self):
+        self.map.close()
         self.fd.close()
 
     def _read(self, len, pos):
-        self.fd.seek(pos)
-        return self.fd.read(len)
-
-    def _match(self, key, pos):
-        return self._read(len(key), pos) == key
+        return self.map[pos:pos+len]
 
     def iteritems(self):
-        # uses loop/hslots in a strange, non-re-entrant manner.
-        (self.loop,) = struct.unpack('<i', self._read(4, 0))
-        self.hslots = 2048
-        while self.hslots < self.loop:
-            (klen, dlen) = unpack2Ints(self._read(8, self.hslots))
-            dpos = self.hslots + 8 + klen
-            ret = (self._read(klen, self.hslots+8), self._read(dlen, dpos))
-            self.hslots = dpos + dlen
-            yield ret
-        self.loop = 0
-        self.hslots = 0
-
-    def _findnext(self, key):
-        if not self.loop:
-            self.khash = hash(key)
-            (self.hpos, self.hslots) = unpack2Ints(self._read(8,
-                                                    (self.khash * 8) & 2047))
-            if not self.hslots:
-                return False
-            self.kpos = self.hpos + (((self.khash / 256) % self.hslots) * 8)
-        while self.loop < self.hslots:
-            (h, p) = unpack2Ints(self._read(8, self.kpos))
+        m = self.map
+        (end, _) = _pair.unpack_from(m, 0)
+        pos = 2048
+        while pos < end:
+            (klen, dlen) = _pair.unpack_from(m, pos)
+            kpos = pos + 8
+            dpos = kpos + klen
+            yield (m[kpos:dpos], m[dpos:dpos+dlen])
+            pos = dpos + dlen
+
+    def _matches(self, key, skip=0, limit=None):
+        """Returns a list of (position, length) pairs for the data of the
+        records matching key, skipping the first skip matches and returning
+        at most limit of them."""
+        ret = []
+        m = self.map
+        khash = hash(key)
+        (hpos, hslots) = _pair.unpack_from(m, (khash * 8) & 2047)
+        if not hslots:
+            return ret
+        hend = hpos + (hslots * 8)
+        kpos = hpos + (((khash / 256) % hslots) * 8)
+        klen = len(key)
+        for _ in xrange(hslots):
+            (h, p) = _pair.unpack_from(m, kpos)
             if p == 0:
-                return False
-            self.loop += 1
-            self.kpos += 8
-            if self.kpos == self.hpos + (self.hslots * 8):
-                self.kpos = self.hpos
-            if h == self.khash:
-                (u, self.dlen) = unpack2Ints(self._read(8, p))
-                if u == len(key):
-                    if self._match(key, p+8):
-                        self.dpos = p + 8 + u
-                        return True
-        return False
+                break
+            kpos += 8
+            if kpos == hend:
+                kpos = hpos
+            if h == khash:
+                (u, dlen) = _pair.unpack_from(m, p)
+                if u == klen and m[p+8:p+8+u] == key:
+                    if skip:
+                        skip -= 1
+                    else:
+                        ret.append((p + 8 + u, dlen))
+                        if len(ret) == limit:
+                            break
+        return ret
 
     def _find(self, key, loop=0):
-        self.loop = loop
-        return self._findnext(key)
-
-    def _getCurrentData(self):
-        return self._read(self.dlen, self.dpos)
+        return bool(self._matches(key, loop, 1))
 
     def find(self, key, loop=0):
-        if self._find(key, loop=loop):
-            return self._getCurrentData()
+        """Returns the data of the record matching key, skipping the first
+        loop matches."""
+        L = self._matches(key, loop, 1)
+        if L:
+            (pos, len) = L[0]
+            return self.map[pos:pos+len]
         else:
             try:
                 return self.default
@@ -255,10 +258,8 @@ class Reader(utils.IterableMap):
                 raise KeyError, key
 
     def findall(self, key):
-        ret = []
-        while self._findnext(key):
-            ret.append(self._getCurrentData())
-        return ret
+        m = self.map
+        return [m[pos:pos+len] for (pos, len) in self._matches(key)]
 
     def get(self, key, default=None):
         try:
@@ -266,10 +267,24 @@ class Reader(utils.IterableMap):
         except KeyError:
             return default
 
+    def getmany(self, keys, default=None):
+        """Returns a list of the data for each of the given keys, with default
+        in place of any key that isn't in the database."""
+        m = self.map
+        matches = self._matches
+        ret = []
+        for key in keys:
+            L = matches(key, 0, 1)
+            if L:
+                (pos, len) = L[0]
+                ret.append(m[pos:pos+len])
+            else:
+                ret.append(default)
+        return ret
+
     def __len__(self):
-        (start,) = struct.unpack('<i', self._read(4, 0))
-        self.fd.seek(0, 2)
-        return ((self.fd.tell() - start) / 16)
+        (start, _) = _pair.unpack_from(self.map, 0)
+        return ((len(self.map) - start) / 16)
 
     has_key = _find
     __contains__ = has_key
@@ -32,6 +32,7 @@
 Includes wrappers for commands.
 """
 
+import os
 import time
 import types
 import getopt
@@ -106,23 +107,183 @@ def process(f, *args, **kwargs):
         v = "Error: " + str(v)
     return v
 
+try:
+    MAXFD = os.sysconf('SC_OPEN_MAX')
+except (AttributeError, ValueError):
+    MAXFD = 256
+
+def _closeFds(keep):
+    """Closes every file descriptor but stdin, stdout, stderr, and keep."""
+    try:
+        # Only the ones that are open; MAXFD can be in the millions.
+        fds = [int(fd) for fd in os.listdir('/proc/self/fd')]
+    except (EnvironmentError, ValueError):
+        os.closerange(3, keep)
+        os.closerange(keep + 1, MAXFD)
+        return
+    for fd in fds:
+        if fd > 2 and fd != keep:
+            try:
+                os.close(fd)
+            except OSError:
+                pass # The one listdir used, which is closed already.
+
+def _poolWorker(conn):
+    # We're forked from the running bot, so we've got copies of its sockets,
+    # databases, and logs; a socket the bot closes isn't really closed until
+    # every process holding it closes it too, so we close them right away.
+    _closeFds(conn.fileno())
+    while True:
+        try:
+            (f, argsList) = conn.recv()
+        except (EOFError, IOError):
+            return
+        for args in argsList:
+            try:
+                conn.send((True, f(*args)))
+            except Exception, e:
+                conn.send((False, str(e)))
+
+class _PoolWorker(object):
+    def __init__(self, pn, cn):
+        (self.conn, child) = multiprocessing.Pipe()
+        self.process = callbacks.CommandProcess(target=_poolWorker,
+                                                args=(child,),
+                                                kwargs={'pn': pn, 'cn': cn})
+        self.process.daemon = True
+        self.process.start()
+        child.close()
+
+    def kill(self):
+        if self.process.is_alive():
+            self.process.terminate()
+        self.process.join()
+        self.conn.close()
+
+class ProcessPool(object):
+    """A pool of worker processes to run functions in that might take too
+    long -- like regexps given by users, which can take exponential time --
+    so they can be killed instead of hanging the bot.
+
+    Workers are started as they're needed and kept for later calls; a worker
+    taking too long is killed, and another started in its place.  The
+    functions given and their arguments must be picklable.
+    """
+    def __init__(self, size):
+        self.size = size
+        self.idle = []
+        self.started = 0
+        self.cond = threading.Condition()
+
+    def _checkout(self):
+        self.cond.acquire()
+        try:
+            while not self.idle and self.started >= self.size():
+                self.cond.wait()
+            if self.idle:
+                return self.idle.pop()
+            self.started += 1
+        finally:
+            self.cond.release()
+        try:
+            return _PoolWorker('ProcessPool', 'worker')
+        except:
+            self._checkin(None)
+            raise
+
+    def _checkin(self, worker, alive=False):
+        if worker is not None and not alive:
+            worker.kill()
+        self.cond.acquire()
+        try:
+            if alive:
+                self.idle.append(worker)
+            else:
+                self.started -= 1
+            self.cond.notify()
+        finally:
+            self.cond.release()
+
+    def map(self, f, argsList, timeout=None, default=None):
+        """Returns [f(*args) for args in argsList], sending them all to a
+        worker at once.  A call taking longer than <timeout> seconds is given
+        up on and gives <default>.  A call raising an exception gives an
+        'Error: ...' string, as process does."""
+        argsList = list(argsList)
+        results = []
+        while len(results) < len(argsList):
+            worker = self._checkout()
+            alive = False
+            try:
+                worker.conn.send((f, argsList[len(results):]))
+                while len(results) < len(argsList):
+                    try:
+                        if not worker.conn.poll(timeout):
+                            raise ProcessTimeoutError
+                        (ok, v) = worker.conn.recv()
+                    except (ProcessTimeoutError, EOFError, IOError):
+                        log.debug('%s aborted due to timeout.',
+                                  worker.process.name)
+                        results.append(default)
+                        break
+                    if not ok:
+                        v = 'Error: ' + v
+                    results.append(v)
+                else:
+                    alive = True
+            finally:
+                self._checkin(worker, alive)
+        return results
+
+    def apply(self, f, args, timeout=None):
+        """Returns f(*args), raising ProcessTimeoutError if it takes longer
+        than <timeout> seconds."""
+        [v] = self.map(f, [args], timeout=timeout, default=self)
+        if v is self:
+            raise ProcessTimeoutError, 'Call aborted due to timeout.'
+        return v
+
+    def search(self, reobj, L, timeout):
+        """Returns whether reobj.search matches each string in L, counting
+        a search that takes longer than <timeout> seconds or raises an
+        exception as not matching."""
+        results = self.map(regexpSearch, [(reobj, s) for s in L],
+                           timeout=timeout, default=False)
+        # Errors come back as 'Error: ...' strings, which are true.
+        return [v is True for v in results]
+
+    def close(self):
+        self.cond.acquire()
+        try:
+            (workers, self.idle) = (self.idle, [])
+            self.started -= len(workers)
+        finally:
+            self.cond.release()
+        for worker in workers:
+            worker.kill()
+
+processPool = ProcessPool(conf.supybot.commands.processes)
+
+def regexpSearch(reobj, s):
+    """Returns whether reobj.search matches s."""
+    return reobj.search(s) is not None
+
+def regexpMatch(reobj, s):
+    """Returns the part of s reobj.search matches, or ''."""
+    m = reobj.search(s)
+    return m and m.group(0) or ''
+
+def regexpReplace(reobj, replacement, count, s):
+    """Returns reobj.sub(replacement, s, count)."""
+    return reobj.sub(replacement, s, count)
+
 def regexp_wrapper(s, reobj, timeout, plugin_name, fcn_name):
     '''A convenient wrapper to stuff regexp search queries through a subprocess.
     
     This is used because specially-crafted regexps can use exponential time
-    and hang the bot.'''
-    def re_bool(s, reobj):
-        """Since we can't enqueue match objects into the multiprocessing queue,
-        we'll just wrap the function to return bools."""
-        if reobj.search(s) is not None:
-            return True
-        else:
-            return False
-    try:
-        v = process(re_bool, s, reobj, timeout=timeout, pn=plugin_name, cn=fcn_name)
-        return v
-    except ProcessTimeoutError:
-        return False
+    and hang the bot.  Use processPool.search to search many strings at once.
+    '''
+    return processPool.search(reobj, [s], timeout)[0]
 
 class UrlSnarfThread(world.SupyThread):
     def __init__(self, *args, **kwargs):
@@ -273,6 +273,14 @@ def registerNetwork(name, password='', ssl=False):
         to %s.""" % name))
     registerChannelValue(network.channels, 'key', registry.String('',
         """Determines what key (if any) will be used to join the channel.""", private=True))
+    registerGlobalValue(network, 'throttleTime', registry.Float(-1.0,
+        """Determines how many seconds of penalty each queued message sent to
+        %s costs.  If negative, supybot.protocols.irc.throttleTime is used
+        instead.""" % name))
+    registerGlobalValue(network.throttleTime, 'burst', registry.Float(-1.0,
+        """Determines how many seconds of penalty may build up before the bot
+        stops sending queued messages to %s.  If negative,
+        supybot.protocols.irc.throttleTime.burst is used instead.""" % name))
     return network
 
 # Let's fill our networks.
@@ -602,6 +610,11 @@ registerChannelValue(supybot.commands.nested, 'pipeSyntax',
     option will allow nested commands with a syntax similar to UNIX pipes, for
     example: 'bot: foo | bar'."""))
 
+registerGlobalValue(supybot.commands, 'processes',
+    registry.PositiveInteger(2, """Determines how many worker processes the
+    bot will keep around for running things that might take too long, like
+    regular expressions given by users, so they can be killed if they do."""))
+
 registerGroup(supybot.commands, 'defaultPlugins',
     orderAlphabetically=True, help="""Determines what commands have default
     plugins set, and which plugins are set to be the default for each of those
@@ -665,13 +678,16 @@ registerGlobalValue(supybot.drivers, 'poll',
     driver should block waiting for input."""))
 
 class ValidDriverModule(registry.OnlySomeStrings):
-    validStrings = ('default', 'Socket', 'Twisted')
+    validStrings = ('default', 'Socket', 'Select', 'Twisted')
 
 registerGlobalValue(supybot.drivers, 'module',
     ValidDriverModule('default', """Determines what driver module the bot will
     use.  Socket, a simple driver based on timeout sockets, is used by default
-    because it's simple and stable.  Twisted is very stable and simple, and if
-    you've got Twisted installed, is probably your best bet."""))
+    because it's simple and stable.  Select waits on all of the bot's
+    connections at once rather than polling each one in turn, which makes it
+    the better choice when the bot is connected to many networks.  Twisted is
+    very stable and simple, and if you've got Twisted installed, is probably
+    your best bet."""))
 
 registerGlobalValue(supybot.drivers, 'maxReconnectWait',
     registry.PositiveFloat(300.0, """Determines the maximum time the bot will
@@ -876,6 +892,15 @@ registerGlobalValue(supybot.databases.types.cdb, 'maximumModifications',
     is greater than this fraction of the total number of records, the database
     will be entirely flushed to disk."""))
 
+registerGroup(supybot.databases.types, 'channelUser')
+registerGlobalValue(supybot.databases.types.channelUser, 'maximumJournalSize',
+    registry.Float(0.5, """Determines how large the journal of changes to a
+    channel/user database (such as Seen's or ChannelStats') may grow before the
+    whole database is rewritten, as a fraction of the number of records in the
+    database.  Until then, flushing the database only appends the records that
+    changed to the journal.  If this is 0, the whole database will be rewritten
+    every time it is flushed."""))
+
 # XXX Configuration variables for dbi, sqlite, flat, mysql, etc.
 
 ###
@@ -985,6 +1010,12 @@ registerGlobalValue(supybot.protocols.irc, 'throttleTime',
     registry.Float(1.0, """A floating point number of seconds to throttle
     queued messages -- that is, messages will not be sent faster than once per
     throttleTime seconds."""))
+registerGlobalValue(supybot.protocols.irc.throttleTime, 'burst',
+    registry.Float(4.0, """A floating point number of seconds that queued
+    messages may get ahead of supybot.protocols.irc.throttleTime -- that is,
+    after a quiet period the bot may send a short burst of messages before
+    settling down to one per throttleTime seconds.  This is the flood control
+    described in RFC 1459, which lets the timer run 10 seconds ahead."""))
 
 registerGlobalValue(supybot.protocols.irc, 'ping',
     registry.Boolean(True, """Determines whether the bot will send PINGs to the
@@ -31,10 +31,15 @@
 Module for some slight database-independence for simple databases.
 """
 
+import re
 import csv
 import math
+import operator
+import sre_parse
+import sre_constants
 
 import supybot.cdb as cdb
+import supybot.log as log
 import supybot.utils as utils
 from supybot.utils.iter import ilen
 
@@ -143,21 +148,64 @@ class DirMapping(MappingInterface):
             raise NoRecordError, id
 
 class FlatfileMapping(MappingInterface):
+    """A mapping stored in a flat text file: a first line holding the next id,
+    then one 'id:record' line per record.  Removed records have their id
+    overwritten with dashes, and are cleaned out by vacuum.
+
+    The byte offset of each record's line is indexed when the mapping is
+    opened, so get, set, and remove can seek straight to the record rather
+    than scanning the file.  The file is vacuumed automatically once more than
+    vacuumRatio of its lines are removed records.
+    """
+    vacuumRatio = 0.5
     def __init__(self, filename, maxSize=10**6):
         self.filename = filename
         try:
             fd = file(self.filename)
+        except EnvironmentError, e:
+            # File couldn't be opened.
+            self.maxSize = int(math.log10(maxSize))
+            self.currentId = 0
+            self.offsets = {}
+            self.removed = 0
+            self._incrementCurrentId()
+        else:
             strId = fd.readline().rstrip()
             self.maxSize = len(strId)
             try:
                 self.currentId = int(strId)
             except ValueError:
+                fd.close()
                 raise Error, 'Invalid file for FlatfileMapping: %s' % filename
-        except EnvironmentError, e:
-            # File couldn't be opened.
-            self.maxSize = int(math.log10(maxSize))
-            self.currentId = 0
-            self._incrementCurrentId()
+            self._index(fd)
+
+    def _index(self, fd):
+        """Indexes the records in fd, which must be positioned just after the
+        first line, and closes it.  Malformed lines are logged and skipped."""
+        self.offsets = {}
+        self.removed = 0
+        duplicates = False
+        pos = fd.tell()
+        try:
+            for line in fd:
+                if line.startswith('-'):
+                    self.removed += 1
+                elif line.strip():
+                    id = self._lineId(line)
+                    if id is None:
+                        log.warning('Skipping malformed line in %s: %r',
+                                    self.filename, line)
+                    elif id in self.offsets:
+                        duplicates = True
+                    else:
+                        self.offsets[id] = pos
+                pos += len(line)
+        finally:
+            fd.close()
+        if duplicates:
+            # Only the first record with a given id can be gotten; vacuum
+            # will clean out the rest.
+            self.vacuum()
 
     def _canonicalId(self, id):
         if id is not None:
@@ -181,30 +229,52 @@ class FlatfileMapping(MappingInterface):
         (id, s) = line.split(':', 1)
         return (id, s)
 
+    def _lineId(self, line):
+        """Returns the id of the record on line, or None if it's malformed."""
+        try:
+            (id, _) = self._splitLine(line)
+            return int(id)
+        except ValueError:
+            return None
+
     def _joinLine(self, id, s):
         return '%s:%s\n' % (self._canonicalId(id), s)
 
+    def _append(self, fd, id, s):
+        fd.seek(0, 2) # End.
+        self.offsets[id] = fd.tell()
+        fd.write(self._joinLine(id, s))
+
+    def _remove(self, fd, id):
+        pos = self.offsets.pop(id)
+        fd.seek(pos)
+        fd.write(self._canonicalId(None))
+        self.removed += 1
+
+    def _maybeVacuum(self):
+        lines = len(self.offsets) + self.removed
+        if self.removed > self.vacuumRatio * lines:
+            self.vacuum()
+
     def add(self, s):
-        line = self._joinLine(self.currentId, s)
         fd = file(self.filename, 'r+')
         try:
-            fd.seek(0, 2) # End.
-            fd.write(line)
+            self._append(fd, self.currentId, s)
             return self.currentId
         finally:
             self._incrementCurrentId(fd)
             fd.close()
 
     def get(self, id):
-        strId = self._canonicalId(id)
         try:
-            fd = file(self.filename)
-            fd.readline() # First line, nextId.
-            for line in fd:
-                (lineId, s) = self._splitLine(line)
-                if lineId == strId:
-                    return s
+            pos = self.offsets[id]
+        except KeyError:
             raise NoRecordError, id
+        fd = file(self.filename)
+        try:
+            fd.seek(pos)
+            (_, s) = self._splitLine(fd.readline())
+            return s
         finally:
             fd.close()
 
@@ -212,45 +282,34 @@ class FlatfileMapping(MappingInterface):
     #     maximum id remains accurate if this is some value we've never given
     #     out -- i.e., self.maxid = max(self.maxid, id) or something.
     def set(self, id, s):
-        strLine = self._joinLine(id, s)
+        fd = file(self.filename, 'r+')
         try:
-            fd = file(self.filename, 'r+')
-            self.remove(id, fd)
-            fd.seek(0, 2) # End.
-            fd.write(strLine)
+            if id in self.offsets:
+                self._remove(fd, id)
+            self._append(fd, id, s)
         finally:
             fd.close()
+        self._maybeVacuum()
 
     def remove(self, id, fd=None):
+        if id not in self.offsets:
+            return
         fdWasNone = fd is None
-        strId = self._canonicalId(id)
         try:
             if fdWasNone:
                 fd = file(self.filename, 'r+')
-            fd.seek(0)
-            fd.readline() # First line, nextId
-            pos = fd.tell()
-            line = fd.readline()
-            while line:
-                (lineId, _) = self._splitLine(line)
-                if lineId == strId:
-                    fd.seek(pos)
-                    fd.write(self._canonicalId(None))
-                    fd.seek(pos)
-                    fd.readline() # Same line we just rewrote the id for.
-                pos = fd.tell()
-                line = fd.readline()
-            # We should be at the end.
+            self._remove(fd, id)
         finally:
             if fdWasNone:
                 fd.close()
+        self._maybeVacuum()
 
     def __iter__(self):
         fd = file(self.filename)
         fd.readline() # First line, nextId.
         for line in fd:
-            (id, s) = self._splitLine(line)
-            if not id.startswith('-'):
+            if not line.startswith('-') and self._lineId(line) is not None:
+                (id, s) = self._splitLine(line)
                 yield (int(id), s)
         fd.close()
 
@@ -258,11 +317,18 @@ class FlatfileMapping(MappingInterface):
         infd = file(self.filename)
         outfd = utils.file.AtomicFile(self.filename,makeBackupIfSmaller=False)
         outfd.write(infd.readline()) # First line, nextId.
+        seen = set()
         for line in infd:
-            if not line.startswith('-'):
-                outfd.write(line)
+            if not line.startswith('-') and line.strip():
+                id = self._lineId(line)
+                if id is None or id not in seen:
+                    seen.add(id)
+                    outfd.write(line)
         infd.close()
         outfd.close()
+        fd = file(self.filename)
+        fd.readline() # First line, nextId.
+        self._index(fd)
 
     def flush(self):
         pass # No-op, we maintain no open files.
@@ -316,9 +382,99 @@ class CdbMapping(MappingInterface):
         self.db.close()
 
 
+def trigrams(s, padded=False):
+    """Returns the set of trigrams of s, lowercased.  If padded, s is padded
+    with spaces first, so its first and last characters begin and end
+    trigrams of their own."""
+    s = s.lower()
+    if padded:
+        s = '  %s ' % s
+    return set([s[i:i+3] for i in xrange(len(s) - 2)])
+
+def _regexpLiterals(parsed, L):
+    current = []
+    for (op, av) in parsed:
+        if op == sre_constants.LITERAL:
+            current.append(av < 256 and chr(av) or unichr(av))
+            continue
+        L.append(''.join(current))
+        current = []
+        if op == sre_constants.SUBPATTERN:
+            _regexpLiterals(av[1], L)
+        elif op in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT):
+            (min, _, repeated) = av
+            if min >= 1:
+                _regexpLiterals(repeated, L)
+    L.append(''.join(current))
+
+def regexpLiterals(r):
+    """Returns strings that anything r (a compiled regexp) matches must
+    contain.  It's fine for this to return no strings at all."""
+    try:
+        parsed = sre_parse.parse(r.pattern, r.flags)
+    except (sre_constants.error, TypeError):
+        return []
+    L = []
+    _regexpLiterals(parsed, L)
+    return filter(None, L)
+
+_globSpecials = re.compile(r'\[!?\]?[^\]]*\]|[*?[\]]')
+def globLiterals(glob):
+    """Returns strings that anything glob matches must contain."""
+    return filter(None, _globSpecials.split(glob))
+
+
+class TextIndex(object):
+    """An inverted index from the trigrams of some texts to the ids of the
+    texts containing them, to narrow down searches for substrings of those
+    texts without looking at every one of them."""
+    def __init__(self):
+        self.ids = {} # trigram -> set of ids
+        self.trigrams = {} # id -> set of trigrams
+
+    def add(self, id, text):
+        if id in self.trigrams:
+            self.remove(id)
+        L = self.trigrams[id] = trigrams(text)
+        for trigram in L:
+            try:
+                self.ids[trigram].add(id)
+            except KeyError:
+                self.ids[trigram] = set([id])
+
+    def remove(self, id):
+        for trigram in self.trigrams.pop(id, ()):
+            ids = self.ids[trigram]
+            ids.discard(id)
+            if not ids:
+                del self.ids[trigram]
+
+    def candidates(self, literals):
+        """Returns the set of ids of the texts that might contain (ignoring
+        case) every one of literals, or None if literals don't rule any out.
+        """
+        wanted = set()
+        for literal in literals:
+            wanted.update(trigrams(literal))
+        if not wanted:
+            return None
+        sets = [self.ids.get(trigram, ()) for trigram in wanted]
+        sets.sort(key=len)
+        ids = set(sets[0])
+        for other in sets[1:]:
+            if not ids:
+                break
+            ids &= other
+        return ids
+
+    def __len__(self):
+        return len(self.trigrams)
+
+
 class DB(object):
     Mapping = 'flat' # This is a good, sane default.
     Record = None
+    textFields = () # Fields of the records to keep a TextIndex of.
     def __init__(self, filename, Mapping=None, Record=None):
         if Record is not None:
             self.Record = Record
@@ -327,6 +483,14 @@ class DB(object):
         if isinstance(self.Mapping, basestring):
             self.Mapping = Mappings[self.Mapping]
         self.map = self.Mapping(filename)
+        self.index = None
+        if self.textFields:
+            self.index = TextIndex()
+            for record in self:
+                self.index.add(record.id, self._text(record))
+
+    def _text(self, record):
+        return '\n'.join([getattr(record, name) for name in self.textFields])
 
     def _newRecord(self, id, s):
         record = self.Record(id=id)
@@ -340,15 +504,21 @@ class DB(object):
     def set(self, id, record):
         s = record.serialize()
         self.map.set(id, s)
+        if self.index is not None:
+            self.index.add(id, self._text(record))
 
     def add(self, record):
         s = record.serialize()
         id = self.map.add(s)
         record.id = id
+        if self.index is not None:
+            self.index.add(id, self._text(record))
         return id
 
     def remove(self, id):
         self.map.remove(id)
+        if self.index is not None:
+            self.index.remove(id)
 
     def __iter__(self):
         for (id, s) in self.map:
@@ -360,6 +530,29 @@ class DB(object):
             if p(record):
                 yield record
 
+    def search(self, literals, p=None):
+        """Yields the records whose textFields contain every one of literals
+        (ignoring case) and, if given, of which p is true, in order of id.
+        Only the records the TextIndex can't rule out are looked at."""
+        literals = [literal.lower() for literal in literals]
+        def matches(record):
+            if self.textFields:
+                text = self._text(record).lower()
+                for literal in literals:
+                    if literal not in text:
+                        return False
+            return p is None or p(record)
+        ids = None
+        if self.index is not None:
+            ids = self.index.candidates(literals)
+        if ids is None:
+            records = sorted(self, key=operator.attrgetter('id'))
+        else:
+            records = [self.get(id) for id in sorted(ids)]
+        for record in records:
+            if matches(record):
+                yield record
+
     def random(self):
         try:
             return self._newRecord(*utils.iter.choice(self.map))
@@ -0,0 +1,195 @@
+###
+# Copyright (c) 2002-2004, Jeremiah Fincher
+# Copyright (c) 2010, James Vega
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+###
+
+"""
+Contains a socket driver which multiplexes every IRC connection in a single
+select (or poll, where available) loop, waking only when a socket is ready or
+when a timer -- scheduled events, reconnects, throttled messages -- is due.
+"""
+
+from __future__ import division
+
+import time
+import errno
+import select
+import socket
+
+import supybot.conf as conf
+import supybot.drivers as drivers
+import supybot.schedule as schedule
+import supybot.drivers.Socket as Socket
+
+class SelectDriver(Socket.SocketDriver):
+    """A SocketDriver that doesn't block on its own socket; the Poller below
+    does the waiting for all of them at once."""
+    def run(self):
+        # All the work is done in Poller.run.
+        pass
+
+    def _nextWakeup(self):
+        """Returns the time at which this driver next needs attention even
+        if its socket isn't ready, or None if it only needs to wait on its
+        socket."""
+        times = []
+        if self.nextReconnectTime is not None:
+            times.append(self.nextReconnectTime)
+        if self.writeCheckTime is not None:
+            times.append(self.writeCheckTime)
+        if self.connected and not self.zombie:
+            if self.irc.fastqueue:
+                return 0
+            elif self.irc.queue:
+                times.append(max(self.irc.floodControl.nextSendTime(),
+                                 self.irc.queue.nextDequeueTime()))
+        if times:
+            return min(times)
+        else:
+            return None
+
+    def _pending(self):
+        """Returns whether the socket has data buffered on our side of it
+        (i.e., SSL data already decrypted) which select won't tell us about."""
+        return self.connected and hasattr(self.conn, 'pending') and \
+               self.conn.pending() > 0
+
+
+class Poller(drivers.IrcDriver):
+    """The driver which waits on every SelectDriver's socket at once."""
+    def name(self):
+        return self.__class__.__name__
+
+    def _drivers(self):
+        return [driver for driver in drivers._drivers.itervalues()
+                if isinstance(driver, SelectDriver)]
+
+    def _timeout(self, conns):
+        now = time.time()
+        wakeups = [now + conf.supybot.drivers.poll()]
+        nextEvent = schedule.nextEventTime()
+        if nextEvent is not None:
+            wakeups.append(nextEvent)
+        for driver in conns:
+            if driver._pending():
+                return 0
+            when = driver._nextWakeup()
+            if when is not None:
+                wakeups.append(when)
+        return max(0, min(wakeups) - now)
+
+    def _wait(self, readers, writers, timeout):
+        """Waits at most timeout seconds for any of the given sockets to be
+        ready, and returns the (readable, writable) sockets."""
+        if not readers and not writers:
+            time.sleep(timeout)
+            return ([], [])
+        if hasattr(select, 'poll'):
+            # poll doesn't have select's FD_SETSIZE limit.
+            poller = select.poll()
+            socks = {}
+            for sock in readers:
+                socks[sock.fileno()] = sock
+                poller.register(sock, select.POLLIN | select.POLLPRI)
+            for sock in writers:
+                socks[sock.fileno()] = sock
+                if sock in readers:
+                    poller.modify(sock, select.POLLIN | select.POLLPRI |
+                                        select.POLLOUT)
+                else:
+                    poller.register(sock, select.POLLOUT)
+            (r, w) = ([], [])
+            for (fd, event) in poller.poll(timeout * 1000):
+                sock = socks[fd]
+                if event & select.POLLOUT:
+                    w.append(sock)
+                if event & ~select.POLLOUT:
+                    # POLLERR and POLLHUP count as readable; recv will tell
+                    # us what went wrong.
+                    r.append(sock)
+            return (r, w)
+        else:
+            (r, w, _) = select.select(readers, writers, [], timeout)
+            return (r, w)
+
+    def _call(self, driver, f):
+        """Calls f, one of driver's methods.  If it raises, the error is
+        logged and driver's connection dropped and scheduled to reconnect, so
+        a failure on one network doesn't stop the others; False is returned
+        then."""
+        try:
+            return f()
+        except Exception, e:
+            drivers.log.exception('Uncaught exception in %s:', driver.name())
+            if driver.connected:
+                driver._handleSocketError(socket.error(str(e)))
+            elif driver.nextReconnectTime is None and not driver.zombie:
+                driver.scheduleReconnect()
+            return False
+
+    def run(self):
+        conns = self._drivers()
+        for driver in conns:
+            self._call(driver, driver._checkTimers)
+            if driver.connected:
+                self._call(driver, driver._sendIfMsgs)
+        # _sendIfMsgs may have killed off some zombies.
+        conns = [driver for driver in conns if driver.connected]
+        readers = {}
+        writers = {}
+        for driver in conns:
+            readers[driver.conn] = driver
+            if driver.outbuffer:
+                writers[driver.conn] = driver
+        try:
+            (r, w) = self._wait(readers.keys(), writers.keys(),
+                                self._timeout(conns))
+        except (select.error, EnvironmentError), e:
+            if e.args[0] != errno.EINTR:
+                drivers.log.exception('Uncaught exception in Poller.run:')
+            return
+        ready = set([readers[sock] for sock in r])
+        ready.update([driver for driver in conns if driver._pending()])
+        for driver in ready:
+            if driver.connected and self._call(driver, driver._read) and \
+               not driver.irc.zombie:
+                self._call(driver, driver._sendIfMsgs)
+        for sock in w:
+            driver = writers[sock]
+            if driver.connected and driver not in ready:
+                self._call(driver, driver._sendIfMsgs)
+
+
+Driver = SelectDriver
+
+try:
+    ignore(poller)
+except NameError:
+    poller = Poller()
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
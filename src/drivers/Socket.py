@@ -44,7 +44,6 @@ import supybot.utils as utils
 import supybot.world as world
 import supybot.drivers as drivers
 import supybot.schedule as schedule
-from supybot.utils.iter import imap
 
 try:
     import ssl
@@ -61,8 +60,8 @@ class SocketDriver(drivers.IrcDriver, drivers.ServersMixin):
         self.conn = None
         self.servers = ()
         self.eagains = 0
-        self.inbuffer = ''
-        self.outbuffer = ''
+        self.inbuffer = drivers.ReceiveBuffer()
+        self.outbuffer = drivers.SendBuffer()
         self.zombie = False
         self.connected = False
         self.writeCheckTime = None
@@ -103,39 +102,35 @@ class SocketDriver(drivers.IrcDriver, drivers.ServersMixin):
 
     def _sendIfMsgs(self):
         if not self.zombie:
-            msgs = [self.irc.takeMsg()]
-            while msgs[-1] is not None:
-                msgs.append(self.irc.takeMsg())
-            del msgs[-1]
-            self.outbuffer += ''.join(imap(str, msgs))
+            msg = self.irc.takeMsg()
+            while msg is not None:
+                self.outbuffer.write(str(msg))
+                msg = self.irc.takeMsg()
         if self.outbuffer:
             try:
-                sent = self.conn.send(self.outbuffer)
-                self.outbuffer = self.outbuffer[sent:]
+                self.outbuffer.send(self.conn)
                 self.eagains = 0
             except socket.error, e:
                 self._handleSocketError(e)
         if self.zombie and not self.outbuffer:
             self._reallyDie()
 
-    def run(self):
+    def _checkTimers(self):
         now = time.time()
         if self.nextReconnectTime is not None and now > self.nextReconnectTime:
             self.reconnect()
         elif self.writeCheckTime is not None and now > self.writeCheckTime:
             self._checkAndWriteOrReconnect()
-        if not self.connected:
-            # We sleep here because otherwise, if we're the only driver, we'll
-            # spin at 100% CPU while we're disconnected.
-            time.sleep(conf.supybot.drivers.poll())
-            return
-        self._sendIfMsgs()
+
+    def _read(self):
+        """Reads whatever the server has sent us and feeds the complete lines
+        to our Irc object.  Returns False if the connection broke."""
         try:
-            self.inbuffer += self.conn.recv(1024)
+            if not self.inbuffer.recv(self.conn):
+                self._handleSocketError(socket.error('Connection closed.'))
+                return False
             self.eagains = 0 # If we successfully recv'ed, we can reset this.
-            lines = self.inbuffer.split('\n')
-            self.inbuffer = lines.pop()
-            for line in lines:
+            for line in self.inbuffer.lines():
                 msg = drivers.parseMsg(line)
                 if msg is not None:
                     self.irc.feedMsg(msg)
@@ -146,11 +141,21 @@ class SocketDriver(drivers.IrcDriver, drivers.ServersMixin):
                 pass
             else:
                 self._handleSocketError(e)
-                return
+                return False
         except socket.error, e:
             self._handleSocketError(e)
+            return False
+        return True
+
+    def run(self):
+        self._checkTimers()
+        if not self.connected:
+            # We sleep here because otherwise, if we're the only driver, we'll
+            # spin at 100% CPU while we're disconnected.
+            time.sleep(conf.supybot.drivers.poll())
             return
-        if not self.irc.zombie:
+        self._sendIfMsgs()
+        if self._read() and not self.irc.zombie:
             self._sendIfMsgs()
 
     def connect(self, **kwargs):
@@ -162,6 +167,8 @@ class SocketDriver(drivers.IrcDriver, drivers.ServersMixin):
             drivers.log.reconnect(self.irc.network)
             self.conn.close()
             self.connected = False
+        self.inbuffer.reset()
+        self.outbuffer.reset()
         if reset:
             drivers.log.debug('Resetting %s.', self.irc)
             self.irc.reset()
@@ -240,6 +247,7 @@ class SocketDriver(drivers.IrcDriver, drivers.ServersMixin):
     def _reallyDie(self):
         if self.conn is not None:
             self.conn.close()
+        self.connected = False
         drivers.IrcDriver.die(self)
         # self.irc.die() Kill off the ircs yourself, jerk!
 
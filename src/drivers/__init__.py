@@ -35,6 +35,7 @@ Contains various drivers (network, file, and otherwise) for using IRC objects.
 import sys
 import time
 import socket
+from collections import deque
 
 import supybot.conf as conf
 import supybot.utils as utils
@@ -209,6 +210,129 @@ def newDriver(irc, moduleName=None):
     irc.driver = driver
     return driver
 
+class ReceiveBuffer(object):
+    """A buffer for reading IRC lines off a socket.
+
+    Data is read with recv_into straight into a preallocated bytearray, and
+    complete lines are split off in one batch per read; the unconsumed tail
+    stays where it is until there isn't room behind it for another read.  The
+    read size adapts to how much the server is sending us, between minRead
+    and maxRead bytes.
+    """
+    def __init__(self, minRead=1024, maxRead=65536):
+        self.minRead = minRead
+        self.maxRead = maxRead
+        self.readSize = minRead
+        self.buffer = bytearray(maxRead * 2)
+        self.start = 0 # Beginning of the unconsumed data.
+        self.end = 0 # End of the unconsumed data.
+
+    def __len__(self):
+        return self.end - self.start
+
+    def reset(self):
+        self.start = self.end = 0
+        self.readSize = self.minRead
+
+    def _makeRoom(self):
+        if len(self.buffer) - self.end >= self.readSize:
+            return
+        tail = self.end - self.start
+        if tail + self.readSize > len(self.buffer):
+            # A single line longer than the buffer; let's grow it.
+            self.buffer.extend(bytearray(tail + self.readSize -
+                                         len(self.buffer)))
+        self.buffer[:tail] = self.buffer[self.start:self.end]
+        (self.start, self.end) = (0, tail)
+
+    def recv(self, conn):
+        """Reads from conn into the buffer.  Returns the number of bytes read,
+        which is 0 if the connection was closed."""
+        self._makeRoom()
+        view = memoryview(self.buffer)[self.end:self.end+self.readSize]
+        n = conn.recv_into(view, self.readSize)
+        self.end += n
+        if n == self.readSize:
+            self.readSize = min(self.readSize * 2, self.maxRead)
+        elif n < self.readSize // 4:
+            self.readSize = max(self.readSize // 2, self.minRead)
+        return n
+
+    def lines(self):
+        """Returns a list of the complete lines in the buffer, and consumes
+        them."""
+        last = self.buffer.rfind('\n', self.start, self.end)
+        if last == -1:
+            return []
+        chunk = memoryview(self.buffer)[self.start:last].tobytes()
+        if last + 1 == self.end:
+            self.start = self.end = 0
+        else:
+            self.start = last + 1
+        return chunk.split('\n')
+
+
+class SendBuffer(object):
+    """A buffer for writing IRC messages to a socket.
+
+    Messages are queued as they are, and joined into a single chunk of at
+    most maxWrite bytes only when it's time to write, so a burst of messages
+    goes out in one send.  A partial write just advances an offset into the
+    chunk; the unsent remainder is handed to the next send as a buffer object
+    rather than copied.
+    """
+    def __init__(self, maxWrite=65536):
+        self.maxWrite = maxWrite
+        self.reset()
+
+    def __len__(self):
+        return len(self.chunk) - self.offset + self.queued
+
+    def __nonzero__(self):
+        return self.offset < len(self.chunk) or bool(self.queued)
+
+    def reset(self):
+        self.chunk = ''
+        self.offset = 0
+        self.queued = 0 # Bytes waiting behind the current chunk.
+        self.strings = deque()
+
+    def write(self, s):
+        """Queues s to be sent."""
+        if s:
+            self.strings.append(s)
+            self.queued += len(s)
+
+    def _nextChunk(self):
+        L = []
+        size = 0
+        while self.strings and \
+              (not L or size + len(self.strings[0]) <= self.maxWrite):
+            s = self.strings.popleft()
+            L.append(s)
+            size += len(s)
+        self.queued -= size
+        self.chunk = ''.join(L)
+        self.offset = 0
+
+    def send(self, conn):
+        """Writes as much of the buffer to conn as it will take in a single
+        send.  Returns the number of bytes written."""
+        if self.offset == len(self.chunk):
+            self._nextChunk()
+            if not self.chunk:
+                return 0
+        if self.offset:
+            n = conn.send(buffer(self.chunk, self.offset))
+        else:
+            n = conn.send(self.chunk)
+        self.offset += n
+        if self.offset == len(self.chunk):
+            self.chunk = ''
+            self.offset = 0
+        return n
+
+
 def parseMsg(s):
     s = s.strip()
     if s:
@@ -31,8 +31,11 @@
 from __future__ import division
 
 import os
+import re
 import time
+import bisect
 import operator
+from cStringIO import StringIO
 
 import supybot.log as log
 import supybot.conf as conf
@@ -43,6 +46,18 @@ import supybot.registry as registry
 import supybot.unpreserve as unpreserve
 from utils.iter import imap, ilen, ifilter
 
+def writeFile(filename, s):
+    """Atomically replaces filename with s.  The writing is done by the
+    flusher thread; see world.write."""
+    # Only fsync when nobody's waiting on us; setUser and friends write from
+    # the main thread, and shouldn't stall it on the disk.
+    sync = world.isBackgroundFlush()
+    def write():
+        fd = utils.file.AtomicFile(filename, sync=sync)
+        fd.write(s)
+        fd.close()
+    world.write(write)
+
 def isCapability(capability):
     return len(capability.split(None, 1)) == 1
 
@@ -111,6 +126,40 @@ def canonicalCapability(capability):
 def unWildcardHostmask(hostmask):
     return hostmask.translate(utils.str.chars, '!@*?')
 
+class CapabilityCache(object):
+    """Remembers what checkCapability has decided, until capabilitiesChanged
+    is called."""
+    def __init__(self, max=10000):
+        self.max = max
+        self.hits = 0
+        self.misses = 0
+        self.generation = 0
+        self.cache = {}
+
+    def invalidate(self):
+        self.generation += 1
+        self.cache.clear()
+
+    def get(self, key):
+        try:
+            ret = self.cache[key]
+            self.hits += 1
+            return ret
+        except KeyError:
+            self.misses += 1
+            raise
+
+    def set(self, key, value):
+        if len(self.cache) >= self.max:
+            self.cache.clear()
+        self.cache[key] = value
+
+capabilityCache = CapabilityCache()
+def capabilitiesChanged():
+    """Tells checkCapability that users, channels, or capabilities have
+    changed, so what it has decided before may no longer hold."""
+    capabilityCache.invalidate()
+
 _invert = invertCapability
 class CapabilitySet(set):
     """A subclass of set handling basic capability stuff."""
@@ -127,11 +176,13 @@ class CapabilitySet(set):
         if self.__parent.__contains__(inverted):
             self.__parent.remove(inverted)
         self.__parent.add(capability)
+        capabilitiesChanged()
 
     def remove(self, capability):
         """Removes a capability from the set."""
         capability = ircutils.toLower(capability)
         self.__parent.remove(capability)
+        capabilitiesChanged()
 
     def __contains__(self, capability):
         capability = ircutils.toLower(capability)
@@ -218,6 +269,7 @@ class IrcUser(object):
             self.hostmasks = ircutils.IrcSet() # hostmasks used for recognition
         else:
             self.hostmasks = hostmasks
+        self.usersDictionary = None # The UsersDictionary it's indexed by.
 
     def __repr__(self):
         return format('%s(id=%s, ignore=%s, password="", name=%q, hashed=%r, '
@@ -264,28 +316,38 @@ class IrcUser(object):
         else:
             return (self.password == password)
 
+    def checkAuth(self, hostmask):
+        """Checks a given hostmask against the user's current
+        authentication."""
+        timeout = conf.supybot.databases.users.timeoutIdentification()
+        removals = []
+        try:
+            for (when, authmask) in self.auth:
+                if timeout and when+timeout < time.time():
+                    removals.append((when, authmask))
+                elif hostmask == authmask:
+                    return True
+        finally:
+            while removals:
+                self.auth.remove(removals.pop())
+        return False
+
     def checkHostmask(self, hostmask, useAuth=True):
         """Checks a given hostmask against the user's hostmasks or current
         authentication.  If useAuth is False, only checks against the user's
         hostmasks.
         """
-        if useAuth:
-            timeout = conf.supybot.databases.users.timeoutIdentification()
-            removals = []
-            try:
-                for (when, authmask) in self.auth:
-                    if timeout and when+timeout < time.time():
-                        removals.append((when, authmask))
-                    elif hostmask == authmask:
-                        return True
-            finally:
-                while removals:
-                    self.auth.remove(removals.pop())
+        if useAuth and self.checkAuth(hostmask):
+            return True
         for pat in self.hostmasks:
             if ircutils.hostmaskPatternEqual(pat, hostmask):
                 return pat
         return False
 
+    def _reindex(self):
+        if self.usersDictionary is not None:
+            self.usersDictionary.reindexUser(self)
+
     def addHostmask(self, hostmask):
         """Adds a hostmask to the user's hostmasks."""
         assert ircutils.isUserHostmask(hostmask), 'got %s' % hostmask
@@ -293,15 +355,18 @@ class IrcUser(object):
             raise ValueError, \
                   'Hostmask must contain at least 8 non-wildcard characters.'
         self.hostmasks.add(hostmask)
+        self._reindex()
 
     def removeHostmask(self, hostmask):
         """Removes a hostmask from the user's hostmasks."""
         self.hostmasks.remove(hostmask)
+        self._reindex()
 
     def addAuth(self, hostmask):
         """Sets a user's authenticated hostmask.  This times out in 1 hour."""
         if self.checkHostmask(hostmask, useAuth=False) or not self.secure:
             self.auth.append((time.time(), hostmask))
+            self._reindex()
         else:
             raise ValueError, 'secure flag set, unmatched hostmask'
 
@@ -310,6 +375,7 @@ class IrcUser(object):
         for (when, hostmask) in self.auth:
             users.invalidateCache(hostmask=hostmask)
         self.auth = []
+        self._reindex()
 
     def preserve(self, fd, indent=''):
         def write(s):
@@ -328,6 +394,50 @@ class IrcUser(object):
         fd.write(os.linesep)
 
 
+class HostmaskExpirations(ircutils.HostmaskDict):
+    """Maps hostmask patterns to the time at which they expire (or to 0, if
+    they never expire)."""
+    def __init__(self, *args, **kwargs):
+        self.nextExpiration = 0
+        ircutils.HostmaskDict.__init__(self, *args, **kwargs)
+
+    def __setitem__(self, pattern, expiration):
+        ircutils.HostmaskDict.__setitem__(self, pattern, expiration)
+        if expiration and (not self.nextExpiration or
+                           expiration < self.nextExpiration):
+            self.nextExpiration = expiration
+
+    def clear(self):
+        ircutils.HostmaskDict.clear(self)
+        self.nextExpiration = 0
+
+    def expire(self, now=None):
+        """Removes the patterns which have expired, returning them as a list
+        of (pattern, expiration) pairs."""
+        if not self.nextExpiration:
+            return []
+        if now is None:
+            now = time.time()
+        if now < self.nextExpiration:
+            return []
+        expired = []
+        self.nextExpiration = 0
+        for (pattern, expiration) in self.items():
+            if expiration:
+                if now >= expiration:
+                    expired.append((pattern, expiration))
+                    del self[pattern]
+                elif not self.nextExpiration or \
+                     expiration < self.nextExpiration:
+                    self.nextExpiration = expiration
+        return expired
+
+    def check(self, hostmask):
+        """Returns whether hostmask matches any of the unexpired patterns."""
+        self.expire()
+        return self.match(hostmask)
+
+
 class IrcChannel(object):
     """This class holds the capabilities, bans, and ignores of a channel."""
     defaultOff = ('op', 'halfop', 'voice', 'protected')
@@ -335,8 +445,8 @@ class IrcChannel(object):
                  capabilities=None, lobotomized=False, defaultAllow=True):
         self.defaultAllow = defaultAllow
         self.expiredBans = []
-        self.bans = bans or {}
-        self.ignores = ignores or {}
+        self.bans = HostmaskExpirations(bans or {})
+        self.ignores = HostmaskExpirations(ignores or {})
         self.silences = silences or []
         self.exceptions = exceptions or []
         self.capabilities = capabilities or CapabilitySet()
@@ -366,15 +476,8 @@ class IrcChannel(object):
     def checkBan(self, hostmask):
         """Checks whether a given hostmask is banned by the channel banlist."""
         assert ircutils.isUserHostmask(hostmask), 'got %s' % hostmask
-        now = time.time()
-        for (pattern, expiration) in self.bans.items():
-            if now < expiration or not expiration:
-                if ircutils.hostmaskPatternEqual(pattern, hostmask):
-                    return True
-            else:
-                self.expiredBans.append((pattern, expiration))
-                del self.bans[pattern]
-        return False
+        self.expiredBans.extend(self.bans.expire())
+        return self.bans.match(hostmask)
 
     def addIgnore(self, hostmask, expiration=0):
         """Adds an ignore to the channel ignore list."""
@@ -399,6 +502,7 @@ class IrcChannel(object):
     def setDefaultCapability(self, b):
         """Sets the default capability in the channel."""
         self.defaultAllow = b
+        capabilitiesChanged()
 
     def _checkCapability(self, capability):
         """Checks whether a certain capability is allowed by the channel."""
@@ -420,15 +524,8 @@ class IrcChannel(object):
         assert ircutils.isUserHostmask(hostmask), 'got %s' % hostmask
         if self.checkBan(hostmask):
             return True
-        now = time.time()
-        for (pattern, expiration) in self.ignores.items():
-            if now < expiration or not expiration:
-                if ircutils.hostmaskPatternEqual(pattern, hostmask):
-                    return True
-            else:
-                del self.ignores[pattern]
-                # Later we may wish to keep expiredIgnores, but not now.
-        return False
+        # Later we may wish to keep expiredIgnores, but not now.
+        return self.ignores.check(hostmask)
 
     def preserve(self, fd, indent=''):
         def write(s):
@@ -560,14 +657,106 @@ class DuplicateHostmask(ValueError):
     pass
 
 class UsersDictionary(utils.IterableMap):
-    """A simple serialized-to-file User Database."""
+    """A simple serialized-to-file User Database.
+
+    Users are found by name or hostmask through indexes which setUser and
+    delUser keep up to date, as do the IrcUser methods changing the
+    hostmasks or authentication of a user that's been set.  Code changing an
+    IrcUser's name should call setUser afterwards (as it already must, to
+    have the change saved)."""
     def __init__(self):
         self.noFlush = False
         self.filename = None
         self.users = {}
         self.nextId = 0
-        self._nameCache = utils.structures.CacheDict(1000)
         self._hostmaskCache = utils.structures.CacheDict(1000)
+        self._nonUserCache = utils.structures.CacheDict(10000)
+        self._clearIndexes()
+
+    def _clearIndexes(self):
+        self._names = {}                       # Lowered name -> id.
+        self._hostmasks = ircutils.HostmaskDict() # Hostmask -> set of ids.
+        # Sorted lists of (lowered hostmask reversed, hostmask) and (lowered
+        # hostmask, hostmask), so setUser can find the hostmasks ending or
+        # starting with some literal text by bisection.
+        self._hostmaskEnds = ([], [])
+        self._auths = {}                       # Authed hostmask -> set of ids.
+        self._indexed = {}                     # id -> what it's indexed by.
+        capabilitiesChanged()
+
+    def _fileEnds(self, hostmask, add=True):
+        lowered = ircutils.toLower(hostmask)
+        (suffixes, prefixes) = self._hostmaskEnds
+        for (ends, end) in [(suffixes, (lowered[::-1], hostmask)),
+                            (prefixes, (lowered, hostmask))]:
+            if add:
+                bisect.insort(ends, end)
+            else:
+                del ends[bisect.bisect_left(ends, end)]
+
+    def _indexUser(self, id, user):
+        """(Re)indexes user, whose id is id, by its current name, hostmasks,
+        and authenticated hostmasks."""
+        self._unindexUser(id)
+        name = user.name.lower()
+        hostmasks = list(user.hostmasks)
+        auths = [authmask for (_, authmask) in user.auth]
+        if name:
+            self._names[name] = id
+        for hostmask in hostmasks:
+            if hostmask not in self._hostmasks:
+                self._hostmasks[hostmask] = set()
+                self._fileEnds(hostmask)
+            self._hostmasks[hostmask].add(id)
+        for authmask in auths:
+            self._auths.setdefault(authmask, set()).add(id)
+        self._indexed[id] = (name, hostmasks, auths)
+        self._nonUserCache.clear()
+        capabilitiesChanged()
+
+    def _unindexUser(self, id):
+        try:
+            (name, hostmasks, auths) = self._indexed.pop(id)
+        except KeyError:
+            return
+        capabilitiesChanged()
+        if self._names.get(name) == id:
+            del self._names[name]
+        for hostmask in hostmasks:
+            ids = self._hostmasks.get(hostmask)
+            if ids is not None:
+                ids.discard(id)
+                if not ids:
+                    del self._hostmasks[hostmask]
+                    self._fileEnds(hostmask, add=False)
+        for authmask in auths:
+            ids = self._auths.get(authmask)
+            if ids is not None:
+                ids.discard(id)
+                if not ids:
+                    del self._auths[authmask]
+
+    def _matchedHostmasks(self, pattern):
+        """Returns the indexed hostmasks which pattern matches."""
+        lowered = ircutils.toLower(pattern)
+        pieces = re.split(r'[*?]', lowered)
+        # Whatever pattern matches has to end with its literal suffix and
+        # start with its literal prefix; we look at whichever of those the
+        # fewest hostmasks have.
+        ranges = []
+        for (ends, literal) in zip(self._hostmaskEnds,
+                                   (pieces[-1][::-1], pieces[0])):
+            if literal:
+                i = bisect.bisect_left(ends, (literal,))
+                j = bisect.bisect_left(ends, (literal + '\xff',))
+                ranges.append((j - i, ends, i, j))
+        if ranges:
+            (_, ends, i, j) = min(ranges, key=operator.itemgetter(0))
+            candidates = [hostmask for (_, hostmask) in ends[i:j]]
+        else:
+            candidates = self._hostmasks
+        return [hostmask for hostmask in candidates
+                if ircutils.hostmaskPatternEqual(pattern, hostmask)]
 
     # This is separate because the Creator has to access our instance.
     def open(self, filename):
@@ -591,8 +780,9 @@ class UsersDictionary(utils.IterableMap):
         """Reloads the database from its file."""
         self.nextId = 0
         self.users.clear()
-        self._nameCache.clear()
         self._hostmaskCache.clear()
+        self._nonUserCache.clear()
+        self._clearIndexes()
         if self.filename is not None:
             try:
                 self.open(self.filename)
@@ -607,12 +797,12 @@ class UsersDictionary(utils.IterableMap):
             if self.filename is not None:
                 L = self.users.items()
                 L.sort()
-                fd = utils.file.AtomicFile(self.filename)
+                fd = StringIO()
                 for (id, u) in L:
                     fd.write('user %s' % id)
                     fd.write(os.linesep)
                     u.preserve(fd, indent='  ')
-                fd.close()
+                writeFile(self.filename, fd.getvalue())
             else:
                 log.error('UsersDictionary.flush called with no filename.')
         else:
@@ -623,6 +813,9 @@ class UsersDictionary(utils.IterableMap):
         if self.flush in world.flushers:
             world.flushers.remove(self.flush)
         self.users.clear()
+        self._hostmaskCache.clear()
+        self._nonUserCache.clear()
+        self._clearIndexes()
 
     def iteritems(self):
         return self.users.iteritems()
@@ -633,11 +826,9 @@ class UsersDictionary(utils.IterableMap):
             try:
                 return self._hostmaskCache[s]
             except KeyError:
-                ids = {}
-                for (id, user) in self.users.iteritems():
-                    x = user.checkHostmask(s)
-                    if x:
-                        ids[id] = x
+                if s in self._nonUserCache:
+                    raise KeyError, s
+                ids = self._matchingIds(s)
                 if len(ids) == 1:
                     id = ids.keys()[0]
                     self._hostmaskCache[s] = id
@@ -647,6 +838,7 @@ class UsersDictionary(utils.IterableMap):
                         self._hostmaskCache[id] = set([s])
                     return id
                 elif len(ids) == 0:
+                    self._nonUserCache[s] = None
                     raise KeyError, s
                 else:
                     log.error('Multiple matches found in user database.  '
@@ -656,17 +848,19 @@ class UsersDictionary(utils.IterableMap):
                         self.users[id].removeHostmask(hostmask)
                     raise DuplicateHostmask, 'Ids %r matched.' % ids
         else: # Not a hostmask, must be a name.
-            s = s.lower()
-            try:
-                return self._nameCache[s]
-            except KeyError:
-                for (id, user) in self.users.items():
-                    if s == user.name.lower():
-                        self._nameCache[s] = id
-                        self._nameCache[id] = s
-                        return id
-                else:
-                    raise KeyError, s
+            return self._names[s.lower()]
+
+    def _matchingIds(self, hostmask):
+        """Returns a dict mapping the ids of the users recognized by hostmask
+        to what IrcUser.checkHostmask would return for it."""
+        ids = {}
+        for pattern in self._hostmasks.matches(hostmask):
+            for id in self._hostmasks[pattern]:
+                ids.setdefault(id, pattern)
+        for id in self._auths.get(hostmask, ()):
+            if self.users[id].checkAuth(hostmask):
+                ids[id] = True
+        return ids
 
     def getUser(self, id):
         """Returns a user given its id, name, or hostmask."""
@@ -692,24 +886,28 @@ class UsersDictionary(utils.IterableMap):
         return len(self.users)
 
     def invalidateCache(self, id=None, hostmask=None, name=None):
+        # Names are indexed rather than cached, so there's nothing to do for
+        # them; the name argument is only kept for compatibility.
+        capabilitiesChanged()
         if hostmask is not None:
             if hostmask in self._hostmaskCache:
                 id = self._hostmaskCache.pop(hostmask)
                 self._hostmaskCache[id].remove(hostmask)
                 if not self._hostmaskCache[id]:
                     del self._hostmaskCache[id]
-        if name is not None:
-            del self._nameCache[self._nameCache[id]]
-            del self._nameCache[id]
         if id is not None:
-            if id in self._nameCache:
-                del self._nameCache[self._nameCache[id]]
-                del self._nameCache[id]
             if id in self._hostmaskCache:
                 for hostmask in self._hostmaskCache[id]:
                     del self._hostmaskCache[hostmask]
                 del self._hostmaskCache[id]
 
+    def reindexUser(self, user):
+        """Brings the indexes up to date with user's hostmasks and
+        authentication.  IrcUser calls this when they change."""
+        if self.users.get(user.id) is user:
+            self.invalidateCache(user.id)
+            self._indexUser(user.id, user)
+
     def setUser(self, user, flush=True):
         """Sets a user (given its id) to the IrcUser given it."""
         self.nextId = max(self.nextId, user.id)
@@ -719,30 +917,30 @@ class UsersDictionary(utils.IterableMap):
         except KeyError:
             pass
         for hostmask in user.hostmasks:
-            for (i, u) in self.iteritems():
-                if i == user.id:
-                    continue
-                elif u.checkHostmask(hostmask):
+            for i in self._matchingIds(hostmask):
+                if i != user.id:
                     # We used to remove the hostmask here, but it's not
                     # appropriate for us both to remove the hostmask and to
                     # raise an exception.  So instead, we'll raise an
                     # exception, but be nice and give the offending hostmask
                     # back at the same time.
                     raise DuplicateHostmask, hostmask
-                for otherHostmask in u.hostmasks:
-                    if ircutils.hostmaskPatternEqual(hostmask, otherHostmask):
-                        raise DuplicateHostmask, hostmask
+            for otherHostmask in self._matchedHostmasks(hostmask):
+                if self._hostmasks[otherHostmask] - set([user.id]):
+                    raise DuplicateHostmask, hostmask
         self.invalidateCache(user.id)
         self.users[user.id] = user
+        self._indexUser(user.id, user)
+        user.usersDictionary = self
         if flush:
             self.flush()
 
     def delUser(self, id):
         """Removes a user from the database."""
-        del self.users[id]
-        if id in self._nameCache:
-            del self._nameCache[self._nameCache[id]]
-            del self._nameCache[id]
+        user = self.users.pop(id)
+        if isinstance(user, IrcUser):
+            user.usersDictionary = None
+        self._unindexUser(id)
         if id in self._hostmaskCache:
             for hostmask in self._hostmaskCache[id]:
                 del self._hostmaskCache[hostmask]
@@ -765,6 +963,7 @@ class ChannelsDictionary(utils.IterableMap):
         self.noFlush = False
         self.filename = None
         self.channels = ircutils.IrcDict()
+        capabilitiesChanged()
 
     def open(self, filename):
         self.noFlush = True
@@ -788,12 +987,12 @@ class ChannelsDictionary(utils.IterableMap):
         """Flushes the channel database to its file."""
         if not self.noFlush:
             if self.filename is not None:
-                fd = utils.file.AtomicFile(self.filename)
+                fd = StringIO()
                 for (channel, c) in self.channels.iteritems():
                     fd.write('channel %s' % channel)
                     fd.write(os.linesep)
                     c.preserve(fd, indent='  ')
-                fd.close()
+                writeFile(self.filename, fd.getvalue())
             else:
                 log.warning('ChannelsDictionary.flush without self.filename.')
         else:
@@ -804,11 +1003,13 @@ class ChannelsDictionary(utils.IterableMap):
         if self.flush in world.flushers:
             world.flushers.remove(self.flush)
         self.channels.clear()
+        capabilitiesChanged()
 
     def reload(self):
         """Reloads the channel database from its file."""
         if self.filename is not None:
             self.channels.clear()
+            capabilitiesChanged()
             try:
                 self.open(self.filename)
             except EnvironmentError, e:
@@ -830,6 +1031,7 @@ class ChannelsDictionary(utils.IterableMap):
         """Sets a given channel to the IrcChannel object given."""
         channel = channel.lower()
         self.channels[channel] = ircChannel
+        capabilitiesChanged()
         self.flush()
 
     def iteritems(self):
@@ -839,7 +1041,7 @@ class ChannelsDictionary(utils.IterableMap):
 class IgnoresDB(object):
     def __init__(self):
         self.filename = None
-        self.hostmasks = {}
+        self.hostmasks = HostmaskExpirations()
 
     def open(self, filename):
         self.filename = filename
@@ -860,13 +1062,13 @@ class IgnoresDB(object):
 
     def flush(self):
         if self.filename is not None:
-            fd = utils.file.AtomicFile(self.filename)
+            fd = StringIO()
             now = time.time()
             for (hostmask, expiration) in self.hostmasks.items():
                 if now < expiration or not expiration:
                     fd.write('%s %s' % (hostmask, expiration))
                     fd.write(os.linesep)
-            fd.close()
+            writeFile(self.filename, fd.getvalue())
         else:
             log.warning('IgnoresDB.flush called without self.filename.')
 
@@ -890,14 +1092,7 @@ class IgnoresDB(object):
             log.warning('IgnoresDB.reload called without self.filename.')
 
     def checkIgnored(self, prefix):
-        now = time.time()
-        for (hostmask, expiration) in self.hostmasks.items():
-            if expiration and now > expiration:
-                del self.hostmasks[hostmask]
-            else:
-                if ircutils.hostmaskPatternEqual(hostmask, prefix):
-                    return True
-        return False
+        return self.hostmasks.check(prefix)
 
     def add(self, hostmask, expiration=0):
         assert ircutils.isUserHostmask(hostmask), 'got %s' % hostmask
@@ -998,6 +1193,16 @@ def checkCapability(hostmask, capability, users=users, channels=channels):
     """
     if world.testing:
         return _x(capability, True)
+    key = (hostmask, capability, conf.supybot.capabilities.default(),
+           id(users), id(channels))
+    try:
+        return capabilityCache.get(key)
+    except KeyError:
+        ret = _checkCapability(hostmask, capability, users, channels)
+        capabilityCache.set(key, ret)
+        return ret
+
+def _checkCapability(hostmask, capability, users, channels):
     try:
         u = users.getUser(hostmask)
         if u.secure and not u.checkHostmask(hostmask, useAuth=False):
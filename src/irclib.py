@@ -28,10 +28,11 @@
 ###
 
 import re
-import copy
 import time
 import random
 
+from collections import deque
+
 import supybot.log as log
 import supybot.conf as conf
 import supybot.utils as utils
@@ -140,25 +141,86 @@ class IrcCallback(IrcCommandDispatcher):
         pass
 
 ###
-# Basic queue for IRC messages.  It doesn't presently (but should at some
-# later point) reorder messages based on priority or penalty calculations.
+# Queue for IRC messages.  Messages are sorted into three priority classes,
+# and within each class we rotate between targets so that one busy channel
+# can't starve the others.  Sending rate is controlled separately, by the
+# FloodControl penalty timer below.
 ###
 _high = frozenset(['MODE', 'KICK', 'PONG', 'NICK', 'PASS', 'CAPAB'])
 _low = frozenset(['PRIVMSG', 'PING', 'WHO', 'NOTICE', 'JOIN'])
+class _FairQueue(object):
+    """A FIFO queue of IrcMsgs which rotates between the messages' targets:
+    each target gets a message dequeued in turn, and within a target messages
+    are dequeued in the order they were enqueued."""
+    __slots__ = ('targets', 'queues', 'length')
+    def __init__(self):
+        self.length = 0
+        self.queues = {}
+        self.targets = deque()
+
+    def _target(self, msg):
+        if msg.args:
+            return ircutils.toLower(msg.args[0])
+        else:
+            return ''
+
+    def enqueue(self, msg):
+        target = self._target(msg)
+        try:
+            self.queues[target].append(msg)
+        except KeyError:
+            self.queues[target] = deque([msg])
+            self.targets.append(target)
+        self.length += 1
+
+    def dequeue(self):
+        target = self.targets.popleft()
+        q = self.queues[target]
+        msg = q.popleft()
+        if q:
+            self.targets.append(target)
+        else:
+            del self.queues[target]
+        self.length -= 1
+        return msg
+
+    def putBack(self, msg):
+        """Returns a just-dequeued message to the front of its target's
+        queue; its target goes to the back of the rotation."""
+        target = self._target(msg)
+        try:
+            self.queues[target].appendleft(msg)
+        except KeyError:
+            self.queues[target] = deque([msg])
+            self.targets.append(target)
+        self.length += 1
+
+    def __iter__(self):
+        for target in self.targets:
+            for msg in self.queues[target]:
+                yield msg
+
+    def __nonzero__(self):
+        return bool(self.length)
+
+    def __len__(self):
+        return self.length
+
+
 class IrcMsgQueue(object):
-    """Class for a queue of IrcMsgs.  Eventually, it should be smart.
+    """Class for a queue of IrcMsgs.
 
-    Probably smarter than it is now, though it's gotten quite a bit smarter
-    than it originally was.  A method to "score" methods, and a heapq to
-    maintain a priority queue of the messages would be the ideal way to do
-    intelligent queuing.
+    We keep track of 'high priority' messages, 'low priority' messages, and
+    normal messages, and make sure to return the 'high priority' ones before
+    the normal ones before the 'low priority' ones.  Within each priority,
+    messages to different targets are interleaved, so that a flood of messages
+    to one channel doesn't hold up the replies to another.
 
-    As it stands, however, we simply keep track of 'high priority' messages,
-    'low priority' messages, and normal messages, and just make sure to return
-    the 'high priority' ones before the normal ones before the 'low priority'
-    ones.
+    A count of each queued message is kept alongside the queues, so checking
+    for duplicates doesn't require looking through the whole queue.
     """
-    __slots__ = ('msgs', 'highpriority', 'normal', 'lowpriority', 'lastJoin')
+    __slots__ = ('msgs', 'highpriority', 'normal', 'lowpriority', 'lastJoin',
+                 'heldUntil')
     def __init__(self, iterable=()):
         self.reset()
         for msg in iterable:
@@ -166,19 +228,23 @@ class IrcMsgQueue(object):
 
     def reset(self):
         """Clears the queue."""
+        self.msgs = {}
         self.lastJoin = 0
-        self.highpriority = smallqueue()
-        self.normal = smallqueue()
-        self.lowpriority = smallqueue()
+        self.heldUntil = 0
+        self.highpriority = _FairQueue()
+        self.normal = _FairQueue()
+        self.lowpriority = _FairQueue()
 
     def enqueue(self, msg):
         """Enqueues a given message."""
-        if msg in self and \
+        if msg in self.msgs and \
            conf.supybot.protocols.irc.queuing.duplicates():
             s = str(msg).strip()
             log.info('Not adding message %q to queue, already added.', s)
             return False
         else:
+            self.msgs[msg] = self.msgs.get(msg, 0) + 1
+            self.heldUntil = 0
             if msg.command in _high:
                 self.highpriority.enqueue(msg)
             elif msg.command in _low:
@@ -195,21 +261,37 @@ class IrcMsgQueue(object):
         elif self.normal:
             msg = self.normal.dequeue()
         elif self.lowpriority:
-            msg = self.lowpriority.dequeue()
-            if msg.command == 'JOIN':
+            # A JOIN held back by the rate limit goes back to the front of its
+            # target's queue, and we try the next target instead.
+            for _ in xrange(len(self.lowpriority.targets)):
+                msg = self.lowpriority.dequeue()
+                if msg.command != 'JOIN':
+                    break
                 limit = conf.supybot.protocols.irc.queuing.rateLimit.join()
                 now = time.time()
                 if self.lastJoin + limit <= now:
                     self.lastJoin = now
-                else:
-                    self.lowpriority.enqueue(msg)
-                    msg = None
+                    break
+                self.lowpriority.putBack(msg)
+                self.heldUntil = self.lastJoin + limit
+                msg = None
+        if msg is not None:
+            self.heldUntil = 0
+            count = self.msgs[msg] - 1
+            if count:
+                self.msgs[msg] = count
+            else:
+                del self.msgs[msg]
         return msg
 
+    def nextDequeueTime(self):
+        """Returns the earliest time at which dequeue will return a message,
+        or 0 if it may do so now.  Only the JOIN rate limit holds messages
+        back."""
+        return self.heldUntil
+
     def __contains__(self, msg):
-        return msg in self.normal or \
-               msg in self.lowpriority or \
-               msg in self.highpriority
+        return msg in self.msgs
 
     def __nonzero__(self):
         return bool(self.highpriority or self.normal or self.lowpriority)
@@ -225,35 +307,181 @@ class IrcMsgQueue(object):
     __str__ = __repr__
 
 
+class FloodControl(object):
+    """Client-side flood control, as described in section 8.10 of RFC 1459.
+
+    Each message sent adds a penalty to a timer, which is never allowed to
+    fall behind the current time.  Messages may be sent as long as the timer
+    is less than a burst window ahead of the current time.  The penalty and
+    burst window are configured per network, falling back to
+    supybot.protocols.irc.throttleTime and its burst child.
+    """
+    __slots__ = ('network', 'timer')
+    def __init__(self, network):
+        self.network = network
+        self.reset()
+
+    def reset(self):
+        self.timer = 0
+
+    def settings(self):
+        """Returns the (penalty, burst) pair in effect for our network."""
+        penalty = conf.supybot.protocols.irc.throttleTime()
+        burst = conf.supybot.protocols.irc.throttleTime.burst()
+        group = conf.supybot.networks.get(self.network)
+        if group.throttleTime() >= 0:
+            penalty = group.throttleTime()
+        if group.throttleTime.burst() >= 0:
+            burst = group.throttleTime.burst()
+        return (penalty, burst)
+
+    def nextSendTime(self):
+        """Returns the earliest time at which a message may be sent."""
+        (penalty, burst) = self.settings()
+        if not penalty:
+            return 0
+        return self.timer - burst
+
+    def ready(self, now=None):
+        """Returns whether a message may be sent now."""
+        if now is None:
+            now = time.time()
+        return self.nextSendTime() <= now
+
+    def sent(self, msg, now=None):
+        """Charges the penalty for sending msg."""
+        if now is None:
+            now = time.time()
+        (penalty, burst) = self.settings()
+        self.timer = max(self.timer, now) + penalty
+
+
 ###
 # Maintains the state of IRC connection -- the most recent messages, the
 # status of various modes (especially ops/halfops/voices) in channels, etc.
 ###
+class _Members(object):
+    """A set-like view of the nicks in a ChannelState that have a given status
+    (being in the channel at all, or being an op, halfop or voice)."""
+    __slots__ = ('channel', 'status')
+    def __init__(self, channel, status):
+        self.channel = channel
+        self.status = status
+
+    def __contains__(self, nick):
+        return bool(self.channel._status(nick) & self.status)
+
+    def __iter__(self):
+        for (nick, status) in self.channel._members.values():
+            if status & self.status:
+                yield nick
+
+    def __len__(self):
+        return self.channel._counts[self.status]
+
+    def __nonzero__(self):
+        return len(self) > 0
+
+    def __eq__(self, other):
+        return ircutils.IrcSet(self) == ircutils.IrcSet(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, list(self))
+
+    def add(self, nick):
+        self.channel._changeStatus(nick, add=self.status)
+
+    def discard(self, nick):
+        self.channel._changeStatus(nick, remove=self.status)
+
+    def remove(self, nick):
+        if nick not in self:
+            raise KeyError, nick
+        self.discard(nick)
+
+
 class ChannelState(utils.python.Object):
-    __slots__ = ('users', 'ops', 'halfops', 'bans',
-                 'voices', 'topic', 'modes', 'created')
+    """The state of a channel.  Its membership is kept in a single dict from
+    interned IRC-lowercased nicks to (nick, status) pairs, status being a
+    bitmask of USER, OP, HALFOP and VOICE; the users, ops, halfops and voices
+    attributes are set-like views of it.  Copies share the membership dict
+    until either of them changes it."""
+    __slots__ = ('_members', '_counts', '_shared',
+                 'bans', 'topic', 'modes', 'created')
+    USER = 1
+    OP = 2
+    HALFOP = 4
+    VOICE = 8
+    statuses = (USER, OP, HALFOP, VOICE)
     def __init__(self):
         self.topic = ''
         self.created = 0
-        self.ops = ircutils.IrcSet()
         self.bans = ircutils.IrcSet()
-        self.users = ircutils.IrcSet()
-        self.voices = ircutils.IrcSet()
-        self.halfops = ircutils.IrcSet()
         self.modes = ircutils.IrcDict()
+        self._members = {}
+        self._counts = dict.fromkeys(self.statuses, 0)
+        self._shared = False
+
+    users = property(lambda self: _Members(self, self.USER))
+    ops = property(lambda self: _Members(self, self.OP))
+    halfops = property(lambda self: _Members(self, self.HALFOP))
+    voices = property(lambda self: _Members(self, self.VOICE))
+
+    def _status(self, nick):
+        try:
+            return self._members[ircutils.toLower(nick)][1]
+        except KeyError:
+            return 0
+
+    def _changeStatus(self, nick, add=0, remove=0):
+        key = intern(ircutils.toLower(nick))
+        (oldNick, old) = self._members.get(key, (nick, 0))
+        new = (old | add) & ~remove
+        if new == old:
+            return
+        if self._shared:
+            self._members = self._members.copy()
+            self._counts = self._counts.copy()
+            self._shared = False
+        if new:
+            self._members[key] = (oldNick, new)
+        else:
+            del self._members[key]
+        for status in self.statuses:
+            if status & new and not status & old:
+                self._counts[status] += 1
+            elif status & old and not status & new:
+                self._counts[status] -= 1
+
+    def copy(self):
+        """Returns a copy of the ChannelState.  The membership isn't copied
+        until one of them changes it."""
+        ret = self.__class__()
+        ret.topic = self.topic
+        ret.created = self.created
+        ret.bans = self.bans.copy()
+        ret.modes = self.modes.copy()
+        ret._members = self._members
+        ret._counts = self._counts
+        ret._shared = self._shared = True
+        return ret
 
     def isOp(self, nick):
-        return nick in self.ops
+        return bool(self._status(nick) & self.OP)
     def isVoice(self, nick):
-        return nick in self.voices
+        return bool(self._status(nick) & self.VOICE)
     def isHalfop(self, nick):
-        return nick in self.halfops
+        return bool(self._status(nick) & self.HALFOP)
 
     def addUser(self, user):
         "Adds a given user to the ChannelState.  Power prefixes are handled."
         nick = user.lstrip('@%+&~!')
         if not nick:
             return
+        status = self.USER
         # & is used to denote protected users in UnrealIRCd
         # ~ is used to denote channel owner in UnrealIRCd
         # ! is used to denote protected users in UltimateIRCd
@@ -261,29 +489,27 @@ class ChannelState(utils.python.Object):
             (marker, user) = (user[0], user[1:])
             assert user, 'Looks like my caller is passing chars, not nicks.'
             if marker in '@&~!':
-                self.ops.add(nick)
+                status |= self.OP
             elif marker == '%':
-                self.halfops.add(nick)
+                status |= self.HALFOP
             elif marker == '+':
-                self.voices.add(nick)
-        self.users.add(nick)
+                status |= self.VOICE
+        self._changeStatus(nick, add=status)
 
     def replaceUser(self, oldNick, newNick):
         """Changes the user oldNick to newNick; used for NICK changes."""
         # Note that this doesn't have to have the sigil (@%+) that users
         # have to have for addUser; it just changes the name of the user
         # without changing any of his categories.
-        for s in (self.users, self.ops, self.halfops, self.voices):
-            if oldNick in s:
-                s.remove(oldNick)
-                s.add(newNick)
+        status = self._status(oldNick)
+        if status:
+            self.removeUser(oldNick)
+            self._changeStatus(newNick, add=status)
 
     def removeUser(self, user):
         """Removes a given user from the channel."""
-        self.users.discard(user)
-        self.ops.discard(user)
-        self.halfops.discard(user)
-        self.voices.discard(user)
+        self._changeStatus(user, remove=self.USER | self.OP |
+                                        self.HALFOP | self.VOICE)
 
     def setMode(self, mode, value=None):
         assert mode not in 'ovhbeq'
@@ -323,17 +549,132 @@ class ChannelState(utils.python.Object):
                     self.unsetMode(modeChar)
 
     def __getstate__(self):
-        return [getattr(self, name) for name in self.__slots__]
-
-    def __setstate__(self, t):
-        for (name, value) in zip(self.__slots__, t):
-            setattr(self, name, value)
+        return (self.topic, self.created, self.bans, self.modes,
+                self._members.values())
+
+    def __setstate__(self, (topic, created, bans, modes, members)):
+        self.__init__()
+        self.topic = topic
+        self.created = created
+        self.bans = bans
+        self.modes = modes
+        for (nick, status) in members:
+            self._changeStatus(nick, add=status)
 
     def __eq__(self, other):
-        ret = True
-        for name in self.__slots__:
-            ret = ret and getattr(self, name) == getattr(other, name)
-        return ret
+        return self.topic == other.topic and \
+               self.created == other.created and \
+               self.bans == other.bans and \
+               self.modes == other.modes and \
+               self._members == other._members
+
+
+class MessageHistory(RingBuffer):
+    """A RingBuffer of IrcMsgs that also indexes them by channel, by nick and
+    by the (lowercased) words in their text, so searches of a long history
+    only have to look at the messages that might match."""
+    __slots__ = ('serial', 'channels', 'nicks', 'words')
+    minWordLength = 3
+    def reset(self):
+        RingBuffer.reset(self)
+        self.serial = 0 # The serial number of the next message appended.
+        self.channels = {}
+        self.nicks = {}
+        self.words = {}
+
+    def resize(self, i):
+        RingBuffer.resize(self, i)
+        self._reindex()
+
+    def __getstate__(self):
+        return RingBuffer.__getstate__(self)
+
+    def __setstate__(self, state):
+        RingBuffer.__setstate__(self, state)
+        self._reindex()
+
+    def _reindex(self):
+        msgs = list(self)
+        self.serial = 0
+        self.channels = {}
+        self.nicks = {}
+        self.words = {}
+        for msg in msgs:
+            self._index(msg)
+
+    def _keys(self, msg):
+        keys = []
+        if msg.nick:
+            keys.append((self.nicks, ircutils.toLower(msg.nick)))
+        if msg.args and ircutils.isChannel(msg.args[0]):
+            keys.append((self.channels, ircutils.toLower(msg.args[0])))
+        if msg.command in ('PRIVMSG', 'NOTICE') and len(msg.args) > 1:
+            for word in set(msg.args[1].lower().split()):
+                if len(word) >= self.minWordLength:
+                    keys.append((self.words, word))
+        return keys
+
+    def _index(self, msg):
+        serial = self.serial
+        for (index, key) in self._keys(msg):
+            index.setdefault(key, deque()).append(serial)
+        self.serial += 1
+
+    def _unindex(self, msg):
+        for (index, key) in self._keys(msg):
+            serials = index[key]
+            serials.popleft()
+            if not serials:
+                del index[key]
+
+    def append(self, msg):
+        if self.full or len(self) == self.maxSize:
+            self._unindex(self[0])
+        RingBuffer.append(self, msg)
+        self._index(msg)
+
+    def _matching(self, index, keys):
+        # Returns the serials filed under any of the given keys, oldest first.
+        if len(keys) == 1:
+            return index.get(keys[0], ())
+        serials = set()
+        for key in keys:
+            serials.update(index[key])
+        return sorted(serials)
+
+    def search(self, channel=None, nick=None, texts=()):
+        """Returns an iterator over the messages in the history, newest first,
+        that may have been sent to channel, by a nick matching the pattern
+        nick, and contain each of the given texts (case-insensitively).  The
+        indexes only narrow the search; callers must still check that each
+        message actually matches."""
+        candidates = []
+        if channel is not None:
+            key = ircutils.toLower(channel)
+            candidates.append(self._matching(self.channels, [key]))
+        if nick is not None:
+            if '*' in nick or '?' in nick:
+                keys = [key for key in self.nicks
+                        if ircutils.hostmaskPatternEqual(nick, key)]
+            else:
+                keys = [ircutils.toLower(nick)]
+            candidates.append(self._matching(self.nicks, keys))
+        for text in texts:
+            pieces = text.lower().split()
+            if pieces:
+                piece = max(pieces, key=len)
+                if len(piece) >= self.minWordLength:
+                    keys = [word for word in self.words if piece in word]
+                    candidates.append(self._matching(self.words, keys))
+        if not candidates:
+            return reversed(self)
+        return self._messages(min(candidates, key=len))
+
+    def _messages(self, serials):
+        for serial in reversed(list(serials)):
+            i = serial - (self.serial - len(self))
+            if i >= 0:
+                yield self[i]
 
 
 class IrcState(IrcCommandDispatcher):
@@ -344,7 +685,8 @@ class IrcState(IrcCommandDispatcher):
     def __init__(self, history=None, supported=None,
                  nicksToHostmasks=None, channels=None):
         if history is None:
-            history = RingBuffer(conf.supybot.protocols.irc.maxHistoryLength())
+            history = MessageHistory(
+                conf.supybot.protocols.irc.maxHistoryLength())
         if supported is None:
             supported = utils.InsensitivePreservingDict()
         if nicksToHostmasks is None:
@@ -379,9 +721,11 @@ class IrcState(IrcCommandDispatcher):
 
     def copy(self):
         ret = self.__class__()
-        ret.history = copy.deepcopy(self.history)
-        ret.nicksToHostmasks = copy.deepcopy(self.nicksToHostmasks)
-        ret.channels = copy.deepcopy(self.channels)
+        ret.history = self.history.__class__(self.history.maxSize,
+                                             self.history)
+        ret.nicksToHostmasks = self.nicksToHostmasks.copy()
+        for (channel, chan) in self.channels.iteritems():
+            ret.channels[channel] = chan.copy()
         return ret
 
     def addMsg(self, irc, msg):
@@ -393,6 +737,33 @@ class IrcState(IrcCommandDispatcher):
         if method is not None:
             method(irc, msg)
 
+    def previousChannels(self, msg):
+        """Returns the channels the user msg is about was in before msg was
+        applied to the state.  QUIT, NICK, PART and KICK messages are tagged
+        with their channels as they're added; for anything else, membership
+        hasn't changed, so the current channels are returned."""
+        channels = msg.tagged('previousChannels')
+        if channels is None:
+            channels = ircutils.IrcSet()
+            for (channel, chan) in self.channels.iteritems():
+                if msg.nick in chan.users:
+                    channels.add(channel)
+        return channels
+
+    def _tagPreviousChannels(self, msg, nicks, channels):
+        # Records, before the state changes, which of the given channels the
+        # given nicks were in, so callbacks needn't keep a state of their own
+        # trailing this one by a message.
+        previous = ircutils.IrcSet()
+        for channel in channels:
+            chan = self.channels.get(channel)
+            if chan is not None:
+                for nick in nicks:
+                    if nick in chan.users:
+                        previous.add(channel)
+                        break
+        msg.tag('previousChannels', previous)
+
     def getTopic(self, channel):
         """Returns the topic for a given channel."""
         return self.channels[channel].topic
@@ -533,6 +904,7 @@ class IrcState(IrcCommandDispatcher):
         chan.created = int(msg.args[2])
 
     def doPart(self, irc, msg):
+        self._tagPreviousChannels(msg, [msg.nick], msg.args[0].split(','))
         for channel in msg.args[0].split(','):
             try:
                 chan = self.channels[channel]
@@ -545,6 +917,7 @@ class IrcState(IrcCommandDispatcher):
 
     def doKick(self, irc, msg):
         (channel, users) = msg.args[:2]
+        self._tagPreviousChannels(msg, users.split(','), [channel])
         chan = self.channels[channel]
         for user in users.split(','):
             if ircutils.strEqual(user, irc.nick):
@@ -554,6 +927,7 @@ class IrcState(IrcCommandDispatcher):
                 chan.removeUser(user)
 
     def doQuit(self, irc, msg):
+        self._tagPreviousChannels(msg, [msg.nick], self.channels)
         for channel in self.channels.itervalues():
             channel.removeUser(msg.nick)
         if msg.nick in self.nicksToHostmasks:
@@ -576,6 +950,7 @@ class IrcState(IrcCommandDispatcher):
     def doNick(self, irc, msg):
         newNick = msg.args[0]
         oldNick = msg.nick
+        self._tagPreviousChannels(msg, [oldNick], self.channels)
         try:
             if msg.user and msg.host:
                 # Nick messages being handed out from the bot itself won't
@@ -618,6 +993,7 @@ class Irc(IrcCommandDispatcher):
         self.state = IrcState()
         self.queue = IrcMsgQueue()
         self.fastqueue = smallqueue()
+        self.floodControl = FloodControl(network)
         self.driver = None # The driver should set this later.
         self._setNonResettingVariables()
         self._queueConnectMessages()
@@ -720,11 +1096,13 @@ class Irc(IrcCommandDispatcher):
         if self.fastqueue:
             msg = self.fastqueue.dequeue()
         elif self.queue:
-            if now-self.lastTake <= conf.supybot.protocols.irc.throttleTime():
+            if not self.floodControl.ready(now):
                 log.debug('Irc.takeMsg throttling.')
             else:
-                self.lastTake = now
                 msg = self.queue.dequeue()
+                if msg is not None:
+                    self.lastTake = now
+                    self.floodControl.sent(msg, now)
         elif self.afterConnect and \
              conf.supybot.protocols.irc.ping() and \
              now > self.lastping + conf.supybot.protocols.irc.ping.interval():
@@ -860,6 +1238,7 @@ class Irc(IrcCommandDispatcher):
         self.state.reset()
         self.queue.reset()
         self.fastqueue.reset()
+        self.floodControl.reset()
         self.startedSync.clear()
         for callback in self.callbacks:
             callback.reset()
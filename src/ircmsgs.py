@@ -80,6 +80,8 @@ class IrcMsg(object):
     # It's too useful to be able to tag IrcMsg objects with extra, unforeseen
     # data.  Goodbye, __slots__.
     # On second thought, let's use methods for tagging.
+    # Note that nick, user, and host aren't set by __init__; most messages
+    # never have them looked at, so __getattr__ fills them in on first use.
     __slots__ = ('args', 'command', 'host', 'nick', 'prefix', 'user',
                  '_hash', '_str', '_repr', '_len', 'tags')
     def __init__(self, s='', command='', args=(), prefix='', msg=None):
@@ -101,13 +103,15 @@ class IrcMsg(object):
                     self.prefix, s = s[1:].split(None, 1)
                 else:
                     self.prefix = ''
-                if ' :' in s: # Note the space: IPV6 addresses are bad w/o it.
-                    s, last = s.split(' :', 1)
-                    self.args = s.split()
-                    self.args.append(last.rstrip('\r\n'))
+                # Note the space: IPV6 addresses are bad w/o it.
+                i = s.find(' :')
+                if i != -1:
+                    args = s[:i].split()
+                    args.append(s[i+2:].rstrip('\r\n'))
                 else:
-                    self.args = s.split()
-                self.command = self.args.pop(0)
+                    args = s.split()
+                self.command = args.pop(0)
+                self.args = tuple(args)
             except (IndexError, ValueError):
                 raise MalformedIrcMsg, repr(originalString)
         else:
@@ -130,9 +134,16 @@ class IrcMsg(object):
                 self.command = command
                 assert all(ircutils.isValidArgument, args)
                 self.args = args
-        self.args = tuple(self.args)
+            self.args = tuple(self.args)
+
+    def _splitPrefix(self):
         if isUserHostmask(self.prefix):
-            (self.nick,self.user,self.host)=ircutils.splitHostmask(self.prefix)
+            # This is ircutils.splitHostmask, without its (second) regexp
+            # check of the prefix.
+            (nick, rest) = self.prefix.split('!', 1)
+            (user, host) = rest.split('@', 1)
+            (self.nick, self.user, self.host) = \
+                        (intern(nick), intern(user), intern(host))
         else:
             (self.nick, self.user, self.host) = (self.prefix,)*3
 
@@ -202,6 +213,9 @@ class IrcMsg(object):
         return self.tags.get(tag) # Returns None if it's not there.
 
     def __getattr__(self, attr):
+        if attr in ('nick', 'user', 'host'):
+            self._splitPrefix()
+            return getattr(self, attr)
         return self.tagged(attr)
 
 
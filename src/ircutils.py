@@ -138,30 +138,33 @@ def isChannel(s, chantypes='#&+!', channellen=50):
            len(s.split(None, 1)) == 1
 
 _patternCache = utils.structures.CacheDict(1000)
+def _compileHostmaskPattern(pattern):
+    # We make our own regexps, rather than use fnmatch, because fnmatch's
+    # case-insensitivity is not IRC's case-insensitity.
+    fd = sio()
+    for c in pattern:
+        if c == '*':
+            fd.write('.*')
+        elif c == '?':
+            fd.write('.')
+        elif c in '[{':
+            fd.write('[[{]')
+        elif c in '}]':
+            fd.write(r'[}\]]')
+        elif c in '|\\':
+            fd.write(r'[|\\]')
+        elif c in '^~':
+            fd.write('[~^]')
+        else:
+            fd.write(re.escape(c))
+    fd.write('$')
+    return re.compile(fd.getvalue(), re.I).match
+
 def _hostmaskPatternEqual(pattern, hostmask):
     try:
         return _patternCache[pattern](hostmask) is not None
     except KeyError:
-        # We make our own regexps, rather than use fnmatch, because fnmatch's
-        # case-insensitivity is not IRC's case-insensitity.
-        fd = sio()
-        for c in pattern:
-            if c == '*':
-                fd.write('.*')
-            elif c == '?':
-                fd.write('.')
-            elif c in '[{':
-                fd.write('[[{]')
-            elif c in '}]':
-                fd.write(r'[}\]]')
-            elif c in '|\\':
-                fd.write(r'[|\\]')
-            elif c in '^~':
-                fd.write('[~^]')
-            else:
-                fd.write(re.escape(c))
-        fd.write('$')
-        f = re.compile(fd.getvalue(), re.I).match
+        f = _compileHostmaskPattern(pattern)
         _patternCache[pattern] = f
         return f(hostmask) is not None
 
@@ -521,6 +524,146 @@ class IrcSet(utils.NormalizingSet):
         return (self.__class__, (list(self),))
 
 
+_wildcardRe = re.compile(r'[*?]')
+class HostmaskDict(dict):
+    """A dict whose keys are hostmask patterns, indexed so that the patterns
+    matching a given hostmask can be found without trying every one of them.
+
+    Each pattern is filed under the literal text it ends with (after its last
+    wildcard), the literal text it starts with (before its first wildcard), or
+    the literal text its host starts with, whichever it has first.  A lookup
+    then only has to try the patterns filed under a suffix or prefix of the
+    hostmask (or of its host), plus those patterns with no literal text to
+    file them under at all (like '*!*@*')."""
+    def __init__(self, *args, **kwargs):
+        self._index = ({}, {}, {})   # (suffixes, prefixes, host prefixes)
+        self._lengths = ({}, {}, {}) # Key length -> number of keys.
+        self._unindexed = {}
+        self._matchers = {}
+        self.update(*args, **kwargs)
+
+    def __reduce__(self):
+        return (self.__class__, (dict(self),))
+
+    def _key(self, pattern):
+        pattern = toLower(pattern)
+        pieces = _wildcardRe.split(pattern)
+        if len(pieces) == 1:
+            return (0, pattern) # No wildcards; the whole thing is a suffix.
+        if pieces[-1]:
+            return (0, pieces[-1])
+        if pieces[0]:
+            return (1, pieces[0])
+        if pattern.count('@') == 1:
+            host = pattern.split('@')[1]
+            host = _wildcardRe.split(host, 1)[0]
+            if host:
+                return (2, host)
+        return None
+
+    def __setitem__(self, pattern, value):
+        if pattern not in self:
+            key = self._key(pattern)
+            if key is None:
+                self._unindexed[pattern] = None
+            else:
+                (which, s) = key
+                self._index[which].setdefault(s, set()).add(pattern)
+                lengths = self._lengths[which]
+                lengths[len(s)] = lengths.get(len(s), 0) + 1
+            self._matchers[pattern] = None # Compiled when first needed.
+        dict.__setitem__(self, pattern, value)
+
+    def __delitem__(self, pattern):
+        dict.__delitem__(self, pattern)
+        del self._matchers[pattern]
+        key = self._key(pattern)
+        if key is None:
+            del self._unindexed[pattern]
+        else:
+            (which, s) = key
+            bucket = self._index[which][s]
+            bucket.remove(pattern)
+            if not bucket:
+                del self._index[which][s]
+            lengths = self._lengths[which]
+            lengths[len(s)] -= 1
+            if not lengths[len(s)]:
+                del lengths[len(s)]
+
+    def pop(self, pattern, *args):
+        if pattern in self:
+            value = self[pattern]
+            del self[pattern]
+            return value
+        elif args:
+            return args[0]
+        else:
+            raise KeyError, pattern
+
+    def popitem(self):
+        for pattern in self:
+            return (pattern, self.pop(pattern))
+        raise KeyError, 'popitem(): dictionary is empty'
+
+    def setdefault(self, pattern, value=None):
+        if pattern not in self:
+            self[pattern] = value
+        return self[pattern]
+
+    def update(self, *args, **kwargs):
+        for (pattern, value) in dict(*args, **kwargs).iteritems():
+            self[pattern] = value
+
+    def clear(self):
+        dict.clear(self)
+        self._index = ({}, {}, {})
+        self._lengths = ({}, {}, {})
+        self._unindexed.clear()
+        self._matchers.clear()
+
+    def _candidates(self, hostmask):
+        lowered = toLower(hostmask)
+        (suffixes, prefixes, hosts) = self._index
+        (suffixLengths, prefixLengths, hostLengths) = self._lengths
+        for n in suffixLengths:
+            if n <= len(lowered):
+                for pattern in suffixes.get(lowered[-n:], ()):
+                    yield pattern
+        for n in prefixLengths:
+            for pattern in prefixes.get(lowered[:n], ()):
+                yield pattern
+        if hostLengths:
+            i = lowered.find('@')
+            while i != -1:
+                host = lowered[i+1:]
+                for n in hostLengths:
+                    for pattern in hosts.get(host[:n], ()):
+                        yield pattern
+                i = lowered.find('@', i+1)
+        for pattern in self._unindexed:
+            yield pattern
+
+    def _matches(self, pattern, hostmask):
+        matcher = self._matchers[pattern]
+        if matcher is None:
+            matcher = _compileHostmaskPattern(pattern)
+            self._matchers[pattern] = matcher
+        return matcher(hostmask) is not None
+
+    def matches(self, hostmask):
+        """Returns the patterns which match hostmask."""
+        return [pattern for pattern in self._candidates(hostmask)
+                if self._matches(pattern, hostmask)]
+
+    def match(self, hostmask):
+        """Returns whether any of the patterns match hostmask."""
+        for pattern in self._candidates(hostmask):
+            if self._matches(pattern, hostmask):
+                return True
+        return False
+
+
 class FloodQueue(object):
     timeout = 0
     def __init__(self, timeout=None, queues=None):
@@ -631,7 +774,7 @@ def standardSubstitute(irc, msg, text, env=None):
             L = list(irc.state.channels[channel].users)
             if len(L) > 1:
                 n = msg.nick
-                while n == msg.nick:
+                while strEqual(n, msg.nick):
                     n = utils.iter.choice(L)
                 return n
             else:
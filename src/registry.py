@@ -61,6 +61,9 @@ class NonExistentRegistryEntry(RegistryException):
 
 _cache = utils.InsensitivePreservingDict()
 _lastModified = 0
+# Incremented whenever any value is set, so code caching registry values can
+# tell when it has to read them again.
+generation = 0
 def open(filename, clear=False):
     """Initializes the module by loading the registry file into memory."""
     global _lastModified
@@ -97,44 +100,59 @@ def open(filename, clear=False):
     _fd.close()
 
 def close(registry, filename, private=True):
-    first = True
-    fd = utils.file.AtomicFile(filename)
+    snapshot(registry, filename, private=private)()
+
+def snapshot(registry, filename, private=True):
+    """Returns a function which writes registry to filename as it is now.
+    Only the reading of the registry is done here; the formatting and writing
+    are left to the returned function, which may be called from any thread."""
+    entries = []
     for (name, value) in registry.getValues(getChildren=True):
         help = value.help()
-        if help:
-            lines = textwrap.wrap(value._help)
-            for (i, line) in enumerate(lines):
-                lines[i] = '# %s\n' % line
-            lines.insert(0, '###\n')
-            if first:
-                first = False
-            else:
-                lines.insert(0, '\n')
-            if hasattr(value, 'value'):
-                if value._showDefault:
-                    lines.append('#\n')
-                    try:
-                        x = value.__class__(value._default, value._help)
-                    except Exception, e:
-                        exception('Exception instantiating default for %s:',
-                                  value._name)
-                    try:
-                        lines.append('# Default value: %s\n' % x)
-                    except Exception, e:
-                        exception('Exception printing default value of %s:',
-                                  value._name)
-            lines.append('###\n')
-            fd.writelines(lines)
+        default = None
+        if help and hasattr(value, 'value') and value._showDefault:
+            try:
+                x = value.__class__(value._default, value._help)
+            except Exception, e:
+                exception('Exception instantiating default for %s:',
+                          value._name)
+            try:
+                default = '# Default value: %s\n' % x
+            except Exception, e:
+                exception('Exception printing default value of %s:',
+                          value._name)
+        s = None
         if hasattr(value, 'value'): # This lets us print help for non-values.
             try:
                 if private or not value._private:
                     s = value.serialize()
                 else:
                     s = 'CENSORED'
-                fd.write('%s: %s\n' % (name, s))
             except Exception, e:
                 exception('Exception printing value:')
-    fd.close()
+        entries.append((name, help and value._help, default, s))
+    def write():
+        first = True
+        fd = utils.file.AtomicFile(filename)
+        for (name, help, default, s) in entries:
+            if help:
+                lines = textwrap.wrap(help)
+                for (i, line) in enumerate(lines):
+                    lines[i] = '# %s\n' % line
+                lines.insert(0, '###\n')
+                if first:
+                    first = False
+                else:
+                    lines.insert(0, '\n')
+                if default is not None:
+                    lines.append('#\n')
+                    lines.append(default)
+                lines.append('###\n')
+                fd.writelines(lines)
+            if s is not None:
+                fd.write('%s: %s\n' % (name, s))
+        fd.close()
+    return write
 
 def isValidRegistryName(name):
     # Now we can have . and : in names.  I'm still gonna call shenanigans on
@@ -335,6 +353,8 @@ class Value(Group):
         100) convert to an integer in set() and check that the integer is less
         than 100 in this method.  You *must* call this parent method in your
         own setValue."""
+        global generation
+        generation += 1
         self._lastModified = time.time()
         self.value = v
         if self._supplyDefault:
@@ -55,16 +55,25 @@ class Schedule(drivers.IrcDriver):
     """An IrcDriver to handling scheduling of events.
 
     Events, in this case, are functions accepting no arguments.
+
+    Removing or rescheduling an event doesn't touch the heap; the event's
+    old entry is simply left in it, and skipped (and discarded) when it makes
+    its way to the top.  Once there are more such dead entries than live ones,
+    the heap is rebuilt without them.
     """
     def __init__(self):
         drivers.IrcDriver.__init__(self)
         self.schedule = []
         self.events = {}
+        self.entries = {} # Maps names to their live entry in the heap.
+        self.removed = 0 # Number of dead entries in the heap.
         self.counter = 0
 
     def reset(self):
         self.events.clear()
+        self.entries.clear()
         self.schedule[:] = []
+        self.removed = 0
         # We don't reset the counter here because if someone has held an id of
         # one of the nuked events, we don't want him removing new events with
         # his old id.
@@ -72,6 +81,22 @@ class Schedule(drivers.IrcDriver):
     def name(self):
         return 'Schedule'
 
+    def _isLive(self, entry):
+        return self.entries.get(entry[1]) is entry
+
+    def _push(self, t, name):
+        entry = mytuple((t, name))
+        self.entries[name] = entry
+        heapq.heappush(self.schedule, entry)
+
+    def _kill(self, name):
+        del self.entries[name]
+        self.removed += 1
+        if self.removed > 16 and self.removed > len(self.entries):
+            self.schedule = [e for e in self.schedule if self._isLive(e)]
+            heapq.heapify(self.schedule)
+            self.removed = 0
+
     def addEvent(self, f, t, name=None):
         """Schedules an event f to run at time t.
 
@@ -83,24 +108,21 @@ class Schedule(drivers.IrcDriver):
         assert name not in self.events, \
                'An event with the same name has already been scheduled.'
         self.events[name] = f
-        heapq.heappush(self.schedule, mytuple((t, name)))
+        self._push(t, name)
         return name
 
     def removeEvent(self, name):
         """Removes the event with the given name from the schedule."""
         f = self.events.pop(name)
-        self.schedule = [(t, n) for (t, n) in self.schedule if n != name]
-        # We must heapify here because the heap property may not be preserved
-        # by the above list comprehension.  We could, conceivably, just mark
-        # the elements of the heap as removed and ignore them when we heappop,
-        # but that would only save a constant factor (we're already linear for
-        # the listcomp) so I'm not worried about it right now.
-        heapq.heapify(self.schedule)
+        self._kill(name)
         return f
 
     def rescheduleEvent(self, name, t):
-        f = self.removeEvent(name)
-        self.addEvent(f, t, name=name)
+        """Changes the time the event with the given name will run to t."""
+        if name not in self.events:
+            raise KeyError, name
+        self._kill(name)
+        self._push(t, name)
 
     def addPeriodicEvent(self, f, t, name=None, now=True):
         """Adds a periodic event that is called every t seconds."""
@@ -117,19 +139,47 @@ class Schedule(drivers.IrcDriver):
 
     removePeriodicEvent = removeEvent
 
+    def _pop(self):
+        entry = heapq.heappop(self.schedule)
+        if self._isLive(entry):
+            del self.entries[entry[1]]
+            return entry
+        else:
+            self.removed -= 1
+            return None
+
+    def nextEventTime(self):
+        """Returns the time at which the next event is due, or None if no
+        events are scheduled."""
+        while self.schedule and not self._isLive(self.schedule[0]):
+            self._pop()
+        if self.schedule:
+            return self.schedule[0][0]
+        else:
+            return None
+
     def run(self):
+        """Runs the events that are due, and returns the number of seconds
+        until the next one is, or None if no events are scheduled."""
         if len(drivers._drivers) == 1 and not world.testing:
             log.error('Schedule is the only remaining driver, '
                       'why do we continue to live?')
             time.sleep(1) # We're the only driver; let's pause to think.
         while self.schedule and self.schedule[0][0] < time.time():
-            (t, name) = heapq.heappop(self.schedule)
-            f = self.events[name]
-            del self.events[name]
+            entry = self._pop()
+            if entry is None:
+                continue
+            name = entry[1]
+            f = self.events.pop(name)
             try:
                 f()
             except Exception, e:
                 log.exception('Uncaught exception in scheduled function:')
+        next = self.nextEventTime()
+        if next is None:
+            return None
+        else:
+            return max(0, next - time.time())
 
 try:
     ignore(schedule)
@@ -141,6 +191,7 @@ removeEvent = schedule.removeEvent
 rescheduleEvent = schedule.rescheduleEvent
 addPeriodicEvent = schedule.addPeriodicEvent
 removePeriodicEvent = removeEvent
+nextEventTime = schedule.nextEventTime
 run = schedule.run
 
 
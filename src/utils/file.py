@@ -125,7 +125,8 @@ class AtomicFile(file):
         makeBackupIfSmaller = True
         allowEmptyOverwrite = True
     def __init__(self, filename, mode='w', allowEmptyOverwrite=None,
-                 makeBackupIfSmaller=None, tmpDir=None, backupDir=None):
+                 makeBackupIfSmaller=None, tmpDir=None, backupDir=None,
+                 sync=False):
         if tmpDir is None:
             tmpDir = force(self.default.tmpDir)
         if backupDir is None:
@@ -137,6 +138,7 @@ class AtomicFile(file):
         if mode not in ('w', 'wb'):
             raise ValueError, format('Invalid mode: %q', mode)
         self.rolledback = False
+        self.sync = sync
         self.allowEmptyOverwrite = allowEmptyOverwrite
         self.makeBackupIfSmaller = makeBackupIfSmaller
         self.filename = filename
@@ -163,6 +165,10 @@ class AtomicFile(file):
 
     def close(self):
         if not self.rolledback:
+            if self.sync:
+                # Make sure the data is on disk before it replaces the file.
+                self.flush()
+                os.fsync(self.fileno())
             super(AtomicFile, self).close()
             # We don't mind writing an empty file if the file we're overwriting
             # doesn't exist.
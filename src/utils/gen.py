@@ -273,6 +273,12 @@ class InsensitivePreservingDict(UserDict.DictMixin, object):
             L.append(k)
         return L
 
+    def copy(self):
+        ret = self.__class__.__new__(self.__class__)
+        ret.__dict__.update(self.__dict__)
+        ret.data = self.data.copy()
+        return ret
+
     def __reduce__(self):
         return (self.__class__, (dict(self.data.values()),))
 
@@ -181,10 +181,13 @@ def perlReToReplacer(s):
         g = True
         flags = filter('g'.__ne__, flags)
     r = perlReToPythonRe(sep.join(('', regexp, flags)))
-    if g:
-        return curry(r.sub, replace)
-    else:
-        return lambda s: r.sub(replace, s, 1)
+    count = (not g) and 1 or 0
+    f = lambda s: r.sub(replace, s, count)
+    # So the replacement can be done elsewhere, e.g., in another process.
+    f.regexp = r
+    f.replacement = replace
+    f.count = count
+    return f
 
 _perlVarSubstituteRe = re.compile(r'\$\{([^}]+)\}|\$([a-zA-Z][a-zA-Z0-9]*)')
 def perlVariableSubstitute(vars, text):
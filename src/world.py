@@ -35,6 +35,7 @@ import gc
 import os
 import sys
 import time
+import Queue
 import atexit
 import threading
 import multiprocessing # python 2.6 and later!
@@ -91,19 +92,162 @@ def getIrc(network):
 def _flushUserData():
     userdataFilename = os.path.join(conf.supybot.directories.conf(),
                                     'userdata.conf')
-    registry.close(conf.users, userdataFilename)
+    write(registry.snapshot(conf.users, userdataFilename))
 
 flushers = [_flushUserData] # A periodic function will flush all these.
 
 registryFilename = None
 
-def flush():
-    """Flushes all the registered flushers."""
-    for (i, f) in enumerate(flushers):
+###
+# Flushers may hand the actual writing of their files off to the flusher
+# thread by taking a snapshot of what they need to write and passing a
+# function which writes that snapshot to write().  During a background flush
+# (as done by upkeep) write() returns right away; otherwise it waits until the
+# function (and everything written before it) has run, so flush() still means
+# everything is on disk when it returns.
+###
+class FlushStats(object):
+    """Timing statistics for a flusher."""
+    __slots__ = ('calls', 'skipped', 'foreground', 'background', 'last')
+    def __init__(self):
+        self.calls = 0
+        self.skipped = 0
+        self.foreground = 0.0 # Seconds spent in the flusher itself.
+        self.background = 0.0 # Seconds spent in its writes.
+        self.last = 0.0
+
+    def __repr__(self):
+        return '<FlushStats calls=%s skipped=%s foreground=%.3f ' \
+               'background=%.3f>' % (self.calls, self.skipped,
+                                     self.foreground, self.background)
+
+flushStats = {} # Flusher name -> FlushStats.
+
+def _flusherName(f):
+    if getattr(f, 'im_self', None) is not None:
+        return '%s.%s' % (f.im_self.__class__.__name__, f.__name__)
+    else:
+        return '%s.%s' % (f.__module__, getattr(f, '__name__', f))
+
+def _getFlushStats(f):
+    name = _flusherName(f)
+    try:
+        return flushStats[name]
+    except KeyError:
+        stats = flushStats[name] = FlushStats()
+        return stats
+
+class FlusherThread(SupyThread):
+    """Runs the functions passed to write(), one at a time, in the order they
+    were passed."""
+    def __init__(self):
+        SupyThread.__init__(self, name='Flusher')
+        self.setDaemon(True)
+        self.writes = Queue.Queue()
+
+    def run(self):
+        while True:
+            (writer, flusher, done) = self.writes.get()
+            started = time.time()
+            try:
+                writer()
+            except Exception, e:
+                log.exception('Uncaught exception in flusher thread (%s):',
+                              writer)
+            if flusher is not None:
+                _getFlushStats(flusher).background += time.time() - started
+                _pendingLock.acquire()
+                try:
+                    _pendingWrites[flusher] -= 1
+                    if not _pendingWrites[flusher]:
+                        del _pendingWrites[flusher]
+                finally:
+                    _pendingLock.release()
+            if done is not None:
+                done.set()
+
+_flusherThread = None
+_pendingLock = threading.Lock()
+_pendingWrites = {} # Flusher -> number of its writes not yet written.
+_backgroundFlushThread = None # The thread doing a background flush, if any.
+_currentFlusher = None
+
+def isBackgroundFlush():
+    """Returns whether the current thread is in the middle of a background
+    flush, i.e., whether write() will return without waiting for its
+    writer."""
+    return _backgroundFlushThread is threading.currentThread()
+
+def write(writer):
+    """Runs writer, a function which writes something to disk, on the flusher
+    thread.  Unless we're in the middle of a background flush, waits until
+    writer has run."""
+    global _flusherThread
+    if _flusherThread is threading.currentThread():
+        writer()
+        return
+    _pendingLock.acquire()
+    try:
+        if _flusherThread is None or not _flusherThread.isAlive():
+            _flusherThread = FlusherThread()
+            _flusherThread.start()
+    finally:
+        _pendingLock.release()
+    flusher = None
+    if isBackgroundFlush() or isMainThread():
+        flusher = _currentFlusher
+    if flusher is not None:
+        _pendingLock.acquire()
+        try:
+            _pendingWrites[flusher] = _pendingWrites.get(flusher, 0) + 1
+        finally:
+            _pendingLock.release()
+    if isBackgroundFlush():
+        _flusherThread.writes.put((writer, flusher, None))
+    else:
+        done = threading.Event()
+        _flusherThread.writes.put((writer, flusher, done))
+        done.wait()
+
+def _runFlusher(i, f):
+    global _currentFlusher
+    stats = _getFlushStats(f)
+    _currentFlusher = f
+    started = time.time()
+    try:
         try:
             f()
         except Exception, e:
             log.exception('Uncaught exception in flusher #%s (%s):', i, f)
+    finally:
+        _currentFlusher = None
+        stats.last = time.time() - started
+        stats.foreground += stats.last
+        stats.calls += 1
+
+def flush():
+    """Flushes all the registered flushers, and returns once everything they
+    write has been written."""
+    for (i, f) in enumerate(flushers[:]):
+        _runFlusher(i, f)
+
+def flushInBackground():
+    """Flushes all the registered flushers, leaving their writes to the
+    flusher thread.  A flusher whose writes from the last flush haven't been
+    written yet is skipped this time; its changes will go out with the next
+    flush."""
+    global _backgroundFlushThread
+    _backgroundFlushThread = threading.currentThread()
+    try:
+        for (i, f) in enumerate(flushers[:]):
+            if f in _pendingWrites:
+                _getFlushStats(f).skipped += 1
+                log.debug('Skipping flusher #%s (%s), its last writes are '
+                          'still pending.', i, f)
+                continue
+            _runFlusher(i, f)
+    finally:
+        _backgroundFlushThread = None
 
 def debugFlush(s=''):
     if conf.supybot.debug.flushVeryOften():
@@ -147,7 +291,10 @@ def upkeep():
             sys.stderr.truncate() # Truncates to current offset.
     doFlush = conf.supybot.flush() and not starting
     if doFlush:
-        flush()
+        if dying:
+            flush()
+        else:
+            flushInBackground()
         # This is so registry._cache gets filled.
         # This seems dumb, so we'll try not doing it anymore.
         #if registryFilename is not None:
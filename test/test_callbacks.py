@@ -453,6 +453,28 @@ class PrivmsgTestCase(ChannelPluginTestCase):
         self.assertRegexp('help first firstcmd', 'First', 0) # no re.I flag.
         self.assertRegexp('help firstrepeat firstcmd', 'FirstRepeat', 0)
 
+    def testCommandIndex(self):
+        first = self.First(self.irc)
+        second = self.Second(self.irc)
+        self.irc.addCallback(first)
+        self.irc.addCallback(second)
+        index = callbacks.CommandIndex()
+        self.failUnless(first in index.get(self.irc.callbacks, 'firstcmd'))
+        self.failIf(second in index.get(self.irc.callbacks, 'firstcmd'))
+        self.failUnless(second in index.get(self.irc.callbacks, 'second'))
+        self.assertEqual(index.get(self.irc.callbacks, 'nosuchcmd'), [])
+
+    def testCommandIndexNoticesNewCommands(self):
+        self.irc.addCallback(self.First(self.irc))
+        self.assertResponse('firstcmd', 'foo')
+        self.irc.addCallback(self.FirstRepeat(self.irc))
+        self.assertError('firstcmd')
+        self.irc.removeCallback('FirstRepeat')
+        self.assertResponse('firstcmd', 'foo')
+        self.First.first = self.First.firstcmd.im_func
+        callbacks.commandsChanged()
+        self.assertResponse('first', 'foo')
+
     class TwoRepliesFirstAction(callbacks.Plugin):
         def testactionreply(self, irc, msg, args):
             irc.reply('foo', action=True)
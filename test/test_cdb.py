@@ -0,0 +1,95 @@
+###
+# Copyright (c) 2002-2005, Jeremiah Fincher
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+###
+
+
+from supybot.test import *
+
+import os
+
+import supybot.cdb as cdb
+
+class ReaderTestCase(SupyTestCase):
+    def setUp(self):
+        SupyTestCase.setUp(self)
+        self.filename = os.path.join(conf.supybot.directories.data(),
+                                     'ReaderTest.cdb')
+        maker = cdb.Maker(self.filename)
+        for i in range(1000):
+            maker.add('key%s' % i, 'value%s' % i)
+        maker.add('dup', 'first')
+        maker.add('dup', 'second')
+        maker.finish()
+        self.reader = cdb.Reader(self.filename)
+
+    def tearDown(self):
+        self.reader.close()
+        os.remove(self.filename)
+        SupyTestCase.tearDown(self)
+
+    def testLookups(self):
+        self.assertEqual(len(self.reader), 1002)
+        self.assertEqual(self.reader['key0'], 'value0')
+        self.assertEqual(self.reader['key999'], 'value999')
+        self.failUnless('key500' in self.reader)
+        self.failIf('key1000' in self.reader)
+        self.assertRaises(KeyError, self.reader.__getitem__, 'key1000')
+        self.assertEqual(self.reader.get('key1000', 'foo'), 'foo')
+
+    def testDuplicates(self):
+        self.assertEqual(self.reader['dup'], 'first')
+        self.assertEqual(self.reader.find('dup', loop=1), 'second')
+        self.assertEqual(self.reader.findall('dup'), ['first', 'second'])
+
+    def testGetmany(self):
+        self.assertEqual(self.reader.getmany(['key1', 'nope', 'key2']),
+                         ['value1', None, 'value2'])
+        self.assertEqual(self.reader.getmany(['nope'], default=''), [''])
+
+    def testReentrantIteration(self):
+        items = []
+        for (key, value) in self.reader.iteritems():
+            self.assertEqual(self.reader[key], self.reader.findall(key)[0])
+            items.append((key, value))
+        self.assertEqual(len(items), 1002)
+        self.assertEqual(len(list(self.reader.iteritems())), 1002)
+
+    def testEmpty(self):
+        maker = cdb.Maker(self.filename + '.empty')
+        maker.finish()
+        reader = cdb.Reader(self.filename + '.empty')
+        try:
+            self.assertEqual(len(reader), 0)
+            self.assertEqual(list(reader.iteritems()), [])
+            self.failIf('foo' in reader)
+        finally:
+            reader.close()
+            os.remove(self.filename + '.empty')
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
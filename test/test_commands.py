@@ -29,7 +29,11 @@
 
 from supybot.test import *
 
+import re
+import socket
+
 from supybot.commands import *
+import supybot.commands as commands
 import supybot.irclib as irclib
 import supybot.ircmsgs as ircmsgs
 import supybot.callbacks as callbacks
@@ -168,6 +172,67 @@ class FirstTestCase(CommandsTestCase):
     def testFirstConverterFailsAndNotErroredState(self):
         self.assertStateErrored([first('int', 'something')], ['words'],
                                 errored=False)
+class FailingRegexp(object):
+    def search(self, s):
+        raise ValueError, s
+
+class ProcessPoolTestCase(SupyTestCase):
+    def setUp(self):
+        SupyTestCase.setUp(self)
+        self.pool = commands.ProcessPool(lambda: 1)
+
+    def tearDown(self):
+        self.pool.close()
+        SupyTestCase.tearDown(self)
+
+    def testSearch(self):
+        r = re.compile('fo+')
+        self.assertEqual(self.pool.search(r, ['foo', 'bar', 'xfx', 'fo'], 1),
+                         [True, False, False, True])
+        self.assertEqual(self.pool.search(r, [], 1), [])
+
+    def testWorkersAreReused(self):
+        self.assertEqual(self.pool.apply(commands.regexpMatch,
+                                         (re.compile('o+'), 'foo'), 1), 'oo')
+        worker = self.pool.idle[0]
+        self.assertEqual(self.pool.apply(commands.regexpReplace,
+                                         (re.compile('o'), 'a', 0, 'foo'), 1),
+                         'faa')
+        self.failUnless(self.pool.idle == [worker])
+
+    def testErrors(self):
+        v = self.pool.apply(commands.regexpReplace,
+                            (re.compile('o'), r'\1', 0, 'foo'), 1)
+        self.failUnless(v.startswith('Error: '))
+        self.assertEqual(len(self.pool.idle), 1)
+
+    def testSearchErrorsDontMatch(self):
+        self.assertEqual(self.pool.search(FailingRegexp(), ['foo'], 1),
+                         [False])
+
+    def testWorkersDontKeepSocketsOpen(self):
+        (ours, theirs) = socket.socketpair()
+        try:
+            self.assertEqual(self.pool.search(re.compile('o'), ['foo'], 1),
+                             [True])
+            self.assertEqual(len(self.pool.idle), 1)
+            ours.close()
+            theirs.settimeout(1)
+            self.assertEqual(theirs.recv(1), '')
+        finally:
+            theirs.close()
+
+    def testTimeout(self):
+        r = re.compile('(a*)*b')
+        s = 'a' * 30
+        self.assertEqual(self.pool.search(r, ['ab', s, 'b', s, 'ab'], 0.1),
+                         [True, False, True, False, True])
+        self.assertEqual(self.pool.started, 1)
+        self.assertRaises(commands.ProcessTimeoutError, self.pool.apply,
+                          commands.regexpSearch, (r, s), 0.1)
+        self.assertEqual(self.pool.apply(commands.regexpSearch,
+                                         (r, 'aab'), 1), True)
+
 
 # vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
 
@@ -0,0 +1,197 @@
+###
+# Copyright (c) 2002-2005, Jeremiah Fincher
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+###
+
+
+from supybot.test import *
+
+import re
+import os
+
+import supybot.dbi as dbi
+
+class FlatfileMappingTestCase(SupyTestCase):
+    def setUp(self):
+        SupyTestCase.setUp(self)
+        self.filename = os.path.join(conf.supybot.directories.data(),
+                                     'FlatfileMappingTest.db')
+        if os.path.exists(self.filename):
+            os.remove(self.filename)
+
+    def lines(self):
+        fd = file(self.filename)
+        try:
+            return fd.read().splitlines()
+        finally:
+            fd.close()
+
+    def testAddGetSetRemove(self):
+        m = dbi.FlatfileMapping(self.filename)
+        self.assertEqual(m.add('foo'), 1)
+        self.assertEqual(m.add('bar'), 2)
+        self.assertEqual(m.get(1), 'foo')
+        self.assertEqual(m.get(2), 'bar')
+        m.set(1, 'baz')
+        self.assertEqual(m.get(1), 'baz')
+        m.remove(2)
+        self.assertRaises(dbi.NoRecordError, m.get, 2)
+        self.assertRaises(dbi.NoRecordError, m.get, 3)
+        self.assertEqual(list(m), [(1, 'baz')])
+
+    def testFormatIsUnchanged(self):
+        m = dbi.FlatfileMapping(self.filename)
+        m.add('foo')
+        m.add('bar')
+        m.vacuumRatio = 1
+        m.set(1, 'baz')
+        self.assertEqual(self.lines(),
+                         ['000003', '------:foo', '000002:bar', '000001:baz'])
+        m.close()
+        self.assertEqual(self.lines(), ['000003', '000002:bar', '000001:baz'])
+
+    def testReopen(self):
+        m = dbi.FlatfileMapping(self.filename)
+        for s in ['foo', 'bar', 'baz']:
+            m.add(s)
+        m.remove(2)
+        m.flush()
+        m = dbi.FlatfileMapping(self.filename)
+        self.assertEqual(m.removed, 1)
+        self.assertEqual(m.get(1), 'foo')
+        self.assertEqual(m.get(3), 'baz')
+        self.assertRaises(dbi.NoRecordError, m.get, 2)
+        self.assertEqual(m.add('qux'), 4)
+
+    def testAutomaticVacuum(self):
+        m = dbi.FlatfileMapping(self.filename)
+        for i in range(10):
+            m.add(str(i))
+        for i in range(20):
+            m.set(1, 'foo%s' % i)
+            self.failIf(m.removed > len(m.offsets))
+        self.assertEqual(len(self.lines()), 11 + m.removed)
+        self.assertEqual(m.get(1), 'foo19')
+        self.assertEqual(m.get(10), '9')
+
+    def testDuplicatesAreVacuumed(self):
+        fd = file(self.filename, 'w')
+        fd.write('000003\n000001:foo\n000002:bar\n000001:baz\n')
+        fd.close()
+        m = dbi.FlatfileMapping(self.filename)
+        self.assertEqual(m.get(1), 'foo')
+        self.assertEqual(self.lines(), ['000003', '000001:foo', '000002:bar'])
+
+    def testMalformedLinesAreSkipped(self):
+        fd = file(self.filename, 'w')
+        fd.write('000004\n000001:foo\ngarbage\nxyzzy:bar\n000003:baz\n'
+                 '000001:qux\n')
+        fd.close()
+        m = dbi.FlatfileMapping(self.filename)
+        self.assertEqual(m.get(1), 'foo')
+        self.assertEqual(m.get(3), 'baz')
+        self.assertRaises(dbi.NoRecordError, m.get, 2)
+        self.assertEqual(list(m), [(1, 'foo'), (3, 'baz')])
+        m.vacuum()
+        self.assertEqual(self.lines(), ['000004', '000001:foo', 'garbage',
+                                        'xyzzy:bar', '000003:baz'])
+
+class LiteralsTestCase(SupyTestCase):
+    def testRegexpLiterals(self):
+        f = lambda s, flags=0: dbi.regexpLiterals(re.compile(s, flags))
+        self.assertEqual(f('foo'), ['foo'])
+        self.assertEqual(f('foo.*bar'), ['foo', 'bar'])
+        self.assertEqual(f('^foo(bar)+baz?'), ['foo', 'bar', 'ba'])
+        self.assertEqual(f('foo|bar'), [])
+        self.assertEqual(f('(?:qux)*[abc]x'), ['x'])
+        self.assertEqual(f(r'a\.b'), ['a.b'])
+        self.assertEqual(f('FOO', re.I), ['FOO'])
+
+    def testGlobLiterals(self):
+        self.assertEqual(dbi.globLiterals('foo*bar?baz'),
+                         ['foo', 'bar', 'baz'])
+        self.assertEqual(dbi.globLiterals('*[abc]def[!]x]'), ['def'])
+        self.assertEqual(dbi.globLiterals('*'), [])
+
+
+class TextIndexTestCase(SupyTestCase):
+    def testCandidates(self):
+        index = dbi.TextIndex()
+        index.add(1, 'The quick brown fox')
+        index.add(2, 'jumped over the lazy dog')
+        index.add(3, 'QUICKLY')
+        self.assertEqual(index.candidates(['quick']), set([1, 3]))
+        self.assertEqual(index.candidates(['quick', 'fox']), set([1]))
+        self.assertEqual(index.candidates(['the']), set([1, 2]))
+        self.assertEqual(index.candidates(['cat']), set())
+        self.assertEqual(index.candidates(['ox', '']), None)
+        index.add(1, 'a slow brown fox')
+        self.assertEqual(index.candidates(['quick']), set([3]))
+        index.remove(3)
+        self.assertEqual(index.candidates(['quick']), set())
+        self.assertEqual(len(index), 2)
+        self.failIf('qui' in index.ids)
+
+
+class DBSearchTestCase(SupyTestCase):
+    class DB(dbi.DB):
+        class Record(dbi.Record):
+            __fields__ = ['text', 'by']
+        textFields = ('text',)
+
+    def setUp(self):
+        SupyTestCase.setUp(self)
+        self.filename = os.path.join(conf.supybot.directories.data(),
+                                     'DBSearchTest.db')
+        if os.path.exists(self.filename):
+            os.remove(self.filename)
+
+    def texts(self, records):
+        return [record.text for record in records]
+
+    def testSearch(self):
+        db = self.DB(self.filename)
+        for (text, by) in [('foo bar', 1), ('Foo baz', 2), ('qux', 1)]:
+            db.add(db.Record(text=text, by=by))
+        self.assertEqual(self.texts(db.search(['foo'])), ['foo bar', 'Foo baz'])
+        self.assertEqual(self.texts(db.search(['foo'], lambda r: r.by == 2)),
+                         ['Foo baz'])
+        self.assertEqual(self.texts(db.search([], lambda r: r.by == 1)),
+                         ['foo bar', 'qux'])
+        self.assertEqual(self.texts(db.search(['o b'])),
+                         ['foo bar', 'Foo baz'])
+        record = db.get(3)
+        record.text = 'foo qux'
+        db.set(3, record)
+        db.remove(1)
+        self.assertEqual(self.texts(db.search(['foo'])), ['Foo baz', 'foo qux'])
+        db.close()
+        db = self.DB(self.filename)
+        self.assertEqual(self.texts(db.search(['qux'])), ['foo qux'])
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
@@ -0,0 +1,228 @@
+###
+# Copyright (c) 2002-2005, Jeremiah Fincher
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+###
+
+
+from supybot.test import *
+
+import socket
+
+import supybot.irclib as irclib
+import supybot.ircmsgs as ircmsgs
+import supybot.drivers as drivers
+import supybot.drivers.Select as Select
+
+class ReceiveBufferTestCase(SupyTestCase):
+    def setUp(self):
+        SupyTestCase.setUp(self)
+        (self.server, self.client) = socket.socketpair()
+
+    def tearDown(self):
+        self.server.close()
+        self.client.close()
+        SupyTestCase.tearDown(self)
+
+    def testLines(self):
+        buf = drivers.ReceiveBuffer()
+        self.server.sendall('PING :foo\r\nPING :b')
+        self.assertEqual(buf.recv(self.client), 18)
+        self.assertEqual(buf.lines(), ['PING :foo\r'])
+        self.assertEqual(buf.lines(), [])
+        self.assertEqual(len(buf), 7)
+        self.server.sendall('ar\r\nPING :baz\r\n')
+        buf.recv(self.client)
+        self.assertEqual(buf.lines(), ['PING :bar\r', 'PING :baz\r'])
+        self.assertEqual(len(buf), 0)
+
+    def testClosed(self):
+        buf = drivers.ReceiveBuffer()
+        self.server.close()
+        self.assertEqual(buf.recv(self.client), 0)
+
+    def testTailSurvivesCompaction(self):
+        buf = drivers.ReceiveBuffer(minRead=16, maxRead=16)
+        lines = []
+        data = ''.join(['PRIVMSG #foo :%s\r\n' % i for i in range(100)])
+        self.server.sendall(data)
+        self.server.close()
+        while buf.recv(self.client):
+            lines.extend(buf.lines())
+        self.assertEqual(lines, data.split('\n')[:-1])
+
+    def testLongLinesGrowTheBuffer(self):
+        buf = drivers.ReceiveBuffer(minRead=16, maxRead=16)
+        line = 'PRIVMSG #foo :%s\r' % ('x' * 1000)
+        self.server.sendall(line + '\n')
+        self.server.close()
+        lines = []
+        while buf.recv(self.client):
+            lines.extend(buf.lines())
+        self.assertEqual(lines, [line])
+
+    def testReadSizeAdapts(self):
+        buf = drivers.ReceiveBuffer(minRead=16, maxRead=64)
+        self.server.sendall('x' * 1000)
+        buf.recv(self.client)
+        buf.recv(self.client)
+        self.assertEqual(buf.readSize, 64)
+        buf.reset()
+        self.assertEqual(buf.readSize, 16)
+        self.assertEqual(len(buf), 0)
+
+
+class SendBufferTestCase(SupyTestCase):
+    def setUp(self):
+        SupyTestCase.setUp(self)
+        (self.server, self.client) = socket.socketpair()
+
+    def tearDown(self):
+        self.server.close()
+        self.client.close()
+        SupyTestCase.tearDown(self)
+
+    def testCoalesces(self):
+        buf = drivers.SendBuffer()
+        buf.write('PING :foo\r\n')
+        buf.write('')
+        buf.write('PING :bar\r\n')
+        self.assertEqual(len(buf), 22)
+        self.assertEqual(buf.send(self.client), 22)
+        self.failIf(buf)
+        self.assertEqual(buf.send(self.client), 0)
+        self.assertEqual(self.server.recv(100), 'PING :foo\r\nPING :bar\r\n')
+
+    def testChunksAreLimited(self):
+        buf = drivers.SendBuffer(maxWrite=16)
+        for s in ['x' * 10, 'y' * 10, 'z' * 20]:
+            buf.write(s)
+        self.assertEqual(buf.send(self.client), 10)
+        self.assertEqual(buf.send(self.client), 10)
+        self.assertEqual(buf.send(self.client), 20)
+        self.failIf(buf)
+
+    def testPartialWrites(self):
+        class Conn(object):
+            def __init__(self):
+                self.data = []
+            def send(self, s):
+                s = str(s)[:3]
+                self.data.append(s)
+                return len(s)
+        conn = Conn()
+        buf = drivers.SendBuffer()
+        buf.write('abcdefg')
+        self.assertEqual(buf.send(conn), 3)
+        buf.write('hij')
+        self.assertEqual(len(buf), 7)
+        while buf:
+            buf.send(conn)
+        self.assertEqual(conn.data, ['abc', 'def', 'g', 'hij'])
+        buf.write('klm')
+        buf.reset()
+        self.failIf(buf)
+        self.assertEqual(len(buf), 0)
+
+
+class SocketPairDriver(Select.SelectDriver):
+    """A SelectDriver connected to the other end of a socketpair, server,
+    instead of to a server."""
+    def reconnect(self, reset=True):
+        (self.conn, self.server) = socket.socketpair()
+        self.currentServer = self.conn.getsockname()
+        self.connected = True
+
+class Poller(Select.Poller):
+    """A Poller of only the given drivers."""
+    def __init__(self, drivers):
+        self.drivers = drivers
+
+    def _drivers(self):
+        return self.drivers
+
+class PollerTestCase(SupyTestCase):
+    def setUp(self):
+        SupyTestCase.setUp(self)
+        self.drivers = []
+        self.poller = Poller(self.drivers)
+
+    def tearDown(self):
+        for driver in self.drivers:
+            drivers._newDrivers.remove((driver.name(), driver))
+            driver.conn.close()
+            driver.server.close()
+            driver.irc._reallyDie()
+        SupyTestCase.tearDown(self)
+
+    def driver(self, network):
+        conf.registerNetwork(network)
+        driver = SocketPairDriver(irclib.Irc(network))
+        self.drivers.append(driver)
+        return driver
+
+    def recvUntil(self, sock, s):
+        sock.settimeout(1)
+        data = ''
+        while s not in data:
+            data += sock.recv(4096)
+        return data
+
+    def testWait(self):
+        (r, w) = socket.socketpair()
+        try:
+            self.assertEqual(self.poller._wait([r], [], 0), ([], []))
+            w.sendall('x')
+            self.assertEqual(self.poller._wait([r], [w], 0), ([r], [w]))
+            self.assertEqual(self.poller._wait([], [], 0), ([], []))
+        finally:
+            r.close()
+            w.close()
+
+    def testTimeout(self):
+        driver = self.driver('pollertest')
+        driver._sendIfMsgs()
+        self.failUnless(self.poller._timeout(self.drivers) <=
+                        conf.supybot.drivers.poll())
+        driver.irc.sendMsg(ircmsgs.ping('foo'))
+        self.assertEqual(self.poller._timeout(self.drivers), 0)
+
+    def testErrorsStayWithTheirDriver(self):
+        good = self.driver('pollertest1')
+        bad = self.driver('pollertest2')
+        def feedMsg(msg):
+            raise ValueError, 'Oops.'
+        bad.irc.feedMsg = feedMsg
+        for driver in self.drivers:
+            driver.server.sendall('PING :foo\r\n')
+        self.poller.run()
+        self.failIf(bad.connected)
+        self.failIf(bad.nextReconnectTime is None)
+        self.failUnless(good.connected)
+        self.recvUntil(good.server, 'PONG :foo')
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
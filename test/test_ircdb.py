@@ -344,6 +344,33 @@ class IrcChannelTestCase(IrcdbTestCase):
         c.removeBan(banmask)
         self.failIf(c.checkIgnored(prefix))
 
+    def testExpiration(self):
+        prefix = 'foo!bar@baz'
+        c = ircdb.IrcChannel()
+        c.addBan('*!*@baz', time.time() - 1)
+        c.addIgnore('foo!*@*', time.time() - 1)
+        c.addBan('*!*@quux', time.time() + 60)
+        self.failIf(c.checkIgnored(prefix))
+        self.failIf('*!*@baz' in c.bans)
+        self.failIf('foo!*@*' in c.ignores)
+        self.assertEqual([ban for (ban, _) in c.expiredBans], ['*!*@baz'])
+        self.failUnless(c.checkBan('foo!bar@quux'))
+
+class HostmaskExpirationsTestCase(SupyTestCase):
+    def test(self):
+        d = ircdb.HostmaskExpirations()
+        d['*!*@baz'] = 0
+        d['*!*@*.baz'] = 100
+        d['foo!*@*'] = 200
+        self.assertEqual(d.nextExpiration, 100)
+        self.assertEqual(d.expire(50), [])
+        self.assertEqual(d.expire(150), [('*!*@*.baz', 100)])
+        self.assertEqual(d.nextExpiration, 200)
+        self.assertEqual(d.expire(250), [('foo!*@*', 200)])
+        self.assertEqual(d.nextExpiration, 0)
+        self.assertEqual(d.keys(), ['*!*@baz'])
+        self.failUnless(d.check('foo!bar@baz'))
+
 class UsersDictionaryTestCase(IrcdbTestCase):
     filename = os.path.join(conf.supybot.directories.conf(),
                             'UsersDictionaryTestCase.conf')
@@ -396,6 +423,57 @@ class UsersDictionaryTestCase(IrcdbTestCase):
         u2 = self.users.newUser()
         u2.addHostmask('*!xyzzy@baz.domain.c?m')
         self.assertRaises(ValueError, self.users.setUser, u2)
+        u2.hostmasks.clear()
+        u2.addHostmask('*!*@*.domain.com')
+        self.assertRaises(ValueError, self.users.setUser, u2)
+        u2.hostmasks.clear()
+        u2.addHostmask('bar!*@quux.example.com')
+        u2.name = 'bar'
+        self.users.setUser(u2)
+        self.assertEqual(self.users.getUser('bar!baz@quux.example.com'), u2)
+        self.users.delUser(u.id)
+        self.assertRaises(KeyError, self.users.getUser, 'foo')
+        self.assertRaises(KeyError, self.users.getUser, hostmask)
+
+    def testIndexFollowsChanges(self):
+        u = self.users.newUser()
+        u.name = 'foo'
+        u.addHostmask('foo!bar@baz.domain.com')
+        self.users.setUser(u)
+        self.assertRaises(KeyError, self.users.getUser, 'foo!bar@quux.com')
+        u.name = 'bar'
+        u.removeHostmask('foo!bar@baz.domain.com')
+        u.addHostmask('*!*@quux.com')
+        self.users.setUser(u)
+        self.assertRaises(KeyError, self.users.getUser, 'foo')
+        self.assertEqual(self.users.getUser('bar'), u)
+        self.assertEqual(self.users.getUser('foo!bar@quux.com'), u)
+        self.assertRaises(KeyError, self.users.getUser,
+                          'foo!bar@baz.domain.com')
+        u.addAuth('foo!bar@elsewhere')
+        self.users.setUser(u)
+        self.assertEqual(self.users.getUser('foo!bar@elsewhere'), u)
+
+    def testIndexFollowsIrcUserMethods(self):
+        u = self.users.newUser()
+        u.name = 'foo'
+        u.addHostmask('foo!bar@baz.domain.com')
+        self.users.setUser(u)
+        self.assertEqual(self.users.getUser('foo!bar@baz.domain.com'), u)
+        self.assertRaises(KeyError, self.users.getUser, 'foo!bar@quux.com')
+        u.addHostmask('*!*@quux.com')
+        self.assertEqual(self.users.getUser('foo!bar@quux.com'), u)
+        u.removeHostmask('foo!bar@baz.domain.com')
+        self.assertRaises(KeyError, self.users.getUser,
+                          'foo!bar@baz.domain.com')
+        u.addAuth('foo!bar@elsewhere')
+        self.assertEqual(self.users.getUser('foo!bar@elsewhere'), u)
+        u.clearAuth()
+        self.assertRaises(KeyError, self.users.getUser, 'foo!bar@elsewhere')
+        self.users.delUser(u.id)
+        u.addHostmask('foo!bar@baz.domain.com')
+        self.assertRaises(KeyError, self.users.getUser,
+                          'foo!bar@baz.domain.com')
 
 
 class CheckCapabilityTestCase(IrcdbTestCase):
@@ -540,6 +618,23 @@ class CheckCapabilityTestCase(IrcdbTestCase):
         self.channelnothing.defaultAllow = not self.channelnothing.defaultAllow
         self.failUnless(self.checkCapability(self.nothing, self.chancap))
 
+    def testCacheIsInvalidated(self):
+        cache = ircdb.capabilityCache
+        self.failUnless(self.checkCapability(self.justfoo, 'bar'))
+        hits = cache.hits
+        self.failUnless(self.checkCapability(self.justfoo, 'bar'))
+        self.assertEqual(cache.hits, hits + 1)
+        u = self.users.getUser('justfoo')
+        u.addCapability('-bar')
+        self.failIf(self.checkCapability(self.justfoo, 'bar'))
+        u.removeCapability('-bar')
+        self.users.setUser(u)
+        self.failUnless(self.checkCapability(self.justfoo, 'bar'))
+        c = self.channels.getChannel(self.channel)
+        self.failUnless(self.checkCapability(self.nothing, '#channel,bar'))
+        c.addCapability('-bar')
+        self.failIf(self.checkCapability(self.nothing, '#channel,bar'))
+
     def testAntiChanFoo(self):
         self.channels.setChannel(self.channel, self.channelnothing)
         self.failIf(self.checkCapability(self.antichanfoo, self.chancap))
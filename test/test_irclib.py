@@ -149,6 +149,8 @@ class IrcMsgQueueTestCase(SupyTestCase):
             q.enqueue(self.msg)
             self.assertEqual(self.msg, q.dequeue())
             self.failIf(q)
+            self.failIf(self.msg in q)
+            self.failUnless(q.enqueue(self.msg))
         finally:
             configVar.setValue(original)
 
@@ -163,6 +165,39 @@ class IrcMsgQueueTestCase(SupyTestCase):
 ##         self.assertEqual(self.join, q.dequeue())
 ##         self.assertEqual(self.who, q.dequeue())
 
+    def testTargetsTakeTurns(self):
+        q = irclib.IrcMsgQueue()
+        foos = [ircmsgs.privmsg('#foo', str(i)) for i in range(3)]
+        bars = [ircmsgs.privmsg('#BAR', str(i)) for i in range(2)]
+        for msg in foos + bars:
+            q.enqueue(msg)
+        q.enqueue(ircmsgs.privmsg('#bar', '2'))
+        self.assertEqual(q.dequeue(), foos[0])
+        self.assertEqual(q.dequeue(), bars[0])
+        self.assertEqual(q.dequeue(), foos[1])
+        self.assertEqual(q.dequeue(), bars[1])
+        self.assertEqual(q.dequeue(), foos[2])
+        self.assertEqual(q.dequeue(), ircmsgs.privmsg('#bar', '2'))
+        self.failIf(q)
+
+    def testJoinRateLimitDoesntHoldUpOthers(self):
+        configVar = conf.supybot.protocols.irc.queuing.rateLimit.join
+        original = configVar()
+        try:
+            configVar.setValue(100)
+            q = irclib.IrcMsgQueue()
+            q.enqueue(self.join)
+            q.enqueue(ircmsgs.join('#bar'))
+            q.enqueue(self.notice)
+            self.assertEqual(q.dequeue(), self.join)
+            self.assertEqual(q.dequeue(), self.notice)
+            self.assertEqual(q.dequeue(), None)
+            self.failUnless(q.nextDequeueTime() > time.time())
+            self.assertEqual(len(q), 1)
+            self.failUnless(ircmsgs.join('#bar') in q)
+        finally:
+            configVar.setValue(original)
+
     def testTopicBeforePrivmsg(self):
         q = irclib.IrcMsgQueue()
         q.enqueue(self.msg)
@@ -201,6 +236,36 @@ class ChannelStateTestCase(SupyTestCase):
         self.failIf('jemfinch' in c.users)
         self.failUnless('jemfinch' in c1.users)
 
+    def testCopyOnWrite(self):
+        c = irclib.ChannelState()
+        c.addUser('@jemfinch')
+        c.addUser('foo')
+        c1 = c.copy()
+        self.assertEqual(c, c1)
+        c.removeUser('jemfinch')
+        c1.replaceUser('foo', 'bar')
+        self.failIf('jemfinch' in c.users)
+        self.failUnless('JEMFINCH' in c1.ops)
+        self.failUnless('foo' in c.users)
+        self.failIf('bar' in c.users)
+        self.failIf('foo' in c1.users)
+        self.assertEqual(sorted(c1.users), ['bar', 'jemfinch'])
+        self.assertEqual((len(c.users), len(c.ops)), (1, 0))
+        self.assertEqual((len(c1.users), len(c1.ops)), (2, 1))
+
+    def testStatusWithoutMembership(self):
+        c = irclib.ChannelState()
+        c.ops.add('foo')
+        self.failUnless('foo' in c.ops)
+        self.failIf('foo' in c.users)
+        c.addUser('+foo')
+        self.failUnless(c.isOp('foo') and c.isVoice('foo'))
+        c.voices.discard('FOO')
+        self.failIf(c.isVoice('foo'))
+        c.removeUser('foo')
+        self.failIf(c.users or c.ops)
+        self.assertRaises(KeyError, c.ops.remove, 'foo')
+
     def testAddUser(self):
         c = irclib.ChannelState()
         c.addUser('foo')
@@ -225,6 +290,42 @@ class ChannelStateTestCase(SupyTestCase):
         self.failIf('quuz' in c.voices)
 
 
+class MessageHistoryTestCase(SupyTestCase):
+    def testSearch(self):
+        h = irclib.MessageHistory(4)
+        m1 = ircmsgs.privmsg('#foo', 'hello world', prefix='bar!u@h')
+        m2 = ircmsgs.privmsg('#bar', 'Hello there', prefix='baz!u@h')
+        m3 = ircmsgs.privmsg('#FOO', 'goodbye', prefix='baz!u@h')
+        for m in (m1, m2, m3):
+            h.append(m)
+        self.assertEqual(list(h.search('#foo')), [m3, m1])
+        self.assertEqual(list(h.search(nick='BAZ')), [m3, m2])
+        self.assertEqual(list(h.search(nick='ba*')), [m3, m2, m1])
+        self.assertEqual(list(h.search(texts=['ELL'])), [m2, m1])
+        self.assertEqual(list(h.search('#bar', texts=['ello'])), [m2])
+        self.assertEqual(list(h.search(texts=['o w'])), [m3, m2, m1])
+        self.assertEqual(list(h.search()), [m3, m2, m1])
+        self.assertEqual(list(h.search(nick='qux')), [])
+
+    def testEviction(self):
+        h = irclib.MessageHistory(2)
+        msgs = [ircmsgs.privmsg('#foo', 'message %s' % i, prefix='bar!u@h')
+                for i in range(5)]
+        for m in msgs:
+            h.append(m)
+        self.assertEqual(list(h.search('#foo', 'bar', ['message'])),
+                         [msgs[4], msgs[3]])
+        self.assertEqual(len(h.channels['#foo']), 2)
+        h.resize(3)
+        h.append(msgs[0])
+        self.assertEqual(list(h.search('#foo')), [msgs[0], msgs[4], msgs[3]])
+        h1 = pickle.loads(pickle.dumps(h))
+        self.assertEqual(h, h1)
+        self.assertEqual(list(h1.search('#foo')), list(h.search('#foo')))
+        h.reset()
+        self.failIf(h.channels or h.nicks or h.words)
+
+
 class IrcStateTestCase(SupyTestCase):
     class FakeIrc:
         nick = 'nick'
@@ -257,6 +358,32 @@ class IrcStateTestCase(SupyTestCase):
         self.failUnless('baz' in st.channels['#foo'].users)
         self.failUnless(st.channels['#foo'].isOp('baz'))
 
+    def testPreviousChannels(self):
+        st = irclib.IrcState()
+        for channel in ('#foo', '#bar', '#baz'):
+            st.channels[channel] = irclib.ChannelState()
+            st.channels[channel].addUser('bar')
+        st.channels['#baz'].removeUser('bar')
+        m = ircmsgs.IrcMsg(':bar!asfd@asdf.com NICK baz')
+        st.addMsg(self.irc, m)
+        self.assertEqual(sorted(st.previousChannels(m)), ['#bar', '#foo'])
+        m = ircmsgs.IrcMsg(':baz!asfd@asdf.com PART #FOO,#baz')
+        st.addMsg(self.irc, m)
+        self.assertEqual(list(st.previousChannels(m)), ['#FOO'])
+        m = ircmsgs.kick('#bar', 'baz', prefix=self.irc.prefix)
+        st.addMsg(self.irc, m)
+        self.assertEqual(list(st.previousChannels(m)), ['#bar'])
+        st.channels['#foo'].addUser('qux')
+        st.channels['#bar'].addUser('qux')
+        m = ircmsgs.quit(prefix='qux!asfd@asdf.com')
+        st.addMsg(self.irc, m)
+        self.failIf('qux' in st.channels['#foo'].users)
+        self.assertEqual(sorted(st.previousChannels(m)), ['#bar', '#foo'])
+        st.channels['#foo'].addUser('qux')
+        m = ircmsgs.IrcMsg(':qux!asfd@asdf.com TOPIC #foo :hi')
+        st.addMsg(self.irc, m)
+        self.assertEqual(list(st.previousChannels(m)), ['#foo'])
+
     def testHistory(self):
         if len(msgs) < 10:
             return
@@ -378,6 +505,61 @@ class IrcStateTestCase(SupyTestCase):
         self.assert_(st.addMsg(self.irc, ircmsgs.IrcMsg('MODE foo +i')) or 1)
 
 
+class FloodControlTestCase(SupyTestCase):
+    msg = ircmsgs.privmsg('#foo', 'hey, you')
+    def setUp(self):
+        SupyTestCase.setUp(self)
+        self.throttleTime = conf.supybot.networks.test.throttleTime
+        self.burst = conf.supybot.networks.test.throttleTime.burst
+        self.throttleTime.setValue(2.0)
+        self.burst.setValue(10.0)
+
+    def tearDown(self):
+        self.throttleTime.setValue(-1.0)
+        self.burst.setValue(-1.0)
+        SupyTestCase.tearDown(self)
+
+    def testBurst(self):
+        fc = irclib.FloodControl('test')
+        now = 1000.0
+        sent = 0
+        while fc.ready(now):
+            fc.sent(self.msg, now)
+            sent += 1
+        self.assertEqual(sent, 6)
+        self.failIf(fc.ready(now + 1.9))
+        self.failUnless(fc.ready(now + 2))
+        self.assertEqual(fc.nextSendTime(), now + 2)
+
+    def testSteadyState(self):
+        fc = irclib.FloodControl('test')
+        now = 1000.0
+        times = []
+        while len(times) < 30:
+            if fc.ready(now):
+                fc.sent(self.msg, now)
+                times.append(now)
+            now += 0.5
+        times = times[-10:]
+        for (before, after) in zip(times, times[1:]):
+            self.assertEqual(after - before, 2.0)
+
+    def testGlobalFallback(self):
+        self.throttleTime.setValue(-1.0)
+        self.burst.setValue(-1.0)
+        self.assertEqual(irclib.FloodControl('test').settings(),
+                         (conf.supybot.protocols.irc.throttleTime(),
+                          conf.supybot.protocols.irc.throttleTime.burst()))
+
+    def testNoPenalty(self):
+        self.throttleTime.setValue(0.0)
+        self.burst.setValue(0.0)
+        fc = irclib.FloodControl('test')
+        for i in range(100):
+            self.failUnless(fc.ready(1000.0))
+            fc.sent(self.msg, 1000.0)
+
+
 class IrcTestCase(SupyTestCase):
     def setUp(self):
         self.irc = irclib.Irc('test')
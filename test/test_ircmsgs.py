@@ -117,6 +117,33 @@ class IrcMsgTestCase(SupyTestCase):
         self.assertRaises(ircmsgs.MalformedIrcMsg, ircmsgs.IrcMsg,
                           args=('biff',), prefix='foo!bar@baz')
 
+    def testHostmaskAttributes(self):
+        m = ircmsgs.IrcMsg(':foo!bar@baz.qux PRIVMSG #foo :bar baz')
+        self.assertEqual(m.host, 'baz.qux')
+        self.assertEqual(m.nick, 'foo')
+        self.assertEqual(m.user, 'bar')
+        m = ircmsgs.IrcMsg(':irc.foo.net 001 foo :Welcome')
+        self.assertEqual(m.nick, 'irc.foo.net')
+        self.assertEqual(m.user, 'irc.foo.net')
+        self.assertEqual(m.host, 'irc.foo.net')
+        m = ircmsgs.IrcMsg(prefix='foo!bar@baz', msg=m)
+        self.assertEqual((m.nick, m.user, m.host), ('foo', 'bar', 'baz'))
+        m = ircmsgs.privmsg('#foo', 'bar')
+        self.assertEqual((m.nick, m.user, m.host), ('', '', ''))
+
+    def testArgs(self):
+        m = ircmsgs.IrcMsg(':foo!bar@baz PRIVMSG #foo :bar :baz qux ')
+        self.assertEqual(m.command, 'PRIVMSG')
+        self.assertEqual(m.args, ('#foo', 'bar :baz qux '))
+        m = ircmsgs.IrcMsg('MODE #foo +b foo!bar@baz\r\n')
+        self.assertEqual(m.args, ('#foo', '+b', 'foo!bar@baz'))
+        m = ircmsgs.IrcMsg('PING')
+        self.assertEqual(m.command, 'PING')
+        self.assertEqual(m.args, ())
+        m = ircmsgs.IrcMsg(':irc.foo.net 005 foo a=1 :are supported')
+        self.assertEqual(m.args, ('foo', 'a=1', 'are supported'))
+        self.assertEqual(type(m.args), tuple)
+
     def testTags(self):
         m = ircmsgs.privmsg('foo', 'bar')
         self.failIf(m.repliedTo)
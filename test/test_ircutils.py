@@ -364,6 +364,47 @@ class IrcSetTestCase(SupyTestCase):
         self.failIf('FOo' in s1)
 
 
+class HostmaskDictTestCase(SupyTestCase):
+    patterns = ['foo!bar@baz', '*!*@baz', '*!*@*.rr.com', 'foo!*@*',
+                '*!*@10.0.0.*', '*!*@*', 'FOO[]!*@*', '*!~supy?ot@*',
+                '*!*bar@*', 'jamessan|*!*@*.rcn.com', '*foo*']
+    def testMatchesLikeHostmaskPatternEqual(self):
+        d = ircutils.HostmaskDict()
+        for pattern in self.patterns:
+            d[pattern] = None
+        hostmasks = [msg.prefix for msg in msgs
+                     if msg.prefix and ircutils.isUserHostmask(msg.prefix)]
+        hostmasks += ['foo!bar@baz', 'FOO!BAR@BAZ', 'foo{}!x@10.0.0.1',
+                      'bar!~supybot@dhcp.columbus.rr.com', 'a!b@c@10.0.0.3',
+                      'JAMESSAN\\away!~j@1.c3-0.cable.RCN.com']
+        for hostmask in hostmasks:
+            expected = [pattern for pattern in self.patterns
+                        if ircutils.hostmaskPatternEqual(pattern, hostmask)]
+            self.assertEqual(sorted(d.matches(hostmask)), sorted(expected))
+            self.assertEqual(d.match(hostmask), bool(expected))
+
+    def testRemove(self):
+        d = ircutils.HostmaskDict({'*!*@baz': 1, '*!*@*.baz': 2})
+        self.failUnless(d.match('foo!bar@baz'))
+        self.assertEqual(d.pop('*!*@baz'), 1)
+        self.failIf(d.match('foo!bar@baz'))
+        self.failUnless(d.match('foo!bar@quux.baz'))
+        del d['*!*@*.baz']
+        self.failIf(d.match('foo!bar@quux.baz'))
+        self.failIf(d)
+        d.update({'*!*@*': 3})
+        self.failUnless(d.match('foo!bar@baz'))
+        d.clear()
+        self.failIf(d.match('foo!bar@baz'))
+
+    def testCopy(self):
+        d = ircutils.HostmaskDict({'*!*@baz': 1})
+        d1 = copy.deepcopy(d)
+        del d['*!*@baz']
+        self.failUnless(d1.match('foo!bar@baz'))
+        self.assertEqual(d1.matches('foo!bar@baz'), ['*!*@baz'])
+
+
 class IrcStringTestCase(SupyTestCase):
     def testEquality(self):
         self.assertEqual('#foo', ircutils.IrcString('#foo'))
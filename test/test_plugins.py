@@ -30,5 +30,253 @@
 
 from supybot.test import *
 
+import supybot.world as world
 import supybot.irclib as irclib
 import supybot.plugins as plugins
+
+import os
+import threading
+
+try:
+    import sqlite3
+except ImportError:
+    from pysqlite2 import dbapi2 as sqlite3 # for python2.4
+
+class ChannelUserDBTestCase(SupyTestCase):
+    class DB(plugins.ChannelUserDB):
+        def serialize(self, v):
+            return [v]
+
+        def deserialize(self, channel, id, L):
+            return L[0]
+
+    def setUp(self):
+        SupyTestCase.setUp(self)
+        self.filename = os.path.join(conf.supybot.directories.data(),
+                                     'ChannelUserDBTest.db')
+        for filename in [self.filename, self.filename + '.journal']:
+            if os.path.exists(filename):
+                os.remove(filename)
+
+    def lines(self, filename):
+        if not os.path.exists(filename):
+            return 0
+        fd = file(filename)
+        try:
+            return len([line for line in fd
+                        if not line.startswith(self.DB.generationTag)])
+        finally:
+            fd.close()
+
+    def testJournal(self):
+        db = self.DB(self.filename)
+        for i in range(10):
+            db['#foo', i] = str(i)
+        db.flush()
+        self.assertEqual(self.lines(self.filename), 10)
+        self.assertEqual(self.lines(self.filename + '.journal'), 0)
+        db['#foo', 1] = 'bar'
+        del db['#foo', 2]
+        db['#bar', 'baz'] = 'qux'
+        db.flush()
+        self.assertEqual(self.lines(self.filename), 10)
+        self.assertEqual(self.lines(self.filename + '.journal'), 3)
+        db.flush()
+        self.assertEqual(self.lines(self.filename + '.journal'), 3)
+        db = self.DB(self.filename)
+        self.assertEqual(db['#foo', 1], 'bar')
+        self.failIf(('#foo', 2) in db)
+        self.assertEqual(db['#bar', 'baz'], 'qux')
+        self.assertEqual(len(db.keys()), 10)
+
+    def testRewrite(self):
+        db = self.DB(self.filename)
+        for i in range(10):
+            db['#foo', i] = str(i)
+        db.flush()
+        for i in range(5):
+            db['#foo', i] = 'x'
+            db.flush()
+        self.assertEqual(self.lines(self.filename + '.journal'), 5)
+        self.assertEqual(self.lines(self.filename), 10)
+        db['#foo', 0] = 'y'
+        db.flush()
+        self.assertEqual(self.lines(self.filename + '.journal'), 0)
+        db.close()
+        db = self.DB(self.filename)
+        self.assertEqual(db['#foo', 0], 'y')
+        self.assertEqual(db['#foo', 4], 'x')
+        self.assertEqual(db['#foo', 5], '5')
+
+    def testStaleJournalIsIgnored(self):
+        db = self.DB(self.filename)
+        for i in range(10):
+            db['#foo', i] = str(i)
+        db.flush()
+        db['#foo', 0] = 'x'
+        db.flush()
+        fd = file(self.filename + '.journal')
+        journal = fd.read()
+        fd.close()
+        for i in range(5):
+            db['#foo', i] = 'y'
+            db.flush()
+        self.assertEqual(self.lines(self.filename + '.journal'), 0)
+        # As if we died between writing the file and removing the journal.
+        fd = file(self.filename + '.journal', 'w')
+        fd.write(journal)
+        fd.close()
+        db = self.DB(self.filename)
+        self.assertEqual(db['#foo', 0], 'y')
+        self.failIf(os.path.exists(self.filename + '.journal'))
+        db['#foo', 1] = 'z'
+        db.flush()
+        db = self.DB(self.filename)
+        self.assertEqual(db['#foo', 0], 'y')
+        self.assertEqual(db['#foo', 1], 'z')
+
+class SqliteDBTestCase(SupyTestCase):
+    def setUp(self):
+        SupyTestCase.setUp(self)
+        self.filename = os.path.join(conf.supybot.directories.data(),
+                                     'SqliteDBTest.db')
+        for suffix in ['', '-wal', '-shm']:
+            if os.path.exists(self.filename + suffix):
+                os.remove(self.filename + suffix)
+        self.db = plugins.SqliteDB(create=self.create)
+
+    def tearDown(self):
+        self.db.close()
+        SupyTestCase.tearDown(self)
+
+    def create(self, db):
+        db.execute("""CREATE TABLE counts (name TEXT PRIMARY KEY,
+                                           n INTEGER)""")
+
+    def count(self, name):
+        db = self.db.connect(self.filename)
+        cursor = db.execute("SELECT n FROM counts WHERE name=?", (name,))
+        return cursor.fetchone()[0]
+
+    def testConnectionIsReused(self):
+        db = self.db.connect(self.filename)
+        self.failUnless(db is self.db.connect(self.filename))
+        cursor = db.execute('PRAGMA journal_mode')
+        self.assertEqual(cursor.fetchone()[0].lower(), 'wal')
+
+    def testIncrementsAreCoalesced(self):
+        sql = "UPDATE counts SET n=n+? WHERE name=?"
+        self.db.later(self.filename,
+                      "INSERT INTO counts VALUES (?, 0)", ('foo',))
+        for i in range(5):
+            self.db.increment(self.filename, sql, 'foo')
+        self.db.increment(self.filename, sql, 'foo', 3)
+        (statements, _) = self.db.pending[self.filename]
+        self.assertEqual(len(statements), 2)
+        self.assertEqual(self.count('foo'), 8)
+        self.failIf(self.db.pending)
+
+    def testFlush(self):
+        self.db.connect(self.filename).execute(
+            "INSERT INTO counts VALUES ('foo', 0)")
+        self.db.increment(self.filename,
+                          "UPDATE counts SET n=n+? WHERE name=?", 'foo')
+        self.failUnless(self.db.flush in world.flushers)
+        world.flush()
+        self.failIf(self.db.pending)
+        self.assertEqual(self.count('foo'), 1)
+        self.db.close()
+        self.failIf(self.db.flush in world.flushers)
+
+    def testAutocommitConnection(self):
+        db = self.db.connect(self.filename)
+        db.isolation_level = None
+        self.db.later(self.filename,
+                      "INSERT INTO counts VALUES (?, 1)", ('foo',))
+        self.db.later(self.filename,
+                      "INSERT INTO counts VALUES (?, 1)", ('foo',))
+        self.db.later(self.filename,
+                      "INSERT INTO counts VALUES (?, 1)", ('bar',))
+        self.failUnless(self.db.connect(self.filename) is db)
+        cursor = db.execute("SELECT COUNT(*) FROM counts")
+        self.assertEqual(cursor.fetchone()[0], 2)
+
+    def testFailedBatchIsKept(self):
+        db = self.db.connect(self.filename)
+        self.db.increment(self.filename,
+                          "UPDATE others SET n=n+? WHERE name=?", 'foo')
+        self.db.later(self.filename,
+                      "INSERT INTO counts VALUES (?, 1)", ('foo',))
+        self.db.connect(self.filename)
+        self.failUnless(self.filename in self.db.pending)
+        db.execute("CREATE TABLE others (name TEXT PRIMARY KEY, n INTEGER)")
+        db.execute("INSERT INTO others VALUES ('foo', 0)")
+        db.commit()
+        self.db.connect(self.filename)
+        self.failIf(self.db.pending)
+        self.assertEqual(self.count('foo'), 1)
+        cursor = db.execute("SELECT n FROM others")
+        self.assertEqual(cursor.fetchone()[0], 1)
+
+    def testCloseClosesEveryThread(self):
+        dbs = []
+        t = threading.Thread(
+            target=lambda: dbs.append(self.db.connect(self.filename)))
+        t.start()
+        t.join()
+        self.db.close()
+        self.assertRaises(sqlite3.ProgrammingError,
+                          dbs[0].execute, "SELECT 1")
+
+class SqliteTrigramIndexTestCase(SupyTestCase):
+    def setUp(self):
+        SupyTestCase.setUp(self)
+        self.index = plugins.SqliteTrigramIndex('texts', 'text')
+        self.db = sqlite3.connect(':memory:')
+        self.db.execute("""CREATE TABLE texts (id INTEGER PRIMARY KEY,
+                                               text TEXT)""")
+
+    def tearDown(self):
+        self.db.close()
+        SupyTestCase.tearDown(self)
+
+    def add(self, text):
+        cursor = self.db.cursor()
+        cursor.execute("INSERT INTO texts VALUES (NULL, ?)", (text,))
+        self.index.add(cursor, cursor.lastrowid, text)
+
+    def select(self, where):
+        (sql, args) = where
+        cursor = self.db.execute("SELECT id FROM texts WHERE %s" % sql, args)
+        return sorted([id for (id,) in cursor.fetchall()])
+
+    def testSearch(self):
+        self.index.create(self.db.cursor())
+        self.add('The quick brown fox')
+        self.add('jumped over the lazy dog')
+        self.add('QUICKLY')
+        self.assertEqual(self.select(self.index.containing('quick')), [1, 3])
+        self.assertEqual(self.select(self.index.containing('the')), [1, 2])
+        self.assertEqual(self.select(self.index.containing('cat')), [])
+        self.assertEqual(self.index.containing('ox'), None)
+        trigrams = self.index.trigrams('quickest')
+        self.assertEqual(self.select(self.index.sharing(trigrams, 3)), [1, 3])
+        self.assertEqual(self.index.sharing(trigrams, 6), None)
+        self.index.remove(self.db.cursor(), 3)
+        self.assertEqual(self.select(self.index.containing('quick')), [1])
+
+    def testPrepare(self):
+        self.db.execute("INSERT INTO texts VALUES (NULL, 'foobar')")
+        self.index.prepare(self.db)
+        self.assertEqual(self.select(self.index.containing('oba')), [1])
+        self.index.prepare(self.db)
+        cursor = self.db.execute("SELECT COUNT(*) FROM text_trigrams")
+        self.assertEqual(cursor.fetchone()[0], 4)
+
+    def testPadded(self):
+        index = plugins.SqliteTrigramIndex('texts', 'text', padded=True)
+        self.assertEqual(index.trigrams('Ab'), set(['  a', ' ab', 'ab ']))
+        self.assertEqual(self.index.trigrams('Ab'), set())
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
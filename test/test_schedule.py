@@ -73,6 +73,64 @@ class TestSchedule(SupyTestCase):
         sched.run()
         self.assertEqual(i[0], 1)
 
+    def testRescheduleEarlier(self):
+        sched = schedule.Schedule()
+        i = [0]
+        def inc():
+            i[0] += 1
+        n = sched.addEvent(inc, time.time() + 10)
+        sched.rescheduleEvent(n, time.time() - 1)
+        sched.run()
+        self.assertEqual(i[0], 1)
+        self.assertRaises(KeyError, sched.rescheduleEvent, n, time.time())
+        self.assertRaises(KeyError, sched.removeEvent, n)
+
+    def testRemovedEventsDontRun(self):
+        sched = schedule.Schedule()
+        ran = []
+        now = time.time()
+        names = [sched.addEvent(lambda i=i: ran.append(i), now - 1 + i/1000.0)
+                 for i in range(1000)]
+        for name in names[:900]:
+            sched.removeEvent(name)
+        # Dead entries are thrown out once they outnumber the live ones.
+        self.failUnless(len(sched.schedule) < 200)
+        sched.run()
+        self.assertEqual(ran, range(900, 1000))
+        self.assertEqual(sched.nextEventTime(), None)
+        self.assertEqual(sched.schedule, [])
+
+    def testRunReturnsTimeUntilNextEvent(self):
+        sched = schedule.Schedule()
+        self.assertEqual(sched.run(), None)
+        sched.addEvent(lambda: None, time.time() + 10)
+        self.failUnless(9 < sched.run() <= 10)
+
+    def testPeriodicEvent(self):
+        sched = schedule.Schedule()
+        i = [0]
+        def inc():
+            i[0] += 1
+        sched.addPeriodicEvent(inc, 0.5, 'inc', now=False)
+        time.sleep(0.6)
+        sched.run()
+        self.assertEqual(i[0], 1)
+        self.failUnless('inc' in sched.events)
+        sched.removePeriodicEvent('inc')
+        time.sleep(0.6)
+        sched.run()
+        self.assertEqual(i[0], 1)
+
+    def testNextEventTime(self):
+        sched = schedule.Schedule()
+        self.assertEqual(sched.nextEventTime(), None)
+        now = time.time()
+        sched.addEvent(lambda: None, now + 10)
+        n = sched.addEvent(lambda: None, now + 5)
+        self.assertEqual(sched.nextEventTime(), now + 5)
+        sched.removeEvent(n)
+        self.assertEqual(sched.nextEventTime(), now + 10)
+
 
 # vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
 
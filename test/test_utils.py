@@ -74,6 +74,10 @@ class GenTest(SupyTestCase):
         self.assertEqual(d.keys(), ['Foo'])
         self.assertEqual(d.get('foo'), 10)
         self.assertEqual(d.get('Foo'), 10)
+        d1 = d.copy()
+        d1['FOO'] = 20
+        self.assertEqual(d['foo'], 10)
+        self.assertEqual(d1.keys(), ['FOO'])
 
     def testFindBinaryInPath(self):
         if os.name == 'posix':
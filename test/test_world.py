@@ -0,0 +1,88 @@
+###
+# Copyright (c) 2002-2005, Jeremiah Fincher
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+###
+
+
+from supybot.test import *
+
+import threading
+
+import supybot.world as world
+
+class FlushTestCase(SupyTestCase):
+    def setUp(self):
+        SupyTestCase.setUp(self)
+        self.written = []
+        self.release = threading.Event()
+        self.originalFlushers = world.flushers[:]
+        world.flushers[:] = [self.flusher]
+
+    def tearDown(self):
+        self.release.set()
+        world.flush()
+        world.flushers[:] = self.originalFlushers
+        SupyTestCase.tearDown(self)
+
+    def flusher(self):
+        n = len(self.written)
+        def write():
+            self.release.wait()
+            self.written.append((n, threading.currentThread()))
+        world.write(write)
+
+    def testFlushWaits(self):
+        self.release.set()
+        world.flush()
+        self.assertEqual(len(self.written), 1)
+        self.failIf(self.written[0][1] is threading.currentThread())
+        stats = world.flushStats['FlushTestCase.flusher']
+        self.failUnless(stats.calls >= 1)
+
+    def testFlushInBackground(self):
+        world.flushInBackground()
+        self.assertEqual(self.written, [])
+        # The first write hasn't finished, so this one is skipped.
+        world.flushInBackground()
+        stats = world.flushStats['FlushTestCase.flusher']
+        self.assertEqual(stats.skipped, 1)
+        self.release.set()
+        world.flush()
+        # The second write may or may not see the first one as written.
+        self.assertEqual(len(self.written), 2)
+        self.assertEqual(self.written[0][0], 0)
+
+    def testIsBackgroundFlush(self):
+        seen = []
+        world.flushers[:] = [lambda: seen.append(world.isBackgroundFlush())]
+        world.flush()
+        world.flushInBackground()
+        self.assertEqual(seen, [False, True])
+        self.failIf(world.isBackgroundFlush())
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79: